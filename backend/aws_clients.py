@@ -0,0 +1,70 @@
+import os
+import threading
+
+# לקוחות boto3 נוצרים פעם אחת לכל קונטיינר ומשותפים בין הרצות "חמות" של הלמבדה -
+# כך נשמרים ה-Connection Pool של ה-HTTP, פתרון ה-Endpoint וה-Credentials
+# Bedrock קבוע ל-us-east-1 (ה-inference profile של המודל), גם אם הלמבדה רצה באזור אחר
+BEDROCK_REGION = os.getenv("BEDROCK_REGION", "us-east-1")
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv("AWS_MAX_POOL_CONNECTIONS", "20"))
+AWS_CONNECT_TIMEOUT = float(os.getenv("AWS_CONNECT_TIMEOUT", "3"))
+AWS_MAX_ATTEMPTS = int(os.getenv("AWS_MAX_ATTEMPTS", "4"))
+S3_READ_TIMEOUT = float(os.getenv("S3_READ_TIMEOUT", "20"))
+BEDROCK_READ_TIMEOUT = float(os.getenv("BEDROCK_READ_TIMEOUT", "120"))  # ניתוח תמונה יכול לקחת עשרות שניות
+
+_clients = {}
+_lock = threading.Lock()
+_stats = {"created": {}, "reused": {}}
+
+
+def _client_config(read_timeout):
+    from botocore.config import Config
+    return Config(
+        max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+        connect_timeout=AWS_CONNECT_TIMEOUT,
+        read_timeout=read_timeout,
+        tcp_keepalive=True,
+        retries={"mode": "adaptive", "max_attempts": AWS_MAX_ATTEMPTS},
+    )
+
+
+def get_client(service_name, region_name=None, read_timeout=S3_READ_TIMEOUT):
+    """מחזיר לקוח boto3 משותף לשירות (נוצר ב-thread-safe בשימוש הראשון), או None אם היצירה נכשלה"""
+    key = (service_name, region_name)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                # boto3 נטען רק כאן ולא ב-import של המודול (Cold Start)
+                try:
+                    import boto3
+                    client = boto3.client(service_name, region_name=region_name, config=_client_config(read_timeout))
+                except Exception as e:
+                    print(f"Error connecting to AWS ({service_name}): {e}")
+                    return None
+                _clients[key] = client
+                _stats["created"][service_name] = _stats["created"].get(service_name, 0) + 1
+                return client
+    _stats["reused"][service_name] = _stats["reused"].get(service_name, 0) + 1
+    return client
+
+
+def get_bedrock_client():
+    return get_client("bedrock-runtime", region_name=BEDROCK_REGION, read_timeout=BEDROCK_READ_TIMEOUT)
+
+
+def get_s3_client():
+    return get_client("s3")
+
+
+def get_client_stats():
+    """כמה לקוחות נוצרו וכמה פעמים נעשה שימוש חוזר - אמור להיות 1 יצירה לשירות לכל קונטיינר"""
+    with _lock:
+        return {"created": dict(_stats["created"]), "reused": dict(_stats["reused"])}
+
+
+def reset_clients():
+    with _lock:
+        _clients.clear()
+        _stats["created"].clear()
+        _stats["reused"].clear()
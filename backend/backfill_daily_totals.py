@@ -0,0 +1,58 @@
+"""
+מילוי (או בנייה מחדש) של daily_nutrient_totals מתוך ההיסטוריה ב-consumed_micros.
+הפקודה אידמפוטנטית - הסכום לכל (משתמש, יום, nutrient_id) מחושב מחדש ודורס את הקיים.
+רק שורות שזוהו במילון הרכיבים (nutrient_id לא ריק) נספרות.
+
+    cd backend
+    python backfill_daily_totals.py                 # כל המשתמשים
+    python backfill_daily_totals.py --user-id 3     # משתמש אחד
+    python backfill_daily_totals.py --since 2024-01-01
+"""
+import argparse
+
+from db_handler import db_connection
+
+BACKFILL_QUERY = """
+    INSERT INTO daily_nutrient_totals (user_id, day, nutrient_id, amount)
+    SELECT m.user_id, m.created_at::date, cm.nutrient_id, SUM(cm.amount)
+    FROM consumed_micros cm
+    JOIN food_items fi ON cm.item_id = fi.item_id
+    JOIN meals m ON fi.meal_id = m.meal_id
+    WHERE cm.nutrient_id IS NOT NULL AND {filters}
+    GROUP BY m.user_id, m.created_at::date, cm.nutrient_id
+    ORDER BY m.user_id, m.created_at::date, cm.nutrient_id  -- אותו סדר נעילה כמו בשמירת ארוחה
+    ON CONFLICT (user_id, day, nutrient_id)
+    DO UPDATE SET amount = EXCLUDED.amount;
+"""
+
+def backfill(user_id=None, since=None):
+    filters = ["TRUE"]
+    params = []
+    if user_id is not None:
+        filters.append("m.user_id = %s")
+        params.append(user_id)
+    if since is not None:
+        filters.append("m.created_at >= %s")
+        params.append(since)
+
+    with db_connection() as conn:
+        if not conn:
+            print("❌ No DB connection")
+            return 0
+        try:
+            cur = conn.cursor()
+            cur.execute(BACKFILL_QUERY.format(filters=" AND ".join(filters)), params)
+            conn.commit()
+            print(f"✅ daily_nutrient_totals: {cur.rowcount} rows written")
+            return cur.rowcount
+        except Exception as e:
+            print(f"❌ Backfill failed: {e}")
+            conn.rollback()
+            return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill daily_nutrient_totals from meal history")
+    parser.add_argument("--user-id", type=int)
+    parser.add_argument("--since", help="YYYY-MM-DD")
+    args = parser.parse_args()
+    backfill(args.user_id, args.since)
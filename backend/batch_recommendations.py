@@ -0,0 +1,178 @@
+"""
+חישוב לילי של החוסרים וההמלצות לכל המשתמשים הפעילים, ושמירה ב-user_recommendations -
+כך ש-/recommendations/{user_id} הוא חיפוש לפי מפתח במקום שתי שאילתות ולולאת המלצה לכל בקשה.
+
+החוסרים של כל המשתמשים מגיעים משאילתה אחת (פרופיל x יעדים x סיכום יומי), והניקוד רץ על מטריצת
+משתמשים x רכיבים מול מאכלים x רכיבים (batch_greedy_recommend), בחלקים ואופציונלית על כמה תהליכים.
+
+    cd backend
+    python batch_recommendations.py                        # היום, משתמשים עם ארוחה ב-30 הימים האחרונים
+    python batch_recommendations.py --workers 4 --chunk-size 2000
+    python batch_recommendations.py --day 2024-05-01 --active-days 7   # לא דורס תוצאה שמורה של יום מאוחר יותר
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+from db_handler import db_connection
+from recommender_engine import food_catalog_cache, batch_greedy_recommend
+from reference_data import STANDARDS_ORDER
+
+BATCH_ACTIVE_DAYS = int(os.getenv("BATCH_ACTIVE_DAYS", "30"))  # "פעיל" = שמר ארוחה בימים האלה
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "2000"))  # משתמשים למטריצה אחת (זיכרון: chunk x מאכלים)
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "1"))
+BATCH_WRITE_PAGE_SIZE = 5000
+
+# אותו פרופיל, אותם יעדים ואותו סיכום יומי כמו get_deficiency_amounts - לכל המשתמשים בשאילתה אחת.
+# השורות עם food_column ריק רק מסמנות משתמש פעיל (גם בלי חוסרים - כדי שגם הוא יקבל תוצאה שמורה).
+# כמה שורות תקן לאותו רכיב: נבחרת האחרונה בסדר של STANDARDS_ORDER, כמו בלולאה של get_deficiency_amounts -
+# ולא מה שבמקרה יצא אחרון מ-Postgres
+DEFICIENCY_QUERY = """
+    WITH profiles AS (
+        SELECT u.user_id, u.gender,
+               EXTRACT(YEAR FROM age(%(day)s, u.date_of_birth)) * 12 + EXTRACT(MONTH FROM age(%(day)s, u.date_of_birth)) AS age_months,
+               CASE WHEN u.is_pregnant THEN 'pregnancy' WHEN u.is_lactating THEN 'lactation' ELSE 'normal' END AS condition
+        FROM users u
+        WHERE EXISTS (SELECT 1 FROM meals m WHERE m.user_id = u.user_id AND m.created_at >= %(since)s)
+    )
+    SELECT p.user_id, NULL, NULL, NULL FROM profiles p
+    UNION ALL
+    SELECT * FROM (
+        SELECT DISTINCT ON (p.user_id, n.food_column)
+               p.user_id, s.nutrient_name, n.food_column, s.daily_value - COALESCE(t.amount, 0)
+        FROM profiles p
+        JOIN nutrient_standards s
+          ON (s.gender = p.gender OR s.gender = 'both')
+         AND p.age_months BETWEEN s.min_age_months AND s.max_age_months
+         AND s.condition = p.condition
+        JOIN nutrients n ON n.nutrient_id = s.nutrient_id
+        LEFT JOIN daily_nutrient_totals t ON t.user_id = p.user_id AND t.day = %(day)s AND t.nutrient_id = s.nutrient_id
+        WHERE n.food_column IS NOT NULL AND s.daily_value > 0 AND s.daily_value > COALESCE(t.amount, 0)
+        ORDER BY p.user_id, n.food_column, {last_standard_first}
+    ) standards;
+""".format(last_standard_first=", ".join(f"s.{column} DESC" for column in STANDARDS_ORDER))
+
+
+def load_deficiencies(cur, day, active_days):
+    """
+    מחזיר (user_ids, gaps, gap_cols): מטריצת חוסרים users x gap_cols (0 = אין חוסר).
+    העמודות מסודרות לפי שם הרכיב בתקן - הסדר שבו get_deficiency_amounts בונה את ה-dict.
+    """
+    cur.execute(DEFICIENCY_QUERY, {"day": day, "since": day - timedelta(days=active_days)})
+    rows = cur.fetchall()
+
+    user_index = {}
+    names = {}
+    for user_id, nutrient_name, food_column, _missing in rows:
+        user_index.setdefault(user_id, len(user_index))
+        if food_column is not None:
+            names.setdefault(food_column, nutrient_name)
+    gap_cols = [col for col, _name in sorted(names.items(), key=lambda item: item[1])]
+    col_index = {col: j for j, col in enumerate(gap_cols)}
+
+    gaps = np.zeros((len(user_index), len(gap_cols)))
+    for user_id, _name, food_column, missing in rows:
+        if food_column is not None:
+            gaps[user_index[user_id], col_index[food_column]] = float(missing)
+    return list(user_index), gaps, gap_cols
+
+
+_worker_state = {}
+
+
+def _init_worker(catalog, gap_cols, max_items):
+    _worker_state.update(catalog=catalog, gap_cols=gap_cols, max_items=max_items)
+
+
+def _score_chunk(gaps):
+    return batch_greedy_recommend(_worker_state["catalog"], gaps, _worker_state["gap_cols"], _worker_state["max_items"])
+
+
+def score_all(catalog, gaps, gap_cols, max_items=3, chunk_size=BATCH_CHUNK_SIZE, workers=BATCH_WORKERS):
+    """ההמלצות לכל השורות ב-gaps, בחלקים של chunk_size משתמשים (על workers תהליכים אם > 1)"""
+    chunks = [gaps[start:start + chunk_size] for start in range(0, len(gaps), chunk_size)]
+    if workers > 1 and len(chunks) > 1:
+        # הקטלוג עובר לכל תהליך פעם אחת (initializer) ולא עם כל חלק
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(catalog, gap_cols, max_items)) as pool:
+            scored = list(pool.map(_score_chunk, chunks))
+    else:
+        scored = [batch_greedy_recommend(catalog, chunk, gap_cols, max_items) for chunk in chunks]
+    return [recommendations for chunk in scored for recommendations in chunk]
+
+
+def store_results(cur, day, computed_at, user_ids, gaps, gap_cols, results):
+    """
+    שורה אחת לכל משתמש. תוצאה שמורה של יום מאוחר יותר (או מאותו יום, שחושבה אחרי ההרצה הזו) לא נדרסת -
+    הרצה עם --day של יום שעבר לא מחליפה את ההמלצות של היום בנתונים ישנים. מחזיר כמה שורות נכתבו.
+    """
+    rows = []
+    for user_id, user_gaps, recommendations in zip(user_ids, gaps.tolist(), results):
+        deficiencies = {col: value for col, value in zip(gap_cols, user_gaps) if value > 0}
+        rows.append((user_id, day, computed_at, json.dumps(deficiencies), json.dumps(recommendations, default=str)))
+    written = execute_values(cur, """
+        INSERT INTO user_recommendations (user_id, day, computed_at, deficiencies, recommendations)
+        VALUES %s
+        ON CONFLICT (user_id) DO UPDATE SET day = EXCLUDED.day, computed_at = EXCLUDED.computed_at,
+            deficiencies = EXCLUDED.deficiencies, recommendations = EXCLUDED.recommendations
+        WHERE (user_recommendations.day, user_recommendations.computed_at) <= (EXCLUDED.day, EXCLUDED.computed_at)
+        RETURNING user_id;
+    """, rows, template="(%s, %s, %s, %s::jsonb, %s::jsonb)", page_size=BATCH_WRITE_PAGE_SIZE, fetch=True)
+    return len(written)
+
+
+def run_batch(day=None, active_days=BATCH_ACTIVE_DAYS, workers=BATCH_WORKERS, chunk_size=BATCH_CHUNK_SIZE, max_items=3):
+    """מחשב ושומר את ההמלצות של כל המשתמשים הפעילים. מחזיר את הזמנים לכל שלב (או None אם נכשל)"""
+    day = day or date.today()
+    timings = {}
+    with db_connection() as conn:
+        if not conn:
+            print("❌ No DB connection")
+            return None
+        try:
+            cur = conn.cursor()
+            # זמן תחילת הטרנזקציה - ארוחה שנשמרת אחריו הופכת את התוצאה ללא עדכנית
+            cur.execute("SELECT LOCALTIMESTAMP")
+            computed_at = cur.fetchone()[0]
+
+            start = time.perf_counter()
+            user_ids, gaps, gap_cols = load_deficiencies(cur, day, active_days)
+            timings["load_s"] = time.perf_counter() - start
+
+            catalog = food_catalog_cache.get(conn)
+            start = time.perf_counter()
+            results = score_all(catalog, gaps, gap_cols, max_items, chunk_size, workers)
+            timings["score_s"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            timings["stored"] = store_results(cur, day, computed_at, user_ids, gaps, gap_cols, results)
+            conn.commit()
+            timings["store_s"] = time.perf_counter() - start
+        except Exception as e:
+            print(f"❌ Batch recommendations failed: {e}")
+            conn.rollback()
+            return None
+
+    timings["users"] = len(user_ids)
+    total = timings["load_s"] + timings["score_s"] + timings["store_s"]
+    print(f"✅ user_recommendations: {len(user_ids)} users in {total:.1f}s "
+          f"(load {timings['load_s']:.1f}s, score {timings['score_s']:.1f}s, store {timings['store_s']:.1f}s)")
+    if timings["stored"] < len(user_ids):
+        print(f"⚠️ {len(user_ids) - timings['stored']} users kept a newer stored result than {day}")
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute deficiencies and recommendations for all active users")
+    parser.add_argument("--day", type=date.fromisoformat, help="YYYY-MM-DD (default: today)")
+    parser.add_argument("--active-days", type=int, default=BATCH_ACTIVE_DAYS)
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE)
+    args = parser.parse_args()
+    run_batch(args.day, args.active_days, args.workers, args.chunk_size)
@@ -0,0 +1,131 @@
+"""
+בנצ'מרק להעלאה מרובת תמונות: N קריאות רצופות ל-/analyze מול קריאה אחת ל-/analyze/batch.
+Bedrock ו-S3 מוחלפים בהשהיה מדומה (כדי למדוד את הצינור ולא את המודל), ה-DB הוא Postgres מקומי.
+
+    cd backend
+    DB_HOST=localhost DB_PASS=postgres DB_SSLMODE=disable python benchmarks/bench_batch_analyze.py --images 1,4,8 --bedrock-ms 800 --rtt-ms 1
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "..", ".."))
+
+import psycopg2.extensions  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+import db_handler  # noqa: E402
+import init_cloud_db  # noqa: E402
+import main as app_main  # noqa: E402
+from routers import meals  # noqa: E402
+
+AI_TEXT = json.dumps({
+    "overall_analysis": "Benchmark meal",
+    "items": [{
+        "food_name": f"Food {i}",
+        "estimated_weight_grams": 100,
+        "macros": {"calories": 200, "protein": 10, "carbs": 20, "fat": 5},
+        "micros": {"Iron": "2 mg", "Calcium": "120 mg", "Vitamin C": "15 mg", "Zinc": "1.5 mg"},
+    } for i in range(4)],
+})
+
+
+class LatencyCursor(psycopg2.extensions.cursor):
+    """מוסיף RTT מדומה לכל פנייה ל-DB"""
+    rtt = 0.0
+
+    def execute(self, query, vars=None):
+        if LatencyCursor.rtt:
+            time.sleep(LatencyCursor.rtt)
+        return super().execute(query, vars)
+
+
+def install_fakes(bedrock_ms, s3_ms):
+    def fake_upload(image, original_name):
+        time.sleep(s3_ms / 1000)
+        return f"https://{meals.S3_BUCKET}.s3.amazonaws.com/bench-{original_name}"
+
+    def fake_analyze(image):
+        time.sleep(bedrock_ms / 1000)
+        return AI_TEXT
+
+    meals.upload_to_s3 = fake_upload
+    meals.analyze_food_image = fake_analyze
+
+    def open_connection():
+        conn = db_handler.psycopg2.connect(
+            host=db_handler.DB_HOST, port=db_handler.DB_PORT, database=db_handler.DB_NAME,
+            user=db_handler.DB_USER, password=db_handler.DB_PASS, sslmode=db_handler.DB_SSLMODE,
+        )
+        conn.cursor_factory = LatencyCursor
+        return conn
+
+    db_handler._pool.close_all()
+    db_handler._pool._connect = open_connection
+
+
+def ensure_user():
+    conn = db_handler._open_connection()
+    init_cloud_db.run_migrations(conn)
+    cur = conn.cursor()
+    cur.execute("INSERT INTO users (full_name, gender) VALUES ('Bench User', 'male') RETURNING user_id;")
+    user_id = cur.fetchone()[0]
+    conn.commit()
+    conn.close()
+    return user_id
+
+
+def images(n):
+    # תוכן אקראי - כדי שה-Cache של הניתוחים לא יחסוך את הקריאות
+    return [(f"meal{i}.jpg", os.urandom(64 * 1024), "image/jpeg") for i in range(n)]
+
+
+def run_sequential(client, user_id, n):
+    for name, content, media_type in images(n):
+        response = client.post("/analyze", data={"user_id": user_id}, files={"file": (name, content, media_type)})
+        assert response.status_code == 200, response.text
+
+
+def run_batch(client, user_id, n):
+    files = [("files", image) for image in images(n)]
+    response = client.post("/analyze/batch", data={"user_id": user_id}, files=files)
+    assert response.status_code == 200, response.text
+    assert response.json()["status"] == "success", response.json()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", default="1,4,8")
+    parser.add_argument("--bedrock-ms", type=float, default=800)
+    parser.add_argument("--s3-ms", type=float, default=80)
+    parser.add_argument("--rtt-ms", type=float, default=1.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    user_id = ensure_user()
+    install_fakes(args.bedrock_ms, args.s3_ms)
+    LatencyCursor.rtt = args.rtt_ms / 1000
+    client = TestClient(app_main.app)
+
+    print(f"concurrency {meals.BATCH_CONCURRENCY}, bedrock {args.bedrock_ms:.0f} ms, s3 {args.s3_ms:.0f} ms, db rtt {args.rtt_ms} ms")
+    print(f"{'images':>6} | {'sequential ms':>13} {'per image':>9} | {'batch ms':>9} {'per image':>9} | {'speedup':>7}")
+    for n in [int(x) for x in args.images.split(",")]:
+        results = {}
+        for name, fn in (("sequential", run_sequential), ("batch", run_batch)):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                for _ in range(args.repeat):
+                    fn(client, user_id, n)
+            results[name] = (time.perf_counter() - start) * 1000 / args.repeat
+        seq, batch = results["sequential"], results["batch"]
+        print(f"{n:>6} | {seq:>13.0f} {seq / n:>9.0f} | {batch:>9.0f} {batch / n:>9.0f} | {seq / batch:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
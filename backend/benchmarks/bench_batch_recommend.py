@@ -0,0 +1,122 @@
+"""
+בנצ'מרק לחישוב הלילי של ההמלצות: משתמשים לשנייה בחישוב לפי בקשה (recommend_food לכל משתמש)
+מול batch_recommendations.run_batch (שאילתה אחת + ניקוד במטריצות), על נתונים סינתטיים.
+
+הנתונים נזרעים לסכמה נפרדת (batchbench) - ה-DB האמיתי לא נוגע.
+
+    cd backend
+    DB_HOST=localhost DB_PASS=postgres DB_SSLMODE=disable python benchmarks/bench_batch_recommend.py --users 100000 --workers 1,4
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "..", ".."))
+
+SCHEMA = "batchbench"
+os.environ["PGOPTIONS"] = f"-c search_path={SCHEMA}"
+
+import db_handler  # noqa: E402
+import init_cloud_db  # noqa: E402
+from batch_recommendations import run_batch  # noqa: E402
+from recommender_engine import NUTRIENT_COLUMNS, recommend_food  # noqa: E402
+from routers.recommendations import load_stored_recommendations  # noqa: E402
+
+
+def seed(users, foods):
+    conn = db_handler._open_connection()
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}; SET search_path TO {SCHEMA};")
+    conn.commit()
+    with contextlib.redirect_stdout(io.StringIO()):
+        init_cloud_db.run_migrations(conn)
+
+    start = time.perf_counter()
+    cur.execute("""
+        INSERT INTO users (full_name, gender, date_of_birth, is_pregnant)
+        SELECT 'Batch User ' || i, CASE WHEN i %% 2 = 0 THEN 'female' ELSE 'male' END,
+               CURRENT_DATE - (7000 + i %% 9000), i %% 13 = 0
+        FROM generate_series(1, %s) i;
+    """, (users,))
+    cur.execute("""
+        INSERT INTO meals (user_id, image_url, ai_analysis_summary, created_at)
+        SELECT user_id, 'https://bench/x.jpg', 'Batch meal', CURRENT_DATE + interval '8 hours' FROM users;
+    """)
+    # יעד לכל רכיב שיש לו עמודה בקטלוג, ויעד גבוה יותר בהריון
+    cur.execute("""
+        INSERT INTO nutrient_standards (nutrient_id, nutrient_name, gender, condition, daily_value, unit)
+        SELECT n.nutrient_id, n.name, 'both', c.condition, (10 + n.nutrient_id * 7) * c.factor, n.unit
+        FROM nutrients n, (VALUES ('normal', 1.0), ('pregnancy', 1.3)) AS c(condition, factor)
+        WHERE n.food_column IS NOT NULL;
+    """)
+    # הצריכה של היום: כ-60% מהרכיבים לכל משתמש, בין 0 ל-120% מהיעד
+    cur.execute("""
+        INSERT INTO daily_nutrient_totals (user_id, day, nutrient_id, amount)
+        SELECT u.user_id, CURRENT_DATE, s.nutrient_id, random() * s.daily_value * 1.2
+        FROM users u JOIN nutrient_standards s ON s.condition = 'normal'
+        WHERE random() < 0.6;
+    """)
+    cur.execute(f"""
+        INSERT INTO recommendation_foods (food_name, calories, serving_grams, tags, {", ".join(NUTRIENT_COLUMNS)})
+        SELECT 'Food ' || i, 20 + random() * 500, 100, 'synthetic',
+               {", ".join("CASE WHEN random() < 0.4 THEN 0 ELSE random() * 40 END" for _ in NUTRIENT_COLUMNS)}
+        FROM generate_series(1, %s) i;
+    """, (foods,))
+    conn.commit()
+    cur.execute("ANALYZE")
+    cur.execute("SELECT COUNT(*) FROM daily_nutrient_totals")
+    print(f"seeded {SCHEMA}: {users} users, {cur.fetchone()[0]} daily_nutrient_totals rows, {foods} foods "
+          f"in {time.perf_counter() - start:.1f}s")
+    conn.close()
+
+
+def quiet(fn, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--foods", type=int, default=500)
+    parser.add_argument("--sample", type=int, default=300, help="users for the per-request baseline and the check")
+    parser.add_argument("--workers", default="1,4")
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    parser.add_argument("--no-seed", action="store_true")
+    args = parser.parse_args()
+
+    if not args.no_seed:
+        seed(args.users, args.foods)
+    sample = random.Random(1).sample(range(1, args.users + 1), args.sample)
+    quiet(recommend_food, sample[0])  # טעינת ה-Caches של טבלאות הייחוס מחוץ למדידה
+
+    start = time.perf_counter()
+    on_demand = {user_id: quiet(recommend_food, user_id) for user_id in sample}
+    per_request_s = (time.perf_counter() - start) / len(sample)
+    print(f"\nper request (recommend_food): {per_request_s * 1000:.2f} ms/user -> {1 / per_request_s:,.0f} users/s "
+          f"(~{args.users * per_request_s:.0f}s for {args.users} users)")
+
+    print(f"\n{'workers':>7} | {'users':>7} | {'load s':>6} {'score s':>7} {'store s':>7} | {'total s':>7} | {'users/s':>8} | {'vs per request':>14}")
+    for workers in [int(x) for x in args.workers.split(",")]:
+        timings = quiet(run_batch, workers=workers, chunk_size=args.chunk_size)
+        total = timings["load_s"] + timings["score_s"] + timings["store_s"]
+        rate = timings["users"] / total
+        print(f"{workers:>7} | {timings['users']:>7} | {timings['load_s']:>6.1f} {timings['score_s']:>7.1f} "
+              f"{timings['store_s']:>7.1f} | {total:>7.1f} | {rate:>8,.0f} | {rate * per_request_s:>13.0f}x")
+
+    start = time.perf_counter()
+    stored = {user_id: quiet(load_stored_recommendations, user_id) for user_id in sample}
+    lookup_ms = (time.perf_counter() - start) * 1000 / len(sample)
+    same = sum(1 for user_id in sample
+               if [r["food_name"] for r in stored[user_id]] == [r["food_name"] for r in on_demand[user_id]])
+    print(f"\n/recommendations lookup: {lookup_ms:.2f} ms/user; stored == recommend_food for {same}/{len(sample)} sampled users")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+בנצ'מרק לאיחוד בקשות: פרצים של ניסיונות חוזרים (אותה תמונה, אותו משתמש, במקביל) ל-/analyze,
+עם ובלי SINGLE_FLIGHT. סופרים קריאות Bedrock, העלאות S3 וארוחות שנשמרו, ומודדים זמני תגובה.
+
+Bedrock ו-S3 מוחלפים בהשהיה מדומה והשמירה ב-DB רק נספרת. כמה workers מדומים כ-threads, לכל אחד
+Event Loop משלו, כך שהתיאום ביניהם עובר רק דרך Redis (fakeredis, או שרת אמיתי עם REDIS_HOST).
+
+    cd backend
+    python benchmarks/bench_coalesce.py --images 20 --retries 4 --workers 1,4 --bedrock-ms 800
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import httpx  # noqa: E402
+
+import cache_handler  # noqa: E402
+import main as app_main  # noqa: E402
+from routers import meals  # noqa: E402
+
+AI_TEXT = '{"overall_analysis": "Benchmark meal", "items": []}'
+
+
+def install_fakes(bedrock_ms, s3_ms):
+    counts = {"bedrock": 0, "s3": 0, "saved": 0}
+    lock = threading.Lock()
+
+    def bump(name):
+        with lock:
+            counts[name] += 1
+
+    def fake_analyze(image):
+        bump("bedrock")
+        time.sleep(bedrock_ms / 1000)
+        return AI_TEXT
+
+    def fake_upload(image, original_name):
+        bump("s3")
+        time.sleep(s3_ms / 1000)
+        return f"https://{meals.S3_BUCKET}.s3.amazonaws.com/bench-{original_name}"
+
+    meals.analyze_food_image = fake_analyze
+    meals.upload_to_s3 = fake_upload
+    meals.save_meal_to_db = lambda **kwargs: bump("saved")
+    return counts
+
+
+def reset_caches():
+    if os.getenv("REDIS_HOST"):
+        cache_handler.cache_client.flushdb()
+    else:
+        import fakeredis
+        cache_handler.cache_client = fakeredis.FakeRedis(decode_responses=True)
+    cache_handler.analysis_cache = cache_handler.LRUCache(1024, 3600)
+    cache_handler.idempotency_cache = cache_handler.LRUCache(1024, 3600)
+
+
+def run_worker(requests, latencies):
+    """worker אחד: Event Loop משלו ששולח את כל הבקשות שלו במקביל"""
+    async def send_all():
+        transport = httpx.ASGITransport(app=app_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            async def send(user_id, image):
+                start = time.perf_counter()
+                response = await client.post("/analyze", data={"user_id": str(user_id)},
+                                             files={"file": ("meal.jpg", image, "image/jpeg")})
+                assert response.status_code == 200, response.text
+                latencies.append(time.perf_counter() - start)
+            await asyncio.gather(*(send(user_id, image) for user_id, image in requests))
+    asyncio.run(send_all())
+
+
+def run_burst(images, retries, workers):
+    # כל תמונה נשלחת retries פעמים, והעותקים מתפזרים בין ה-workers
+    requests = [(index % 50 + 1, f"image-{index}".encode() * 64) for index in range(images) for _ in range(retries)]
+    per_worker = [requests[w::workers] for w in range(workers)]
+    latencies = []
+    threads = [threading.Thread(target=run_worker, args=(chunk, latencies)) for chunk in per_worker]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    latencies.sort()
+    return time.perf_counter() - start, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--retries", type=int, default=4, help="concurrent copies of each request")
+    parser.add_argument("--workers", default="1,4")
+    parser.add_argument("--bedrock-ms", type=float, default=800)
+    parser.add_argument("--s3-ms", type=float, default=80)
+    args = parser.parse_args()
+
+    counts = install_fakes(args.bedrock_ms, args.s3_ms)
+    total = args.images * args.retries
+    print(f"{args.images} images x {args.retries} concurrent copies = {total} requests, bedrock {args.bedrock_ms:.0f} ms\n")
+    print(f"{'single-flight':>13} | {'workers':>7} | {'bedrock':>7} {'s3':>4} {'meals':>5} | {'wall s':>6} | {'p50 ms':>7} {'p95 ms':>7}")
+    for workers in [int(x) for x in args.workers.split(",")]:
+        for enabled in (False, True):
+            cache_handler.SINGLE_FLIGHT = enabled
+            reset_caches()
+            for key in counts:
+                counts[key] = 0
+            wall, latencies = run_burst(args.images, args.retries, workers)
+            p50 = latencies[len(latencies) // 2] * 1000
+            p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+            print(f"{'on' if enabled else 'off':>13} | {workers:>7} | {counts['bedrock']:>7} {counts['s3']:>4} "
+                  f"{counts['saved']:>5} | {wall:>6.2f} | {p50:>7.0f} {p95:>7.0f}")
+    print(f"\nflight stats: {cache_handler.get_flight_stats()}")
+
+
+if __name__ == "__main__":
+    main()
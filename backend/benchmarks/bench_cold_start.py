@@ -0,0 +1,93 @@
+"""
+בנצ'מרק Cold Start של הלמבדה: זמן `import main` ושיא ה-RSS בתהליך Python נקי,
+ואת המודולים הכבדים ביותר לפי `python -X importtime`.
+
+    cd backend
+    python benchmarks/bench_cold_start.py                  # העץ הנוכחי
+    python benchmarks/bench_cold_start.py --ref HEAD~1     # השוואה מול גרסה קודמת (git worktree זמני)
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+PROBE = """
+import resource, time, json
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({"import_ms": elapsed * 1000,
+                  "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+
+def _env():
+    env = dict(os.environ)
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def measure(backend_dir, runs):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", PROBE], cwd=backend_dir, env=_env(),
+                             capture_output=True, text=True, check=True)
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {
+        "import_ms": statistics.median(s["import_ms"] for s in samples),
+        "rss_mb": statistics.median(s["rss_mb"] for s in samples),
+    }
+
+
+def top_imports(backend_dir, count):
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=backend_dir, env=_env(),
+                         capture_output=True, text=True, check=True)
+    # זמן עצמי (self) מסוכם לפי החבילה העליונה - pandas / botocore / numpy וכו'
+    per_package = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, _, raw_name = line[len("import time:"):].split("|")
+        package = raw_name.strip().split(".")[0]
+        per_package[package] = per_package.get(package, 0) + int(self_us)
+    rows = [(us, package) for package, us in per_package.items()]
+    return sorted(rows, reverse=True)[:count]
+
+
+def report(label, backend_dir, runs, count):
+    result = measure(backend_dir, runs)
+    print(f"{label}: import main {result['import_ms']:.0f} ms, peak RSS {result['rss_mb']:.0f} MB (median of {runs})")
+    for cumulative_us, name in top_imports(backend_dir, count):
+        print(f"    {cumulative_us / 1000:7.1f} ms  {name}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8)
+    parser.add_argument("--ref", help="git ref to compare against")
+    args = parser.parse_args()
+
+    if args.ref:
+        repo = subprocess.run(["git", "rev-parse", "--show-toplevel"], cwd=BACKEND, capture_output=True,
+                              text=True, check=True).stdout.strip()
+        with tempfile.TemporaryDirectory() as tmp:
+            worktree = os.path.join(tmp, "ref")
+            subprocess.run(["git", "worktree", "add", "--detach", worktree, args.ref], cwd=repo,
+                           capture_output=True, check=True)
+            try:
+                report(args.ref, os.path.join(worktree, "backend"), args.runs, args.top)
+            finally:
+                subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=repo, capture_output=True)
+    report("current", BACKEND, args.runs, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+בנצ'מרק לדוח היומי: הסכימה הישנה (consumed_micros -> food_items -> meals עם created_at::date = CURRENT_DATE)
+מול קריאה מ-daily_nutrient_totals, עבור משתמש עם שנים של היסטוריה.
+
+דורש Postgres מקומי:
+    cd backend
+    DB_HOST=localhost DB_PASS=postgres DB_SSLMODE=disable python benchmarks/bench_daily_totals.py --years 3
+"""
+import argparse
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "..", ".."))
+
+import db_handler  # noqa: E402
+import init_cloud_db  # noqa: E402
+from backfill_daily_totals import backfill  # noqa: E402
+
+NUTRIENTS = ["Iron", "Calcium", "Zinc", "Magnesium", "Potassium", "Sodium", "Phosphorus", "Vitamin A",
+             "Vitamin C", "Vitamin D", "Vitamin E", "Vitamin K", "Vitamin B6", "Vitamin B12", "Folate"]
+
+LEGACY_QUERY = """
+    SELECT cm.nutrient_id, SUM(cm.amount) as total
+    FROM consumed_micros cm
+    JOIN food_items fi ON cm.item_id = fi.item_id
+    JOIN meals m ON fi.meal_id = m.meal_id
+    WHERE m.user_id = %s AND m.created_at::date = CURRENT_DATE AND cm.nutrient_id IS NOT NULL
+    GROUP BY cm.nutrient_id
+"""
+
+ROLLUP_QUERY = """
+    SELECT nutrient_id, amount
+    FROM daily_nutrient_totals
+    WHERE user_id = %s AND day = CURRENT_DATE
+"""
+
+
+def seed_user(cur, years, meals_per_day, items_per_meal):
+    cur.execute("INSERT INTO users (full_name, date_of_birth, gender) VALUES ('History User', '1990-01-01', 'female') RETURNING user_id;")
+    user_id = cur.fetchone()[0]
+    cur.execute("""
+        INSERT INTO meals (user_id, image_url, ai_analysis_summary, created_at)
+        SELECT %s, 'https://bench/meal.jpg', 'bench', d + make_interval(hours => 7 + slot * 3)
+        FROM generate_series(CURRENT_DATE - %s * 365, CURRENT_DATE, interval '1 day') d,
+             generate_series(0, %s - 1) slot;
+    """, (user_id, years, meals_per_day))
+    cur.execute("""
+        INSERT INTO food_items (meal_id, food_name, estimated_weight_g, calories_kcal, protein_g, carbs_g, fat_g)
+        SELECT m.meal_id, 'Food ' || i, 100, 200, 10, 20, 5
+        FROM meals m, generate_series(1, %s) i
+        WHERE m.user_id = %s;
+    """, (items_per_meal, user_id))
+    cur.execute("""
+        INSERT INTO consumed_micros (item_id, nutrient_id, nutrient_name, amount, unit)
+        SELECT fi.item_id, n.nutrient_id, n.name, round((random() * 10)::numeric, 2), n.unit
+        FROM food_items fi JOIN meals m ON fi.meal_id = m.meal_id, nutrients n
+        WHERE m.user_id = %s AND n.name = ANY(%s);
+    """, (user_id, NUTRIENTS))
+    cur.execute("SELECT COUNT(*) FROM consumed_micros cm JOIN food_items fi ON cm.item_id = fi.item_id JOIN meals m ON fi.meal_id = m.meal_id WHERE m.user_id = %s", (user_id,))
+    return user_id, cur.fetchone()[0]
+
+
+def timed(cur, query, params, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        cur.execute(query, params)
+        rows = cur.fetchall()
+    return (time.perf_counter() - start) * 1000 / repeat, rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--meals-per-day", type=int, default=4)
+    parser.add_argument("--items-per-meal", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    conn = db_handler._open_connection()
+    cur = conn.cursor()
+    init_cloud_db.run_migrations(conn)
+    start = time.perf_counter()
+    user_id, micro_rows = seed_user(cur, args.years, args.meals_per_day, args.items_per_meal)
+    conn.commit()
+    cur.execute("ANALYZE")
+    print(f"seeded user {user_id}: {micro_rows} consumed_micros rows in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    backfill(user_id=user_id)
+    print(f"backfill: {time.perf_counter() - start:.2f}s")
+
+    legacy_ms, legacy_rows = timed(cur, LEGACY_QUERY, (user_id,), args.repeat)
+    rollup_ms, rollup_rows = timed(cur, ROLLUP_QUERY, (user_id,), args.repeat)
+    assert {n: round(a, 6) for n, a in legacy_rows} == {n: round(a, 6) for n, a in rollup_rows}
+    print(f"today's totals - join over history: {legacy_ms:.2f} ms | daily_nutrient_totals: {rollup_ms:.2f} ms "
+          f"(x{legacy_ms / rollup_ms:.0f})")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
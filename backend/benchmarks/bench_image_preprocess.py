@@ -0,0 +1,64 @@
+"""
+בנצ'מרק לעיבוד התמונה לפני Bedrock: גודל ה-payload, מימדים, הערכת טוקני תמונה וזמן עיבוד.
+
+    cd backend
+    python benchmarks/bench_image_preprocess.py ../test_meal.jpg ../1.jpg --max-dim 1568 --quality 85
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PIL import Image  # noqa: E402
+
+from image_processing import prepare_image_for_model, _downscale  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+
+
+def _image_tokens(image_bytes):
+    # הערכת Anthropic: tokens ≈ (width * height) / 750, אחרי ההקטנה שהמודל עושה בעצמו ל-1568
+    with Image.open(BytesIO(image_bytes)) as img:
+        w, h = img.size
+    scale = min(1.0, 1568 / max(w, h))
+    return int((w * scale) * (h * scale) / 750), (w, h)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("images", nargs="*", default=[os.path.join(ROOT, "test_meal.jpg"), os.path.join(ROOT, "1.jpg")])
+    parser.add_argument("--max-dim", type=int, default=None)
+    parser.add_argument("--quality", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    for path in args.images:
+        with open(path, "rb") as f:
+            original = f.read()
+        processed, media_type = prepare_image_for_model(original, args.max_dim, args.quality)
+
+        # מדידת העיבוד עצמו בלי ה-cache
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            _downscale(original, args.max_dim or 1568, args.quality or 85)
+        process_ms = (time.perf_counter() - start) * 1000 / args.repeat
+
+        start = time.perf_counter()
+        prepare_image_for_model(original, args.max_dim, args.quality)
+        cached_ms = (time.perf_counter() - start) * 1000
+
+        tokens_before, dims_before = _image_tokens(original)
+        tokens_after, dims_after = _image_tokens(processed)
+        print(f"{os.path.basename(path)}:")
+        print(f"  dims            {dims_before} -> {dims_after} ({media_type})")
+        print(f"  base64 payload  {len(base64.b64encode(original)) / 1024:.0f} KB -> {len(base64.b64encode(processed)) / 1024:.0f} KB")
+        print(f"  image tokens    ~{tokens_before} -> ~{tokens_after}")
+        print(f"  preprocess      {process_ms:.1f} ms (cached: {cached_ms:.2f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+זמני EXPLAIN ANALYZE לשאילתות החמות לפני ואחרי מיגרציית האינדקסים (init_cloud_db.MIGRATIONS).
+הכל רץ בסכמה זמנית (bench_indexes) על נתונים סינתטיים, כך שה-DB האמיתי לא נוגע.
+
+    cd backend
+    DB_HOST=localhost DB_PASS=postgres DB_SSLMODE=disable python benchmarks/bench_indexes.py --users 2000
+"""
+import argparse
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "..", ".."))
+
+import db_handler  # noqa: E402
+import init_cloud_db  # noqa: E402
+
+SCHEMA = "bench_indexes"
+INDEX_MIGRATION = 4
+
+QUERIES = {
+    "history page": "SELECT meal_id, created_at, ai_analysis_summary, image_url FROM meals "
+                     "WHERE user_id = %(user_id)s ORDER BY created_at DESC, meal_id DESC LIMIT 50",
+    "latest meal": "SELECT ai_analysis_summary, image_url FROM meals WHERE user_id = %(user_id)s "
+                    "ORDER BY created_at DESC LIMIT 1",
+    "meal report": "SELECT cm.nutrient_name, SUM(cm.amount) FROM consumed_micros cm "
+                    "JOIN food_items fi ON cm.item_id = fi.item_id WHERE fi.meal_id = %(meal_id)s "
+                    "GROUP BY cm.nutrient_name",
+    "user day join": "SELECT cm.nutrient_name, SUM(cm.amount) FROM consumed_micros cm "
+                      "JOIN food_items fi ON cm.item_id = fi.item_id JOIN meals m ON fi.meal_id = m.meal_id "
+                      "WHERE m.user_id = %(user_id)s AND m.created_at >= CURRENT_DATE "
+                      "AND m.created_at < CURRENT_DATE + 1 GROUP BY cm.nutrient_name",
+}
+
+
+def seed(cur, users, days, meals_per_day):
+    cur.execute("INSERT INTO users (full_name, gender) SELECT 'User ' || i, 'female' FROM generate_series(1, %s) i;", (users,))
+    cur.execute("""
+        INSERT INTO meals (user_id, image_url, ai_analysis_summary, created_at)
+        SELECT u.user_id, 'https://bench/x.jpg', 'bench', d + make_interval(hours => 7 + slot * 4)
+        FROM users u, generate_series(CURRENT_DATE - %s, CURRENT_DATE, interval '1 day') d, generate_series(0, %s - 1) slot;
+    """, (days, meals_per_day))
+    cur.execute("""
+        INSERT INTO food_items (meal_id, food_name, estimated_weight_g, calories_kcal, protein_g, carbs_g, fat_g)
+        SELECT m.meal_id, 'Food ' || i, 100, 200, 10, 20, 5 FROM meals m, generate_series(1, 3) i;
+    """)
+    cur.execute("""
+        INSERT INTO consumed_micros (item_id, nutrient_name, amount, unit)
+        SELECT fi.item_id, 'Nutrient ' || k, 1.5, 'mg' FROM food_items fi, generate_series(1, 6) k;
+    """)
+    cur.execute("SELECT (SELECT COUNT(*) FROM meals), (SELECT COUNT(*) FROM consumed_micros)")
+    return cur.fetchone()
+
+
+def _scan_types(node):
+    scans = {node["Node Type"]} if "Scan" in node["Node Type"] else set()
+    for child in node.get("Plans", []):
+        scans |= _scan_types(child)
+    return scans
+
+
+def explain_all(cur, params):
+    timings = {}
+    for name, query in QUERIES.items():
+        cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + query, params)
+        plan = cur.fetchone()[0][0]
+        timings[name] = (plan["Execution Time"], "/".join(sorted(_scan_types(plan["Plan"]))))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=60)
+    parser.add_argument("--meals-per-day", type=int, default=3)
+    parser.add_argument("--keep", action="store_true", help="don't drop the scratch schema at the end")
+    args = parser.parse_args()
+
+    conn = db_handler._open_connection()
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}; SET search_path TO {SCHEMA};")
+    conn.commit()
+
+    init_cloud_db.run_migrations(conn, target=INDEX_MIGRATION - 1)
+    meals, micros = seed(cur, args.users, args.days, args.meals_per_day)
+    conn.commit()
+    cur.execute("ANALYZE")
+    print(f"synthetic data: {args.users} users, {meals} meals, {micros} consumed_micros rows")
+
+    cur.execute("SELECT user_id FROM users ORDER BY user_id OFFSET %s LIMIT 1", (args.users // 2,))
+    user_id = cur.fetchone()[0]
+    cur.execute("SELECT meal_id FROM meals WHERE user_id = %s LIMIT 1", (user_id,))
+    params = {"user_id": user_id, "meal_id": cur.fetchone()[0]}
+
+    before = explain_all(cur, params)
+    init_cloud_db.run_migrations(conn)
+    cur.execute("ANALYZE")
+    after = explain_all(cur, params)
+
+    print(f"{'query':<15} {'before ms':>10} {'after ms':>10} {'speedup':>8}  scans (before -> after)")
+    for name in QUERIES:
+        (b_ms, b_node), (a_ms, a_node) = before[name], after[name]
+        print(f"{name:<15} {b_ms:>10.2f} {a_ms:>10.2f} {b_ms / max(a_ms, 0.001):>7.0f}x  {b_node} -> {a_node}")
+
+    if not args.keep:
+        cur.execute(f"DROP SCHEMA {SCHEMA} CASCADE;")
+        conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
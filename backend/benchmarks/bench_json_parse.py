@@ -0,0 +1,114 @@
+"""
+בנצ'מרק לפענוח תשובות המודל: המימוש הקודם (תיקוני regex על כל הטקסט + נסיון חוזר) מול model_output
+(json.loads, ורק אם הוא נכשל - תיקונים, סגירת תשובה שנקטעה ופרסר סובלני), על הקורפוס ב-benchmarks/corpus/model_outputs.jsonl.
+json: רק הפענוח (legacy_extract_json_from_text מול loads_tolerant).
+total: כולל בניית השורות לשמירה (פירוק הכמויות, מאקרו) כמו בלולאה של _save_meals.
+
+    cd backend
+    python benchmarks/bench_json_parse.py --repeat 2000
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from model_output import parse_quantity, loads_tolerant, parse_model_output  # noqa: E402
+
+CORPUS = os.path.join(HERE, "corpus", "model_outputs.jsonl")
+
+
+def legacy_repair_json_string(text):
+    text = re.sub(r':\s*(\d+(?:\.\d+)?\s*[a-zA-Z%]+)(?=")', r': "\1', text)
+    text = re.sub(r':\s*(\d+(?:\.\d+)?\s*[a-zA-Z%]+)(?=[,}])', r': "\1"', text)
+    return text
+
+
+def legacy_extract_json_from_text(text):
+    # המימוש הקודם של db_handler.extract_json_from_text, כולל הדפסות הדיבאג (הפלט מופנה ל-StringIO)
+    print("\n🔍 --- DEBUG: מתחיל ניתוח וניקוי טקסט ---")
+    start_index = text.find('{')
+    end_index = text.rfind('}')
+    if start_index == -1 or end_index == -1:
+        print("❌ לא נמצאו סוגריים מסולסלים JSON בטקסט.")
+        return None
+    fixed_json = legacy_repair_json_string(text[start_index:end_index + 1])
+    try:
+        return json.loads(fixed_json)
+    except json.JSONDecodeError as e:
+        print(f"⚠️ נכשל בנסיון ראשון, מנסה ניקוי אגרסיבי יותר... ({e})")
+        fixed_json = fixed_json.replace('\n', ' ')
+        try:
+            return json.loads(fixed_json)
+        except json.JSONDecodeError:
+            print(f"❌ שגיאה סופית בפענוח ה-JSON.\nהנה הטקסט הבעייתי:\n{fixed_json[:200]}...")
+            return None
+
+
+def legacy_parse(text):
+    # הפענוח + בניית השורות כמו בלולאה הקודמת של _save_meals (בלי ה-DB) - אותה עבודה ש-parse_model_output עושה
+    data = legacy_extract_json_from_text(text)
+    if not data:
+        return None
+    rows = []
+    for item in data.get('items', []):
+        macros = item.get('macros', {})
+        rows.append((item.get('food_name', 'Unknown'), item.get('estimated_weight_grams', 0), macros.get('calories', 0),
+                     macros.get('protein', 0), macros.get('carbs', 0), macros.get('fat', 0)))
+        count = 0
+        for k, v in item.get('micros', {}).items():
+            amount, unit = parse_quantity(v)
+            if amount > 0:
+                rows.append((k, amount, unit))
+                count += 1
+        print(f"   > {item.get('food_name', 'Unknown')}: נשמרו {count} ויטמינים.")
+    return data
+
+
+def load_corpus():
+    with open(CORPUS, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def measure(fn, text, repeat, rounds=5):
+    # המינימום מכמה סבבים - פחות רעש ממכונה עמוסה
+    best = float("inf")
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for _ in range(max(repeat // rounds, 1)):
+                result = fn(text)
+            best = min(best, (time.perf_counter() - start) * 1e6 / max(repeat // rounds, 1))
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'document':<28} | {'json: legacy µs':>15} {'new µs':>7} | {'total: legacy µs':>16} {'ok':>3} {'new µs':>7} {'items':>5} | {'speedup':>7}")
+    totals = [0.0, 0.0, 0.0, 0.0]
+    for doc in load_corpus():
+        legacy_json_us, _ = measure(legacy_extract_json_from_text, doc["text"], args.repeat)
+        new_json_us, _ = measure(loads_tolerant, doc["text"], args.repeat)
+        legacy_us, legacy_result = measure(legacy_parse, doc["text"], args.repeat)
+        new_us, new_result = measure(parse_model_output, doc["text"], args.repeat)
+        for i, value in enumerate((legacy_json_us, new_json_us, legacy_us, new_us)):
+            totals[i] += value
+        items = len(new_result["items"]) if new_result else 0
+        ok = "yes" if legacy_result else "no"
+        print(f"{doc['name']:<28} | {legacy_json_us:>15.1f} {new_json_us:>7.1f} | {legacy_us:>16.1f} {ok:>3} {new_us:>7.1f} "
+              f"{items:>5} | {legacy_us / new_us:>6.1f}x")
+    print(f"{'total':<28} | {totals[0]:>15.1f} {totals[1]:>7.1f} | {totals[2]:>16.1f} {'':>3} {totals[3]:>7.1f} {'':>5} | "
+          f"{totals[2] / totals[3]:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
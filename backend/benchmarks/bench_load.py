@@ -0,0 +1,278 @@
+"""
+בדיקת עומס ל-backend כולו: Postgres מקומי עם נתונים סינתטיים, S3 ו-Bedrock מדומים עם השהיה,
+ו-N לקוחות במקביל מול /analyze, /report, /history, /recommendations ו-/users (דרך ASGI, בלי שרת).
+מדפיס p50/p95/p99 ו-requests/sec לכל endpoint ושומר את התוצאות כ-JSON להשוואה בין commits.
+
+הנתונים נזרעים לסכמה נפרדת (loadtest) - ה-DB האמיתי לא נוגע.
+
+    cd backend
+    DB_HOST=localhost DB_PASS=postgres DB_SSLMODE=disable python benchmarks/bench_load.py --users 500 --concurrency 32 --duration 30
+    # השוואה מול ריצה קודמת
+    ... python benchmarks/bench_load.py --compare benchmarks/results/load-<commit>.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "..", ".."))
+
+SCHEMA = "loadtest"
+# כל החיבורים של האפליקציה (libpq) עובדים מול סכמת הבדיקה
+os.environ["PGOPTIONS"] = f"-c search_path={SCHEMA}"
+os.environ.setdefault("TRACE_LOG", "0")  # שורת לוג לכל בקשה רק מאטה את הבדיקה
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import httpx  # noqa: E402
+
+import db_handler  # noqa: E402
+import init_cloud_db  # noqa: E402
+import main as app_main  # noqa: E402
+import tracing  # noqa: E402
+from routers import meals  # noqa: E402
+
+NUTRIENTS = [("Iron", 18, "mg"), ("Calcium", 1000, "mg"), ("Zinc", 8, "mg"), ("Magnesium", 320, "mg"),
+             ("Vitamin C", 75, "mg"), ("Vitamin A", 700, "mcg"), ("Folate", 400, "mcg"), ("Potassium", 2600, "mg")]
+FOOD_COLUMNS = ["iron_mg", "calcium_mg", "zinc_mg", "magnesium_mg", "vitamin_c_mg", "vitamin_a_mcg", "folate_mcg", "potassium_mg"]
+
+DEFAULT_MIX = "report=30,history=25,recommendations=20,users=10,analyze=15"  # זמין גם trend (/report/{id}/range)
+
+
+def seed(users, days, meals_per_day, foods):
+    conn = db_handler._open_connection()
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}; SET search_path TO {SCHEMA};")
+    conn.commit()
+    init_cloud_db.run_migrations(conn)
+
+    cur.execute("""
+        INSERT INTO users (full_name, gender, date_of_birth, is_pregnant)
+        SELECT 'Load User ' || i, CASE WHEN i %% 2 = 0 THEN 'female' ELSE 'male' END,
+               CURRENT_DATE - (7000 + i %% 9000), i %% 13 = 0
+        FROM generate_series(1, %s) i;
+    """, (users,))
+    cur.execute("""
+        INSERT INTO meals (user_id, image_url, ai_analysis_summary, created_at)
+        SELECT u.user_id, 'https://bench/x.jpg', 'Load test meal', d + make_interval(hours => 7 + slot * 4)
+        FROM users u, generate_series(CURRENT_DATE - %s, CURRENT_DATE, interval '1 day') d, generate_series(0, %s - 1) slot;
+    """, (days, meals_per_day))
+    cur.execute("""
+        INSERT INTO food_items (meal_id, food_name, estimated_weight_g, calories_kcal, protein_g, carbs_g, fat_g)
+        SELECT m.meal_id, 'Food ' || i, 100, 200, 10, 20, 5 FROM meals m, generate_series(1, 3) i;
+    """)
+    cur.execute("""
+        INSERT INTO consumed_micros (item_id, nutrient_id, nutrient_name, amount, unit)
+        SELECT fi.item_id, d.nutrient_id, n.name, round((random() * n.dv / 6)::numeric, 2), n.unit
+        FROM food_items fi, (VALUES %s) AS n(name, dv, unit) JOIN nutrients d ON d.name = n.name;
+    """ % ", ".join(f"('{name}', {dv}, '{unit}')" for name, dv, unit in NUTRIENTS))
+    cur.execute("""
+        INSERT INTO daily_nutrient_totals (user_id, day, nutrient_id, amount)
+        SELECT m.user_id, m.created_at::date, cm.nutrient_id, SUM(cm.amount)
+        FROM consumed_micros cm JOIN food_items fi ON cm.item_id = fi.item_id JOIN meals m ON fi.meal_id = m.meal_id
+        GROUP BY 1, 2, 3;
+    """)
+    for name, dv, unit in NUTRIENTS:
+        cur.execute("INSERT INTO nutrient_standards (nutrient_id, nutrient_name, gender, condition, daily_value, unit) "
+                    "SELECT nutrient_id, %s, 'both', c.condition, %s * c.factor, %s FROM nutrients, "
+                    "(VALUES ('normal', 1.0), ('pregnancy', 1.3)) AS c(condition, factor) WHERE name = %s;",
+                    (name, dv, unit, name))
+    cur.execute(f"""
+        INSERT INTO recommendation_foods (food_name, calories, serving_grams, tags, {", ".join(FOOD_COLUMNS)})
+        SELECT 'Food ' || i, 50 + random() * 400, 100, 'synthetic', {", ".join("random() * 30" for _ in FOOD_COLUMNS)}
+        FROM generate_series(1, %s) i;
+    """, (foods,))
+    conn.commit()
+    cur.execute("ANALYZE")
+    cur.execute("SELECT (SELECT COUNT(*) FROM meals), (SELECT COUNT(*) FROM consumed_micros)")
+    n_meals, n_micros = cur.fetchone()
+    conn.close()
+    print(f"seeded {SCHEMA}: {users} users, {n_meals} meals, {n_micros} consumed_micros rows, {foods} foods")
+
+
+def install_fakes(bedrock_ms, s3_ms, jitter):
+    """S3 ו-Bedrock מדומים: השהיה (עם פיזור) ותשובה בפורמט של המודל"""
+    def delay(ms):
+        time.sleep(max(0.0, random.gauss(ms, ms * jitter)) / 1000)
+
+    def fake_upload(image, original_name):
+        delay(s3_ms)
+        return f"https://{meals.S3_BUCKET}.s3.amazonaws.com/load-{original_name}"
+
+    def fake_analyze(image):
+        delay(bedrock_ms)
+        items = [{
+            "food_name": f"Food {i}",
+            "estimated_weight_grams": 120,
+            "macros": {"calories": 180, "protein": 9, "carbs": 22, "fat": 6},
+            "micros": {name: f"{round(random.random() * dv / 5, 2)} {unit}" for name, dv, unit in NUTRIENTS},
+        } for i in range(random.randint(1, 4))]
+        return json.dumps({"overall_analysis": "Load test meal", "items": items})
+
+    meals.upload_to_s3 = fake_upload
+    meals.analyze_food_image = fake_analyze
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 2)
+
+
+def summarize(samples, elapsed):
+    endpoints = {}
+    for name in sorted(samples):
+        latencies = sorted(ms for ms, ok in samples[name])
+        errors = sum(1 for _, ok in samples[name] if not ok)
+        endpoints[name] = {
+            "requests": len(latencies),
+            "errors": errors,
+            "rps": round(len(latencies) / elapsed, 1),
+            "p50": _percentile(latencies, 50),
+            "p95": _percentile(latencies, 95),
+            "p99": _percentile(latencies, 99),
+            "max": round(latencies[-1], 2) if latencies else None,
+        }
+    all_latencies = sorted(ms for values in samples.values() for ms, _ in values)
+    endpoints["ALL"] = {
+        "requests": len(all_latencies),
+        "errors": sum(e["errors"] for e in endpoints.values()),
+        "rps": round(len(all_latencies) / elapsed, 1),
+        "p50": _percentile(all_latencies, 50),
+        "p95": _percentile(all_latencies, 95),
+        "p99": _percentile(all_latencies, 99),
+        "max": round(all_latencies[-1], 2) if all_latencies else None,
+    }
+    return endpoints
+
+
+async def run_load(users, concurrency, duration, mix):
+    transport = httpx.ASGITransport(app=app_main.app)
+    names, weights = zip(*mix.items())
+    samples = {name: [] for name in names}
+    deadline = time.perf_counter() + duration
+
+    async def request(client, name):
+        user_id = random.randint(1, users)
+        if name == "report":
+            return await client.get(f"/report/{user_id}")
+        if name == "trend":
+            return await client.get(f"/report/{user_id}/range")
+        if name == "history":
+            return await client.get(f"/history/{user_id}", params={"limit": 50})
+        if name == "recommendations":
+            return await client.get(f"/recommendations/{user_id}")
+        if name == "users":
+            return await client.get("/users")
+        # תמונה ייחודית - בלי פגיעה ב-Cache של הניתוחים
+        files = {"file": ("meal.jpg", os.urandom(32 * 1024), "image/jpeg")}
+        return await client.post("/analyze", data={"user_id": str(user_id)}, files=files)
+
+    async def worker(client):
+        while time.perf_counter() < deadline:
+            name = random.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                response = await request(client, name)
+                ok = response.status_code < 400
+            except Exception:
+                ok = False
+            samples[name].append(((time.perf_counter() - start) * 1000, ok))
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=120) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return samples, elapsed
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def print_table(endpoints, baseline=None):
+    header = f"{'endpoint':<16} {'reqs':>6} {'err':>4} {'rps':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    print(header + ("   vs baseline (p50 / p99 / rps)" if baseline else ""))
+    for name, stats in endpoints.items():
+        line = (f"{name:<16} {stats['requests']:>6} {stats['errors']:>4} {stats['rps']:>7.1f} "
+                f"{stats['p50'] or 0:>8.1f} {stats['p95'] or 0:>8.1f} {stats['p99'] or 0:>8.1f}")
+        base = (baseline or {}).get(name)
+        if base:
+            def delta(key):
+                if not base.get(key) or stats.get(key) is None:
+                    return "   n/a"
+                return f"{(stats[key] - base[key]) / base[key] * 100:+6.1f}%"
+            line += f"   {delta('p50')} / {delta('p99')} / {delta('rps')}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--meals-per-day", type=int, default=3)
+    parser.add_argument("--foods", type=int, default=2000)
+    parser.add_argument("--no-seed", action="store_true", help="reuse the existing loadtest schema")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint weights, e.g. report=30,analyze=15")
+    parser.add_argument("--bedrock-ms", type=float, default=1500)
+    parser.add_argument("--s3-ms", type=float, default=80)
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative stddev of the injected latency")
+    parser.add_argument("--output", help="JSON results path (default benchmarks/results/load-<commit>.json)")
+    parser.add_argument("--compare", help="previous results JSON to diff against")
+    args = parser.parse_args()
+
+    mix = {name: float(weight) for name, weight in (part.split("=") for part in args.mix.split(","))}
+    if not args.no_seed:
+        seed(args.users, args.days, args.meals_per_day, args.foods)
+    install_fakes(args.bedrock_ms, args.s3_ms, args.jitter)
+    tracing.reset_latency_stats()
+
+    print(f"load: {args.concurrency} concurrent clients for {args.duration:.0f}s, mix {args.mix}, "
+          f"bedrock {args.bedrock_ms:.0f} ms, s3 {args.s3_ms:.0f} ms")
+    with contextlib.redirect_stdout(io.StringIO()):  # ההדפסות של האפליקציה
+        samples, elapsed = asyncio.run(run_load(args.users, args.concurrency, args.duration, mix))
+    endpoints = summarize(samples, elapsed)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["endpoints"]
+    print_table(endpoints, baseline)
+
+    stages = tracing.latency_summary()["stages"]
+    print("\nstages (p50 / p99 ms): " + ", ".join(f"{name} {s['p50']}/{s['p99']}" for name, s in stages.items()))
+
+    commit = git_commit()
+    results = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "args": vars(args),
+        "elapsed_s": round(elapsed, 2),
+        "endpoints": endpoints,
+        "stages": stages,
+        "db_pool": db_handler.get_pool_stats(),
+    }
+    output = args.output or os.path.join(HERE, "results", f"load-{commit}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nresults saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+בנצ'מרק ל-BackgroundTasks ב-Lambda: Mangum מריץ את האפליקציה עד הסוף (כולל BackgroundTasks) ורק אז
+מחזיר את התשובה ל-API Gateway - כך שהשמירה ב-DB "שאחרי התשובה" נכנסת לזמן שהלקוח מחכה.
+
+מריץ את ה-handler של הלמבדה (main.handler) עם אירוע HTTP API של POST /analyze, כשהניתוח וההעלאה מיידיים
+והשמירה היא השהיה מדומה, ומשווה את זמן ה-handler לזמן שבו התשובה הייתה מוכנה (duration_ms של ה-tracing).
+background - השמירה ב-BackgroundTasks, queue - עבודת save בתור חיצוני (השהיה מדומה של send_message ל-SQS).
+
+    cd backend
+    python benchmarks/bench_mangum_background.py --save-ms 0,50,200 --enqueue-ms 15 --calls 20
+"""
+import argparse
+import base64
+import contextlib
+import io
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import job_queue  # noqa: E402
+import main as app_main  # noqa: E402
+import tracing  # noqa: E402
+from routers import meals  # noqa: E402
+
+BOUNDARY = "benchboundary"
+
+
+def analyze_event(image):
+    body = (
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"user_id\"\r\n\r\n1\r\n"
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"meal.jpg\"\r\n"
+        f"Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + image + f"\r\n--{BOUNDARY}--\r\n".encode()
+    return {
+        "version": "2.0",
+        "routeKey": "POST /analyze",
+        "rawPath": "/default/analyze",
+        "rawQueryString": "",
+        "headers": {"content-type": f"multipart/form-data; boundary={BOUNDARY}", "host": "bench.execute-api"},
+        "requestContext": {
+            "http": {"method": "POST", "path": "/default/analyze", "protocol": "HTTP/1.1", "sourceIp": "127.0.0.1"},
+            "stage": "default",
+            "requestId": "bench",
+        },
+        "body": base64.b64encode(body).decode(),
+        "isBase64Encoded": True,
+    }
+
+
+class SimulatedSQS:
+    """תור חיצוני: send_message בלבד - ה-worker (sqs_handler) הוא Lambda אחרת ולא נמדד כאן"""
+    carries_image = False
+
+    def __init__(self, enqueue_ms):
+        self.enqueue_ms = enqueue_ms
+
+    def put(self, message):
+        time.sleep(self.enqueue_ms / 1000)
+
+
+class Context:
+    aws_request_id = "bench"
+    function_name = "bench"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--save-ms", default="0,50,200")
+    parser.add_argument("--enqueue-ms", type=float, default=15)
+    parser.add_argument("--calls", type=int, default=20)
+    args = parser.parse_args()
+
+    tracing.TRACE_LOG = False
+    meals.upload_to_s3 = lambda image, name: f"https://{meals.S3_BUCKET}.s3.amazonaws.com/{name}"
+    meals.analyze_food_image = lambda image: '{"overall_analysis": "Bench", "items": []}'
+
+    in_process = job_queue.job_queue
+    print(f"{'save':>10} | {'save ms':>7} | {'response ready':>14} | {'lambda handler':>14} | {'after response':>14}")
+    for mode in ("background", "queue"):
+        job_queue.job_queue = SimulatedSQS(args.enqueue_ms) if mode == "queue" else in_process
+        for save_ms in [float(x) for x in args.save_ms.split(",")]:
+            meals.save_meal_to_db = lambda save_ms=save_ms, **kwargs: time.sleep(save_ms / 1000)
+            handler_ms = []
+            tracing.reset_latency_stats()
+            for call in range(args.calls):
+                # תמונה שונה בכל קריאה - בלי Cache ובלי איחוד בקשות
+                event = analyze_event(f"image-{mode}-{save_ms}-{call}".encode() * 32)
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    response = app_main.handler(event, Context())
+                handler_ms.append((time.perf_counter() - start) * 1000)
+                assert response["statusCode"] == 200, response
+            handler_ms.sort()
+            ready = tracing.latency_summary()["routes"]["POST /analyze"]["p50"]
+            handler = handler_ms[len(handler_ms) // 2]
+            print(f"{mode:>10} | {save_ms:>7.0f} | {ready:>11.1f} ms | {handler:>11.1f} ms | {handler - ready:>11.1f} ms")
+    job_queue.job_queue = in_process
+
+
+if __name__ == "__main__":
+    main()
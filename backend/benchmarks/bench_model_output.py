@@ -0,0 +1,134 @@
+"""
+בנצ'מרק לחוזה הפלט של המודל: ה-JSON החופשי הישן (STRUCTURED_OUTPUT=0) מול הכלי record_meal המקוצר,
+על תשובות מוקלטות בפורמט של Bedrock (corpus/bedrock_responses.jsonl - אותן ארוחות בשני הפורמטים).
+
+Bedrock מוחלף ב-Stubber שמחזיר את התשובה המוקלטת, כך שנמדד כל הצינור המקומי (בניית הבקשה, קריאת התשובה,
+פענוח לשמירה). זמן המודל עצמו מוערך מטוקני הפלט: ttft + output_tokens / tokens_per_s.
+הטוקנים מוערכים (אין כאן את ה-tokenizer של המודל): מילה / מספר / סימן פיסוק / ירידת שורה עם הזחה = טוקן -
+מספיק להשוואה בין שני הפורמטים, לא לספירה מדויקת. הקידומת הקבועה מוערכת בגסות (4 תווים לטוקן), ואם היא נשמרת
+ב-Prompt Cache יודעים רק מ-cache_creation_input_tokens / cache_read_input_tokens בתשובה אמיתית של Bedrock.
+
+    cd backend
+    python benchmarks/bench_model_output.py --calls 20 --ttft-ms 600 --tokens-per-s 60
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from botocore.response import StreamingBody  # noqa: E402
+from botocore.stub import Stubber  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import aws_clients  # noqa: E402
+import nutrition_ai  # noqa: E402
+from model_output import parse_model_output  # noqa: E402
+
+CORPUS = os.path.join(HERE, "corpus", "bedrock_responses.jsonl")
+_TOKEN_ESTIMATE = re.compile(r"\n[ \t]*|[A-Za-z]+|\d+|[^\w\s]|[^\x00-\x7f]")
+# המינימום של Bedrock לקידומת שנשמרת ב-Prompt Cache (Claude Sonnet)
+CACHE_MIN_TOKENS = 1024
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return len(_TOKEN_ESTIMATE.findall(text))
+
+
+def output_text(body):
+    """מה שהמודל כתב בפועל: הטקסט, או ה-JSON של קלט הכלי"""
+    block = body["content"][0]
+    return block["text"] if block["type"] == "text" else json.dumps(block["input"], ensure_ascii=False)
+
+
+def static_prefix_tokens(structured):
+    """הכלי וה-system - החלק הקבוע שנשלח בכל קריאה (ונשמר ב-Cache רק אם הוא מעל המינימום). הערכה גסה"""
+    text = nutrition_ai.SYSTEM_PROMPT
+    if structured:
+        text += json.dumps(nutrition_ai.ANALYSIS_TOOL)
+    return len(text) // CHARS_PER_TOKEN
+
+
+def run_mode(meals, image, structured, calls, ttft_ms, tokens_per_s):
+    nutrition_ai.STRUCTURED_OUTPUT = structured
+    nutrition_ai.ANALYSIS_MAX_TOKENS = 2048 if structured else 4096
+    aws_clients.reset_clients()
+    client = aws_clients.get_bedrock_client()
+    rows = []
+    for meal in meals:
+        recorded = meal["structured" if structured else "legacy"]
+        payload = json.dumps(recorded).encode()
+        local_ms, parsed = [], None
+        with Stubber(client) as stub, contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(calls):
+                stub.add_response("invoke_model", {"body": StreamingBody(io.BytesIO(payload), len(payload)),
+                                                   "contentType": "application/json"})
+                start = time.perf_counter()
+                text = nutrition_ai.analyze_food_image(image)
+                parsed = parse_model_output(text)
+                local_ms.append((time.perf_counter() - start) * 1000)
+        local_ms.sort()
+        out_tokens = estimate_tokens(output_text(recorded))
+        rows.append({
+            "meal": meal["name"],
+            "out_chars": len(output_text(recorded)),
+            "out_tokens": out_tokens,
+            "model_ms": ttft_ms + out_tokens / tokens_per_s * 1000,
+            "local_ms": local_ms[len(local_ms) // 2],
+            "parsed": parsed,
+        })
+    aws_clients.reset_clients()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=20, help="calls per meal (median local time)")
+    parser.add_argument("--ttft-ms", type=float, default=600)
+    parser.add_argument("--tokens-per-s", type=float, default=60)
+    args = parser.parse_args()
+
+    with open(CORPUS, encoding="utf-8") as f:
+        meals = [json.loads(line) for line in f]
+    buf = io.BytesIO()
+    Image.new("RGB", (1024, 768), (180, 140, 90)).save(buf, format="JPEG")
+    image = buf.getvalue()
+
+    legacy = run_mode(meals, image, False, args.calls, args.ttft_ms, args.tokens_per_s)
+    structured = run_mode(meals, image, True, args.calls, args.ttft_ms, args.tokens_per_s)
+
+    print(f"model time = {args.ttft_ms:.0f} ms + output tokens / {args.tokens_per_s:.0f} tok/s (tokens are estimates)\n")
+    print(f"{'meal':>14} | {'free-form JSON':^30} | {'record_meal (compact)':^30} | {'tokens':>6} | {'same':>4}")
+    print(f"{'':>14} | {'chars':>6} {'tok':>5} {'model':>7} {'local':>7} | {'chars':>6} {'tok':>5} {'model':>7} {'local':>7} | "
+          f"{'saved':>6} | {'data':>4}")
+    for old, new in zip(legacy, structured):
+        same = old["parsed"] == new["parsed"]
+        print(f"{old['meal']:>14} | {old['out_chars']:>6} {old['out_tokens']:>5} {old['model_ms']:>6.0f}ms {old['local_ms']:>5.1f}ms | "
+              f"{new['out_chars']:>6} {new['out_tokens']:>5} {new['model_ms']:>6.0f}ms {new['local_ms']:>5.1f}ms | "
+              f"{1 - new['out_tokens'] / old['out_tokens']:>6.0%} | {'yes' if same else 'NO':>4}")
+
+    old_total = sum(row["out_tokens"] for row in legacy)
+    new_total = sum(row["out_tokens"] for row in structured)
+    old_ms = sum(row["model_ms"] for row in legacy) / len(legacy)
+    new_ms = sum(row["model_ms"] for row in structured) / len(structured)
+    print(f"\noutput tokens: {old_total} -> {new_total} ({1 - new_total / old_total:.0%} fewer), "
+          f"mean modelled latency {old_ms:.0f} -> {new_ms:.0f} ms")
+
+    for label, structured_mode in (("free-form", False), ("record_meal", True)):
+        prefix = static_prefix_tokens(structured_mode)
+        side = "below" if prefix < CACHE_MIN_TOKENS else "at or above"
+        print(f"static prefix ({label}): ~{prefix} tokens (chars / {CHARS_PER_TOKEN}), "
+              f"{side} the {CACHE_MIN_TOKENS}-token cache minimum by this estimate")
+    print("whether the prefix is cached is only known from cache_creation_input_tokens / cache_read_input_tokens "
+          "in real Bedrock responses (model_usage.uncached_calls in /debug/latency)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+בנצ'מרק למנוע ההמלצות: הלולאה המקורית עם iterrows מול הניקוד הווקטורי, על קטלוג סינתטי.
+
+    cd backend
+    python benchmarks/bench_recommend.py --foods 1000,10000,50000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from recommender_engine import NUTRIENT_COLUMNS, build_food_catalog, greedy_recommend  # noqa: E402
+
+
+def legacy_recommend(foods_df, current_gaps, max_items=3):
+    """הלולאה הקודמת של recommend_food, כפי שהייתה"""
+    current_gaps = dict(current_gaps)
+    recommended_list = []
+    for _ in range(max_items):
+        if not current_gaps: break
+        best_food, best_score = None, -1
+        for idx, food in foods_df.iterrows():
+            if food['food_name'] in [r['food_name'] for r in recommended_list]:
+                continue
+            score = 0
+            for nutrient_col, missing_amount in current_gaps.items():
+                food_amount = food[nutrient_col]
+                if food_amount > 0:
+                    score += (min(food_amount, missing_amount) / missing_amount) * 100
+            final_score = score / (food['calories'] + 10)
+            if final_score > best_score:
+                best_score, best_food = final_score, food
+        if best_food is not None and best_score > 0.5:
+            recommended_list.append({"food_name": best_food['food_name']})
+            for nutrient in list(current_gaps):
+                current_gaps[nutrient] -= best_food[nutrient]
+                if current_gaps[nutrient] <= 0:
+                    del current_gaps[nutrient]
+        else:
+            break
+    return recommended_list
+
+
+def synthetic_catalog(n, rng):
+    data = {col: rng.choice([0, 0, 0.5, 2, 10, 50, 300], size=n) for col in NUTRIENT_COLUMNS}
+    data["food_name"] = [f"food_{i}" for i in range(n)]
+    data["calories"] = rng.integers(0, 600, size=n)
+    data["serving_grams"] = rng.choice([50, 100, 150], size=n)
+    data["tags"] = ["synthetic"] * n
+    return pd.DataFrame(data)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--foods", default="1000,10000")
+    parser.add_argument("--skip-legacy-above", type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    gaps = {col: float(rng.choice([5, 20, 100, 900])) for col in NUTRIENT_COLUMNS}
+    for n in [int(x) for x in args.foods.split(",")]:
+        df = synthetic_catalog(n, rng)
+
+        start = time.perf_counter()
+        catalog = build_food_catalog(df.to_dict(orient="list"))
+        build_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        result = greedy_recommend(catalog, gaps)
+        vector_ms = (time.perf_counter() - start) * 1000
+
+        line = f"foods={n:>6}  vectorized {vector_ms:8.1f} ms (catalog build {build_ms:.0f} ms)"
+        if n <= args.skip_legacy_above:
+            start = time.perf_counter()
+            legacy = legacy_recommend(df, gaps)
+            legacy_ms = (time.perf_counter() - start) * 1000
+            assert [r["food_name"] for r in legacy] == [r["food_name"] for r in result]
+            line += f"  legacy {legacy_ms:8.1f} ms  speedup x{legacy_ms / vector_ms:.0f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
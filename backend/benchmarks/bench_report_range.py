@@ -0,0 +1,136 @@
+"""
+בנצ'מרק לדוח מגמה: גרף של N ימים כשאילתה לכל יום (כמו קריאה ל-/report לכל יום) מול build_report_range -
+שאילתה מקובצת אחת על טווח התאריכים. סופר את הפניות ל-DB ומוסיף RTT מדומה לכל פנייה.
+
+הנתונים נזרעים לסכמה נפרדת (trendbench) - ה-DB האמיתי לא נוגע.
+
+    cd backend
+    DB_HOST=localhost DB_PASS=postgres DB_SSLMODE=disable python benchmarks/bench_report_range.py --days 7,30,90 --rtt-ms 1
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "..", ".."))
+
+SCHEMA = "trendbench"
+os.environ["PGOPTIONS"] = f"-c search_path={SCHEMA}"
+
+import psycopg2.extensions  # noqa: E402
+
+import db_handler  # noqa: E402
+import init_cloud_db  # noqa: E402
+from reference_data import get_standards  # noqa: E402
+from routers.meals import build_report_range  # noqa: E402
+
+NUTRIENTS = [("Iron", 18, "mg"), ("Calcium", 1000, "mg"), ("Zinc", 8, "mg"), ("Magnesium", 320, "mg"),
+             ("Vitamin C", 75, "mg"), ("Vitamin A", 700, "mcg"), ("Folate", 400, "mcg"), ("Potassium", 2600, "mg"),
+             ("Sodium", 1500, "mg"), ("Vitamin D", 15, "mcg"), ("Vitamin B12", 2.4, "mcg"), ("Phosphorus", 700, "mg")]
+
+PROFILE_QUERY = "SELECT gender, (CURRENT_DATE - date_of_birth)/30, CASE WHEN is_pregnant THEN 'pregnancy' ELSE 'normal' END FROM users WHERE user_id = %s"
+DAY_QUERY = "SELECT nutrient_id, amount FROM daily_nutrient_totals WHERE user_id = %s AND day = %s"
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """סופר פניות ל-DB ומוסיף RTT מדומה לכל אחת"""
+    rtt = 0.0
+    trips = 0
+
+    def execute(self, query, vars=None):
+        CountingCursor.trips += 1
+        if CountingCursor.rtt:
+            time.sleep(CountingCursor.rtt)
+        return super().execute(query, vars)
+
+
+def seed(users, days):
+    conn = db_handler._open_connection()
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}; SET search_path TO {SCHEMA};")
+    conn.commit()
+    init_cloud_db.run_migrations(conn)
+    cur.execute("""
+        INSERT INTO users (full_name, gender, date_of_birth)
+        SELECT 'Trend User ' || i, 'female', '1990-01-01' FROM generate_series(1, %s) i;
+    """, (users,))
+    cur.execute("""
+        INSERT INTO daily_nutrient_totals (user_id, day, nutrient_id, amount)
+        SELECT u.user_id, d::date, k.nutrient_id, round((random() * n.dv)::numeric, 2)
+        FROM users u, generate_series(CURRENT_DATE - %s, CURRENT_DATE, interval '1 day') d,
+             (VALUES {}) AS n(name, dv) JOIN nutrients k ON k.name = n.name;
+    """.format(", ".join(f"('{name}', {dv})" for name, dv, _ in NUTRIENTS)), (days,))
+    for name, dv, unit in NUTRIENTS:
+        cur.execute("INSERT INTO nutrient_standards (nutrient_id, nutrient_name, gender, condition, daily_value, unit) "
+                    "SELECT nutrient_id, %s, 'both', 'normal', %s, %s FROM nutrients WHERE name = %s;", (name, dv, unit, name))
+    conn.commit()
+    cur.execute("ANALYZE")
+    cur.execute("SELECT COUNT(*) FROM daily_nutrient_totals")
+    print(f"seeded {SCHEMA}: {users} users, {cur.fetchone()[0]} daily_nutrient_totals rows")
+    conn.close()
+
+
+def per_day(user_id, from_date, to_date):
+    """גרף שנבנה מדוח יומי לכל יום - פרופיל + סכומי היום בכל קריאה"""
+    series = []
+    with db_handler.db_connection() as conn:
+        cur = conn.cursor()
+        day = from_date
+        while day <= to_date:
+            cur.execute(PROFILE_QUERY, (user_id,))
+            gender, age_months, condition = cur.fetchone()
+            cur.execute(DAY_QUERY, (user_id, day))
+            totals = dict(cur.fetchall())
+            series.append([(name, totals.get(nutrient_id, 0) / target * 100)
+                           for nutrient_id, name, target, _unit in get_standards(gender, age_months, condition, conn)])
+            day += timedelta(days=1)
+    return series
+
+
+def timed(fn, repeat):
+    CountingCursor.trips = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) * 1000 / repeat, CountingCursor.trips / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--history-days", type=int, default=365)
+    parser.add_argument("--days", default="7,30,90")
+    parser.add_argument("--window", type=int, default=7)
+    parser.add_argument("--rtt-ms", type=float, default=1.0)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    seed(args.users, args.history_days)
+    db_handler._pool.close_all()
+    open_connection = db_handler._pool._connect
+
+    def counting_connection():
+        conn = open_connection()
+        conn.cursor_factory = CountingCursor
+        return conn
+
+    db_handler._pool._connect = counting_connection
+    CountingCursor.rtt = args.rtt_ms / 1000
+    user_id = args.users // 2
+    get_standards("female", 400, "normal")  # טעינת ה-Cache של היעדים מחוץ למדידה
+
+    print(f"db rtt {args.rtt_ms} ms, window {args.window}")
+    print(f"{'days':>5} | {'per-day ms':>10} {'trips':>6} | {'range ms':>9} {'trips':>6} | {'speedup':>7}")
+    for n in [int(x) for x in args.days.split(",")]:
+        to_date = date.today()
+        from_date = to_date - timedelta(days=n - 1)
+        legacy_ms, legacy_trips = timed(lambda: per_day(user_id, from_date, to_date), args.repeat)
+        range_ms, range_trips = timed(lambda: build_report_range(user_id, from_date, to_date, args.window), args.repeat)
+        print(f"{n:>5} | {legacy_ms:>10.1f} {legacy_trips:>6.0f} | {range_ms:>9.1f} {range_trips:>6.0f} | {legacy_ms / range_ms:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+בנצ'מרק לשמירת ארוחה ב-DB: זמן השמירה ומספר הפניות ל-DB כפונקציה של מספר הפריטים.
+משווה את השמירה הישנה (INSERT לכל שורה) מול save_meal_to_db הנוכחי.
+
+דורש Postgres מקומי (הטבלאות נוצרות אם אינן קיימות):
+    cd backend
+    DB_HOST=localhost DB_PASS=postgres DB_SSLMODE=disable python benchmarks/bench_save_meal.py --rtt-ms 1
+
+--rtt-ms מוסיף השהיה לכל פנייה כדי לדמות את ה-RTT ל-RDS (ברשת מקומית כמעט אין RTT).
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "..", ".."))
+
+import psycopg2.extensions  # noqa: E402
+
+import db_handler  # noqa: E402
+from db_handler import _save_meal  # noqa: E402
+from model_output import parse_quantity  # noqa: E402
+import init_cloud_db  # noqa: E402
+
+MICROS = ["Iron", "Calcium", "Zinc", "Magnesium", "Potassium", "Sodium", "Phosphorus", "Vitamin A", "Vitamin C",
+          "Vitamin D", "Vitamin E", "Vitamin K", "Vitamin B6", "Vitamin B12", "Folate", "Thiamin B1",
+          "Riboflavin B2", "Niacin B3", "Copper", "Selenium"]
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """סופר פניות ל-DB ומוסיף RTT מדומה לכל אחת"""
+    rtt = 0.0
+    round_trips = 0
+
+    def execute(self, query, vars=None):
+        CountingCursor.round_trips += 1
+        if CountingCursor.rtt:
+            time.sleep(CountingCursor.rtt)
+        return super().execute(query, vars)
+
+
+def make_ai_text(n_items):
+    items = [{
+        "food_name": f"Food {i}",
+        "estimated_weight_grams": 100,
+        "macros": {"calories": 200, "protein": 10, "carbs": 20, "fat": 5},
+        "micros": {name: f"{j + 1} mg" for j, name in enumerate(MICROS)},
+    } for i in range(n_items)]
+    return json.dumps({"overall_analysis": "Benchmark meal", "items": items})
+
+
+def legacy_save(conn, user_id, image_url, ai_json_text):
+    """שחזור השמירה הקודמת: RETURNING לכל פריט ו-INSERT לכל ויטמין"""
+    data = json.loads(ai_json_text)
+    cur = conn.cursor()
+    cur.execute("INSERT INTO meals (user_id, image_url, ai_analysis_summary) VALUES (%s, %s, %s) RETURNING meal_id;",
+                (user_id, image_url, data["overall_analysis"]))
+    meal_id = cur.fetchone()[0]
+    for item in data["items"]:
+        macros = item["macros"]
+        cur.execute("""
+            INSERT INTO food_items (meal_id, food_name, estimated_weight_g, calories_kcal, protein_g, carbs_g, fat_g)
+            VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING item_id;
+        """, (meal_id, item["food_name"], item["estimated_weight_grams"], macros["calories"], macros["protein"], macros["carbs"], macros["fat"]))
+        item_id = cur.fetchone()[0]
+        for k, v in item["micros"].items():
+            amount, unit = parse_quantity(v)
+            cur.execute("INSERT INTO consumed_micros (item_id, nutrient_name, amount, unit) VALUES (%s, %s, %s, %s);",
+                        (item_id, k, amount, unit))
+    conn.commit()
+
+
+def ensure_schema(conn):
+    init_cloud_db.run_migrations(conn)
+    cur = conn.cursor()
+    cur.execute("INSERT INTO users (full_name, gender) VALUES ('Bench User', 'male') RETURNING user_id;")
+    user_id = cur.fetchone()[0]
+    conn.commit()
+    return user_id
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", default="1,4,8,16,32")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--rtt-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    conn = db_handler._open_connection()
+    conn.cursor_factory = CountingCursor
+    user_id = ensure_schema(conn)
+    CountingCursor.rtt = args.rtt_ms / 1000
+
+    print(f"{'items':>5} {'rows':>5} | {'legacy ms':>9} {'trips':>5} | {'batched ms':>10} {'trips':>5}")
+    for n in [int(x) for x in args.items.split(",")]:
+        text = make_ai_text(n)
+        results = {}
+        for name, fn in (("legacy", legacy_save), ("batched", _save_meal)):
+            CountingCursor.round_trips = 0
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):  # ההדפסות של השמירה לא רלוונטיות כאן
+                for _ in range(args.repeat):
+                    fn(conn, user_id, "https://bench/meal.jpg", text)
+            elapsed_ms = (time.perf_counter() - start) * 1000 / args.repeat
+            results[name] = (elapsed_ms, CountingCursor.round_trips // args.repeat)
+        rows = 1 + n + n * len(MICROS)
+        print(f"{n:>5} {rows:>5} | {results['legacy'][0]:>9.1f} {results['legacy'][1]:>5} | "
+              f"{results['batched'][0]:>10.1f} {results['batched'][1]:>5}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
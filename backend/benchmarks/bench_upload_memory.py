@@ -0,0 +1,105 @@
+"""
+בנצ'מרק זיכרון לנתיב התמונה של /analyze: הנתיב הישן (קובץ זמני + קריאה חוזרת ל-S3 ול-base64)
+מול הנתיב הנוכחי (bytes אחד משותף, base64 פעם אחת).
+
+כל מצב רץ בתהליך נפרד כדי ש-ru_maxrss (שיא ה-RSS) יימדד בנפרד.
+
+    cd backend
+    python benchmarks/bench_upload_memory.py --size-mb 8
+"""
+import argparse
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+
+class _FakeS3:
+    """קורא את ה-Body כמו ש-botocore עושה, בלי רשת"""
+    def put_object(self, Bucket, Key, Body, ContentType):
+        data = Body.read() if hasattr(Body, "read") else Body
+        return {"size": len(data)}
+
+
+def _payload():
+    return {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 4096,
+        "messages": [{"role": "user", "content": [
+            {"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": None}},
+            {"type": "text", "text": "Analyze this meal image."},
+        ]}],
+    }
+
+
+def run_legacy(content):
+    """שחזור של הנתיב הקודם: כתיבה ל-/tmp, קריאה ל-S3, קריאה נוספת ל-base64, json.dumps על str"""
+    fd, path = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            buffer.write(content)
+        with open(path, "rb") as f:
+            _FakeS3().put_object(Bucket="b", Key="k", Body=f, ContentType="image/jpeg")
+        with open(path, "rb") as f:
+            b64 = base64.b64encode(f.read()).decode("utf-8")
+        payload = _payload()
+        payload["messages"][0]["content"][0]["source"]["data"] = b64
+        body = json.dumps(payload).encode("utf-8")  # botocore מקודד str ל-bytes
+        return len(body)
+    finally:
+        os.remove(path)
+
+
+def run_current(content):
+    from routers import meals
+    from nutrition_ai import encode_image_to_base64, build_request_body, _IMAGE_PLACEHOLDER
+    meals.get_s3_client = lambda: _FakeS3()
+    meals.upload_to_s3(content, "meal.jpg")
+    payload = _payload()
+    payload["messages"][0]["content"][0]["source"]["data"] = _IMAGE_PLACEHOLDER
+    body = build_request_body(payload, encode_image_to_base64(content))
+    return len(body)
+
+
+def _child(mode, size_mb):
+    content = os.urandom(size_mb * 1024 * 1024)
+    if mode == "current":
+        # טעינת המודולים לפני המדידה כדי למדוד רק את הבקשה
+        import routers.meals  # noqa: F401
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    (run_current if mode == "current" else run_legacy)(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "mode": mode,
+        "size_mb": size_mb,
+        "peak_alloc_mb": round(peak / 1024 / 1024, 1),
+        "rss_growth_mb": round((peak_rss - baseline_rss) / 1024, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=8)
+    parser.add_argument("--child", choices=["legacy", "current"])
+    args = parser.parse_args()
+    if args.child:
+        _child(args.child, args.size_mb)
+        return
+    for mode in ("legacy", "current"):
+        out = subprocess.run([sys.executable, __file__, "--child", mode, "--size-mb", str(args.size_mb)],
+                             capture_output=True, text=True, check=True)
+        print(out.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,91 @@
-import redis
 import os
 import json
+import asyncio
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
 
 # הגדרת הכתובת - אותה תכניס ב-Environment Variables ב-Lambda/GitHub
 REDIS_HOST = os.getenv("REDIS_HOST")
 REDIS_PORT = 6379
 
+# הגדרות Cache הניתוחים (שכבה מקומית בזיכרון לפני Redis)
+ANALYSIS_CACHE_MAX_ITEMS = int(os.getenv("ANALYSIS_CACHE_MAX_ITEMS", "256"))
+ANALYSIS_CACHE_TTL_HOURS = int(os.getenv("ANALYSIS_CACHE_TTL_HOURS", "24"))
+# Hash תפיסתי (dHash) לזיהוי אותה תמונה שנשמרה מחדש/הוקטנה - דורש Pillow
+ANALYSIS_CACHE_PHASH = os.getenv("ANALYSIS_CACHE_PHASH", "0") == "1"
+
+# Cache של תשובות /report ו-/recommendations - מתבטל בכל שמירת ארוחה של המשתמש
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+# בלי Redis הביטול מגיע רק לקונטיינר ששמר את הארוחה - לכן TTL קצר לשכבה המקומית
+RESPONSE_CACHE_LOCAL_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_LOCAL_TTL_SECONDS", "30"))
+RESPONSE_CACHE_MAX_ITEMS = int(os.getenv("RESPONSE_CACHE_MAX_ITEMS", "512"))
+
+# איחוד בקשות זהות שרצות במקביל (ניסיונות חוזרים של הלקוח) - רק אחת מבצעת את העבודה
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "1") == "1"
+# ה-Lock ב-Redis פג לבד אם המוביל נפל - צריך להיות ארוך מניתוח רגיל
+FLIGHT_LOCK_TTL_SECONDS = int(os.getenv("FLIGHT_LOCK_TTL_SECONDS", "60"))
+# התוצאה המפורסמת נמחקת כשהממתין האחרון קרא אותה - ה-TTL הוא רק גיבוי לממתין שנפל באמצע.
+# כך היא לא משמשת Cache: אותה תמונה שנשלחת שוב אחרי שהבקשה הסתיימה היא ארוחה חדשה
+FLIGHT_RESULT_TTL_SECONDS = 5
+FLIGHT_POLL_SECONDS = 0.1
+# תשובות שמורות לפי Idempotency-Key
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+
 # יצירת חיבור (Connection Pool)
+# ספריית redis נטענת רק כשבאמת מוגדר שרת (חוסך זמן ב-Cold Start)
 try:
-    cache_client = redis.Redis(
-        host=REDIS_HOST,
-        port=REDIS_PORT,
-        decode_responses=True,
-        socket_connect_timeout=2  # מניעת תקיעה של הלמבדה אם ה-Cache לא זמין
-    )
+    if REDIS_HOST:
+        import redis
+        cache_client = redis.Redis(
+            host=REDIS_HOST,
+            port=REDIS_PORT,
+            decode_responses=True,
+            socket_connect_timeout=2  # מניעת תקיעה של הלמבדה אם ה-Cache לא זמין
+        )
+    else:
+        cache_client = None
 except Exception as e:
     print(f"Cache connection error: {e}")
     cache_client = None
 
+
+class LRUCache:
+    """Cache מקומי בזיכרון התהליך עם חסם על מספר הרשומות ו-TTL"""
+
+    def __init__(self, max_items, ttl_seconds):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+analysis_cache = LRUCache(ANALYSIS_CACHE_MAX_ITEMS, ANALYSIS_CACHE_TTL_HOURS * 3600)
+
 def get_cached_nutrition(food_text: str):
     """שליפת נתונים מה-Cache במידה וקיימים"""
     if not cache_client:
@@ -40,4 +108,269 @@ def set_nutrition_cache(food_text: str, nutrition_data: dict, expire_hours=24):
             json.dumps(nutrition_data)
         )
     except Exception as e:
-        print(f"Error saving to cache: {e}")
\ No newline at end of file
+        print(f"Error saving to cache: {e}")
+
+def _perceptual_hash(image_bytes):
+    """dHash של 64 ביט - זהה גם אחרי דחיסה מחדש או שינוי גודל קל"""
+    try:
+        from io import BytesIO
+        from PIL import Image
+        with Image.open(BytesIO(image_bytes)) as img:
+            pixels = list(img.convert("L").resize((9, 8)).getdata())
+    except Exception:
+        return None
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (1 if left > right else 0)
+    return f"{bits:016x}"
+
+def image_cache_keys(image_bytes):
+    """מפתחות ה-Cache של תמונה: hash של התוכן, ואופציונלית hash תפיסתי"""
+    keys = [f"analysis:sha256:{hashlib.sha256(image_bytes).hexdigest()}"]
+    if ANALYSIS_CACHE_PHASH:
+        phash = _perceptual_hash(image_bytes)
+        if phash:
+            keys.append(f"analysis:dhash:{phash}")
+    return keys
+
+def get_cached_analysis(keys):
+    """חיפוש ניתוח קודם - קודם בזיכרון המקומי ורק אחר כך ב-Redis"""
+    for key in keys:
+        result = analysis_cache.get(key)
+        if result is not None:
+            return result
+    for key in keys:
+        result = get_cached_nutrition(key)
+        if result is not None:
+            # חימום השכבה המקומית לבקשות הבאות באותו קונטיינר
+            analysis_cache.set(key, result)
+            return result
+    return None
+
+def set_analysis_cache(keys, analysis: dict):
+    for key in keys:
+        analysis_cache.set(key, analysis)
+        set_nutrition_cache(key, analysis, expire_hours=ANALYSIS_CACHE_TTL_HOURS)
+
+response_cache = LRUCache(RESPONSE_CACHE_MAX_ITEMS, RESPONSE_CACHE_LOCAL_TTL_SECONDS)
+_user_versions = {}
+_user_versions_lock = threading.Lock()
+_response_stats = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0}
+
+def get_user_version(user_id):
+    """מונה הגרסה של נתוני המשתמש - עולה בכל שמירת ארוחה, וחלק ממפתח ה-Cache של התשובות"""
+    if cache_client:
+        try:
+            return int(cache_client.get(f"user:{user_id}:version") or 0)
+        except Exception:
+            pass
+    with _user_versions_lock:
+        return _user_versions.get(user_id, 0)
+
+def invalidate_user_cache(user_id):
+    """
+    נקרא אחרי שמירת ארוחה: העלאת הגרסה מבטלת בבת אחת את כל התשובות השמורות של המשתמש
+    (המפתחות הישנים פשוט לא נקראים יותר ופגים לבד ב-TTL).
+    """
+    _response_stats["invalidations"] += 1
+    with _user_versions_lock:
+        _user_versions[user_id] = _user_versions.get(user_id, 0) + 1
+    if cache_client:
+        try:
+            cache_client.incr(f"user:{user_id}:version")
+        except Exception as e:
+            print(f"Error invalidating user cache: {e}")
+
+def response_cache_key(kind, user_id, *parts):
+    """המפתח כולל את גרסת המשתמש - יש לחשב אותו לפני חישוב התשובה, כדי ששמירה במקביל לא תישמר בטעות כעדכנית"""
+    suffix = ":".join(str(part) for part in parts)
+    return f"resp:{kind}:{user_id}:v{get_user_version(user_id)}:{suffix}"
+
+def get_cached_response(key):
+    """מחזיר {"etag", "body"} או None - קודם מהזיכרון המקומי ואחר כך מ-Redis"""
+    entry = response_cache.get(key)
+    if entry is None and cache_client:
+        try:
+            raw = cache_client.get(key)
+            entry = json.loads(raw) if raw else None
+        except Exception:
+            entry = None
+        if entry is not None:
+            response_cache.set(key, entry)
+    _response_stats["hits" if entry is not None else "misses"] += 1
+    return entry
+
+def set_cached_response(key, body):
+    """שומר את התשובה עם ETag שמחושב מהתוכן (כך שהוא זהה בכל הקונטיינרים)"""
+    payload = json.dumps(body, sort_keys=True, default=str)
+    entry = {"etag": f'"{hashlib.sha1(payload.encode()).hexdigest()}"', "body": body}
+    response_cache.set(key, entry)
+    if cache_client:
+        try:
+            cache_client.setex(key, RESPONSE_CACHE_TTL_SECONDS, json.dumps(entry, default=str))
+        except Exception as e:
+            print(f"Error saving response to cache: {e}")
+    return entry
+
+def etag_response(request, entry):
+    """304 אם ה-ETag של הלקוח עדכני, אחרת התשובה עם ETag"""
+    from fastapi.responses import JSONResponse, Response
+
+    headers = {"ETag": entry["etag"], "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if entry["etag"] in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        _response_stats["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(entry["body"], headers=headers)
+
+def get_response_cache_stats():
+    stats = dict(_response_stats)
+    total = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / total, 3) if total else 0.0
+    stats["local_items"] = len(response_cache)
+    return stats
+
+_inflight = {}
+_flight_stats = {"leaders": 0, "local_followers": 0, "remote_followers": 0}
+
+async def single_flight(key, compute):
+    """
+    מריץ את compute (פונקציה אסינכרונית שמחזירה ערך JSON) פעם אחת לכל key, גם כשאותה בקשה מגיעה כמה פעמים במקביל:
+    באותו תהליך העוקבים מחכים ל-Future של המוביל, ובין workers ה-Lock ב-Redis קובע מי מוביל
+    והעוקבים מחכים לתוצאה שהוא מפרסם. מחזיר (result, shared) - shared=True אם העבודה נעשתה בבקשה אחרת.
+    התוצאה משותפת רק עם בקשות שהגיעו בזמן שהעבודה רצה - לא עם בקשות שמגיעות אחרי שכולן סיימו.
+    """
+    if not SINGLE_FLIGHT:
+        return await compute(), False
+    loop = asyncio.get_running_loop()
+    while (loop, key) in _inflight:
+        future = _inflight[(loop, key)]
+        try:
+            result = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # המוביל בוטל - מנסים שוב (ואולי נהיים המובילים). אם בוטלה הבקשה הזו עצמה - ממשיכים לזרוק
+            if not future.cancelled():
+                raise
+            continue
+        _flight_stats["local_followers"] += 1
+        return result, True
+
+    future = loop.create_future()
+    _inflight[(loop, key)] = future
+    try:
+        result, shared = await _redis_flight(key, compute)
+        future.set_result(result)
+        return result, shared
+    except Exception as e:
+        # העוקבים מקבלים את אותה שגיאה (ו-exception() מסמן אותה כנקראה אם אין עוקבים)
+        future.set_exception(e)
+        future.exception()
+        raise
+    finally:
+        if not future.done():
+            future.cancel()
+        del _inflight[(loop, key)]
+
+async def _redis_flight(key, compute):
+    if not cache_client:
+        _flight_stats["leaders"] += 1
+        return await compute(), False
+    waiters_key = f"flight:{key}:waiters"
+    try:
+        # כל בקשה (מוביל ועוקבים) נרשמת - מי שיוצא אחרון מוחק את התוצאה
+        cache_client.incr(waiters_key)
+        cache_client.expire(waiters_key, FLIGHT_LOCK_TTL_SECONDS * 2)
+    except Exception as e:
+        print(f"Flight lock error: {e}")
+        _flight_stats["leaders"] += 1
+        return await compute(), False
+    try:
+        return await _lead_or_follow(key, compute)
+    finally:
+        _leave_flight(key)
+
+def _leave_flight(key):
+    try:
+        if cache_client.decr(f"flight:{key}:waiters") <= 0:
+            cache_client.delete(f"flight:{key}:waiters", f"flight:{key}:result")
+    except Exception as e:
+        print(f"Error leaving flight: {e}")
+
+async def _lead_or_follow(key, compute):
+    lock_key, result_key = f"flight:{key}:lock", f"flight:{key}:result"
+    token = uuid.uuid4().hex
+    while True:
+        try:
+            # קודם התוצאה: המוביל מפרסם אותה לפני שהוא משחרר את ה-Lock
+            raw = cache_client.get(result_key)
+            acquired = raw is None and cache_client.set(lock_key, token, nx=True, px=FLIGHT_LOCK_TTL_SECONDS * 1000)
+            if acquired:
+                raw = cache_client.get(result_key)  # המוביל הקודם סיים בין שתי הפעולות
+        except Exception as e:
+            print(f"Flight lock error: {e}")
+            _flight_stats["leaders"] += 1
+            return await compute(), False
+        if raw is not None:
+            if acquired:
+                _release_flight_lock(lock_key, token)
+            _flight_stats["remote_followers"] += 1
+            return json.loads(raw), True
+        if acquired:
+            break
+        await asyncio.sleep(FLIGHT_POLL_SECONDS)
+
+    _flight_stats["leaders"] += 1
+    try:
+        result = await compute()
+        try:
+            cache_client.setex(result_key, FLIGHT_RESULT_TTL_SECONDS, json.dumps(result, default=str))
+        except Exception as e:
+            print(f"Error publishing flight result: {e}")
+        return result, False
+    finally:
+        # אם המוביל נכשל לא מתפרסמת תוצאה, והעוקב הבא לוקח את ה-Lock ומנסה בעצמו
+        _release_flight_lock(lock_key, token)
+
+def _release_flight_lock(lock_key, token):
+    """מוחק את ה-Lock רק אם הוא עדיין שלנו (אם פג ונלקח - הוא כבר של מוביל אחר)"""
+    try:
+        if cache_client.get(lock_key) == token:
+            cache_client.delete(lock_key)
+    except Exception as e:
+        print(f"Error releasing flight lock: {e}")
+
+def get_flight_stats():
+    return dict(_flight_stats, in_flight=len(_inflight))
+
+idempotency_cache = LRUCache(RESPONSE_CACHE_MAX_ITEMS, IDEMPOTENCY_TTL_HOURS * 3600)
+
+def _idempotency_key(user_id, key):
+    return f"idem:{user_id}:{hashlib.sha256(key.encode()).hexdigest()}"
+
+def get_idempotent_response(user_id, key):
+    """התשובה שנשמרה לאותו Idempotency-Key: {"fingerprint", "status_code", "body"} או None"""
+    cache_key = _idempotency_key(user_id, key)
+    entry = idempotency_cache.get(cache_key)
+    if entry is None and cache_client:
+        try:
+            raw = cache_client.get(cache_key)
+            entry = json.loads(raw) if raw else None
+        except Exception:
+            entry = None
+        if entry is not None:
+            idempotency_cache.set(cache_key, entry)
+    return entry
+
+def set_idempotent_response(user_id, key, fingerprint, status_code, body):
+    """fingerprint מזהה את תוכן הבקשה - אותו מפתח עם תמונה אחרת הוא שגיאה של הלקוח ולא ניסיון חוזר"""
+    cache_key = _idempotency_key(user_id, key)
+    entry = {"fingerprint": fingerprint, "status_code": status_code, "body": body}
+    idempotency_cache.set(cache_key, entry)
+    if cache_client:
+        try:
+            cache_client.setex(cache_key, IDEMPOTENCY_TTL_HOURS * 3600, json.dumps(entry, default=str))
+        except Exception as e:
+            print(f"Error saving idempotent response: {e}")
@@ -1,7 +1,13 @@
 import psycopg2
-import re
-import json
+import psycopg2.extensions
+from psycopg2.extras import execute_values
 import os
+import threading
+import time
+from contextlib import contextmanager
+from cache_handler import invalidate_user_cache
+from tracing import span, traced
+from model_output import loads_tolerant, parse_model_output, normalize_model_output
 
 # --- פרטי התחברות ---
 DB_HOST = os.getenv("DB_HOST", "database-1.cmtkkqyiagdy.us-east-1.rds.amazonaws.com")
@@ -9,133 +15,377 @@ DB_NAME = os.getenv("DB_NAME", "postgres")
 DB_USER = os.getenv("DB_USER", "postgres")
 # ⚠️ WARNING: Fallback password only for testing. In production, always use environment variables!
 DB_PASS = os.getenv("DB_PASS", os.getenv("DATABASE_PASSWORD", "Karina1256"))  # Fallback for testing only 
+DB_PORT = int(os.getenv("DB_PORT", "5432"))
+DB_SSLMODE = os.getenv("DB_SSLMODE", "require")  # ל-Postgres מקומי (בנצ'מרקים) אפשר disable
+
+# --- הגדרות Pool (נשמר ברמת המודול ולכן שורד בין הרצות "חמות" של הלמבדה) ---
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "5"))
+DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))  # שניות עד סגירת חיבור שלא היה בשימוש
+DB_POOL_HEALTH_CHECK_AFTER = float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", "30"))  # חיבור שנח יותר מזה נבדק עם SELECT 1
+DB_POOL_WAIT_TIMEOUT = float(os.getenv("DB_POOL_WAIT_TIMEOUT", "10"))  # זמן המתנה מקסימלי לחיבור פנוי
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Pool פשוט ו-thread-safe של חיבורי psycopg2 עם בדיקות תקינות, פינוי חיבורים רדומים ומונים"""
+
+    def __init__(self, connect, max_size=DB_POOL_MAX_SIZE, idle_timeout=DB_POOL_IDLE_TIMEOUT,
+                 health_check_after=DB_POOL_HEALTH_CHECK_AFTER, wait_timeout=DB_POOL_WAIT_TIMEOUT):
+        self._connect = connect
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.wait_timeout = wait_timeout
+        self._idle = []  # רשימת (conn, last_used) - LIFO כדי להעדיף את החיבור ה"חם" ביותר
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "waits": 0,
+            "wait_time_ms": 0.0,
+            "max_wait_ms": 0.0,
+            "health_check_failures": 0,
+            "evicted": 0,
+            "discarded": 0,
+        }
+
+    def _evict_idle_locked(self):
+        now = time.monotonic()
+        keep = []
+        for conn, last_used in self._idle:
+            if now - last_used > self.idle_timeout:
+                self._close_quietly(conn)
+                self._stats["evicted"] += 1
+            else:
+                keep.append((conn, last_used))
+        self._idle = keep
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_after:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.wait_timeout
+        waited = False
+        with self._cond:
+            while True:
+                self._evict_idle_locked()
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.max_size:
+                    conn, last_used = None, None
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"No free DB connection after {self.wait_timeout}s")
+                waited = True
+                self._cond.wait(remaining)
+
+            if waited:
+                wait_ms = (time.monotonic() - start) * 1000
+                self._stats["waits"] += 1
+                self._stats["wait_time_ms"] += wait_ms
+                self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], wait_ms)
+
+        # בדיקת תקינות ופתיחת חיבור חדש נעשים מחוץ למנעול
+        if conn is not None:
+            if self._is_healthy(conn, last_used):
+                with self._cond:
+                    self._stats["hits"] += 1
+                return conn
+            self._close_quietly(conn)
+            with self._cond:
+                self._stats["health_check_failures"] += 1
+
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats["misses"] += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                # חיבור שחוזר ל-Pool חייב להיות נקי מטרנזקציה פתוחה
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        with self._cond:
+            self._in_use -= 1
+            if discard or conn.closed:
+                self._close_quietly(conn)
+                self._stats["discarded"] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            for conn, _ in self._idle:
+                self._close_quietly(conn)
+            self._idle = []
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["in_use"] = self._in_use
+            stats["idle"] = len(self._idle)
+            stats["max_size"] = self.max_size
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / total, 3) if total else 0.0
+        return stats
+
+
+class TracedCursor(psycopg2.extensions.cursor):
+    """cursor שמודד כל פנייה ל-DB כשלב db.query (כולל אלה של execute_values)"""
+
+    def execute(self, query, vars=None):
+        with span("db.query"):
+            return super().execute(query, vars)
+
+
+def _open_connection():
+    return psycopg2.connect(
+        host=DB_HOST,
+        port=DB_PORT,
+        database=DB_NAME,
+        user=DB_USER,
+        password=DB_PASS,
+        sslmode=DB_SSLMODE,
+        connect_timeout=5,
+        cursor_factory=TracedCursor
+    )
+
+_pool = ConnectionPool(_open_connection)
 
 def get_db_connection():
+    """מחזיר חיבור מה-Pool (או None בשגיאה). יש להחזיר אותו עם release_db_connection"""
     if not DB_PASS:
         print("❌ Error: DB_PASS environment variable is not set!")
         return None
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS,
-            sslmode='require'
-        )
-        return conn
+        with span("db.connect"):
+            return _pool.acquire()
     except Exception as e:
         print(f"❌ Error connecting to DB: {e}")
         return None
 
-def repair_json_string(text):
+def release_db_connection(conn, discard=False):
+    if conn is not None:
+        _pool.release(conn, discard=discard)
+
+@contextmanager
+def db_connection():
     """
-    פונקציית קסם: מתקנת שגיאות נפוצות של ה-AI ב-JSON
+    Context manager לשימוש בכל הקוד:
+        with db_connection() as conn:
+            if not conn: ...
+    החיבור חוזר ל-Pool בסוף הבלוק (עם rollback אם נשארה טרנזקציה פתוחה)
     """
-    # תיקון 1: הוספת גרשיים חסרים בהתחלה (כמו במקרה של ה-phosphorus)
-    # מחפש: : 476 mg", ומחליף ב: : "476 mg",
-    text = re.sub(r':\s*(\d+(?:\.\d+)?\s*[a-zA-Z%]+)(?=")', r': "\1', text)
-    
-    # תיקון 2: הוספת גרשיים אם חסרים משני הצדדים
-    # מחפש: : 476 mg, ומחליף ב: : "476 mg",
-    text = re.sub(r':\s*(\d+(?:\.\d+)?\s*[a-zA-Z%]+)(?=[,}])', r': "\1"', text)
-    
-    return text
+    conn = get_db_connection()
+    discard = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        # חיבור שנפל באמצע - לא מחזירים אותו ל-Pool
+        discard = True
+        raise
+    finally:
+        release_db_connection(conn, discard=discard)
+
+def fetch_all(conn, query, params=None):
+    """מריץ שאילתה ומחזיר רשימת dict-ים (עמודה -> ערך) - תחליף קל ל-pd.read_sql(...).to_dict(orient="records")"""
+    cur = conn.cursor()
+    cur.execute(query, params)
+    columns = [desc[0] for desc in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
 
+def get_pool_stats():
+    """מוני hit/miss/המתנה של ה-Pool - לראות כמה handshakes נחסכו"""
+    return _pool.stats()
+
+@traced("json.repair")
 def extract_json_from_text(text):
-    print("\n🔍 --- DEBUG: מתחיל ניתוח וניקוי טקסט ---")
-    
-    # שלב א': מציאת הסוגריים המסולסלים
-    start_index = text.find('{')
-    end_index = text.rfind('}')
-    
-    if start_index == -1 or end_index == -1:
-        print("❌ לא נמצאו סוגריים מסולסלים JSON בטקסט.")
-        return None
-        
-    clean_json = text[start_index : end_index + 1]
-    
-    # שלב ב': הפעלת התיקון האוטומטי
-    fixed_json = repair_json_string(clean_json)
-    
-    try:
-        # נסיון המרה
-        return json.loads(fixed_json)
-    except json.JSONDecodeError as e:
-        print(f"⚠️ נכשל בנסיון ראשון, מנסה ניקוי אגרסיבי יותר... ({e})")
-        # לפעמים יש בעיות עם שורות חדשות
-        fixed_json = fixed_json.replace('\n', ' ')
-        try:
-            return json.loads(fixed_json)
-        except:
-            print(f"❌ שגיאה סופית בפענוח ה-JSON.\nהנה הטקסט הבעייתי:\n{fixed_json[:200]}...")
+    """ה-JSON הגולמי מתשובת המודל (json.loads מהיר, ורק אם נכשל - הפרסר הסובלני) או None"""
+    data = loads_tolerant(text)
+    if data is None:
+        print(f"❌ שגיאה בפענוח ה-JSON.\nהנה הטקסט הבעייתי:\n{(text or '')[:200]}...")
+    return data
+
+@traced("db.save")
+def save_meal_to_db(user_id, image_url, ai_json_text, data=None):
+    """
+    שומר את הניתוח ומחזיר את ה-meal_id החדש (או None אם השמירה נכשלה).
+    data - ה-JSON של הניתוח אם הקורא כבר פענח אותו (הזרמה), כדי לא לפענח את ai_json_text פעם שנייה.
+    """
+    print(f"🚀 Database Save Started - User: {user_id}, URL: {image_url}")
+    with db_connection() as conn:
+        if not conn:
             return None
+        meal_id = _save_meal(conn, user_id, image_url, ai_json_text, data)
+    if meal_id is not None:
+        # הדוח וההמלצות השמורים של המשתמש כבר לא עדכניים
+        invalidate_user_cache(user_id)
+    return meal_id
 
-def parse_quantity(value_str):
-    if not isinstance(value_str, str):
-        # אם ה-AI החזיר מספר במקום טקסט (למשל 500 במקום "500 mg")
-        if isinstance(value_str, (int, float)):
-            return float(value_str), "unknown"
-        return 0, ""
-        
-    clean_str = str(value_str).strip()
-    match = re.match(r"([\d\.]+)\s*([a-zA-Z]+)", clean_str)
-    if match:
-        return float(match.group(1)), match.group(2).lower()
-    return 0, ""
+@traced("db.save")
+def save_meals_to_db(user_id, entries):
+    """
+    שומר כמה ניתוחים של אותו משתמש בטרנזקציה אחת. entries = [(image_url, ai_json_text), ...].
+    מחזיר meal_id לכל רשומה (None לניתוח שלא ניתן לפענח, או לכולן אם הטרנזקציה נכשלה).
+    """
+    print(f"🚀 Database Batch Save Started - User: {user_id}, Meals: {len(entries)}")
+    with db_connection() as conn:
+        if not conn:
+            return [None] * len(entries)
+        meal_ids = _save_meals(conn, user_id, entries)
+    if any(meal_id is not None for meal_id in meal_ids):
+        invalidate_user_cache(user_id)
+    return meal_ids
 
-def save_meal_to_db(user_id, image_url, ai_json_text):
-    print(f"🚀 Database Save Started - User: {user_id}, URL: {image_url}")
-    conn = get_db_connection()
-    if not conn:
-        return
+def _save_meal(conn, user_id, image_url, ai_json_text, data=None):
+    return _save_meals(conn, user_id, [(image_url, ai_json_text)], decoded=[data])[0]
+
+def _save_meals(conn, user_id, entries, decoded=None):
+    """
+    שומר ארוחות, פריטים וויטמינים במספר קבוע של פניות ל-DB (ולא פנייה לכל שורה), בלי קשר לכמות הארוחות:
+    הקצאת מזהי ארוחות ופריטים -> כל הארוחות ב-INSERT אחד -> כל הפריטים ב-INSERT אחד
+    -> כל הויטמינים ב-INSERT אחד -> עדכון הסיכום היומי -> commit
+    decoded - רשימה מקבילה ל-entries עם ה-JSON שכבר פוענח (או None ברשומה שצריך לפענח).
+    """
+    # nutrients -> reference_data -> db_handler: נטען רק כאן כדי לא ליצור import מעגלי
+    from nutrients import get_nutrient_dictionary, resolve_nutrient
+
+    meal_ids = [None] * len(entries)
     try:
-        # כאן אנחנו משתמשים ב-ai_json_text שקיבלנו
-        data = extract_json_from_text(ai_json_text)
-        if not data:
-            return
-        
+        # פענוח ונרמול היחידות - הפריטים מגיעים מוכנים לשורות של ה-DB
+        parsed = []
+        for index, (image_url, ai_json_text) in enumerate(entries):
+            with span("json.repair"):
+                if decoded and decoded[index]:
+                    data = normalize_model_output(decoded[index])  # כבר פוענח - רק הנרמול
+                else:
+                    data = parse_model_output(ai_json_text)
+            if data:
+                parsed.append((index, image_url, data))
+            else:
+                print(f"❌ שגיאה בפענוח ה-JSON.\nהנה הטקסט הבעייתי:\n{(ai_json_text or '')[:200]}...")
+        if not parsed:
+            return meal_ids
+
         cur = conn.cursor()
-        summary = data.get('overall_analysis', 'No summary')
 
+        # 1. מקצים מראש את כל ה-meal_id וה-item_id מה-sequences כדי לקשר אליהם את השורות בלי RETURNING לכל שורה.
+        # CURRENT_DATE הוא היום של created_at (שניהם לפי תחילת הטרנזקציה)
+        n_items = sum(len(data['items']) for _, _, data in parsed)
         cur.execute("""
-            INSERT INTO meals (user_id, image_url, ai_analysis_summary)
-            VALUES (%s, %s, %s) RETURNING meal_id;
-        """, (user_id, image_url, summary))
+            SELECT 'meal', nextval(pg_get_serial_sequence('meals', 'meal_id')), CURRENT_DATE FROM generate_series(1, %s)
+            UNION ALL
+            SELECT 'item', nextval(pg_get_serial_sequence('food_items', 'item_id')), CURRENT_DATE FROM generate_series(1, %s);
+        """, (len(parsed), n_items))
+        reserved = cur.fetchall()
+        meal_day = reserved[0][2]
+        new_meal_ids = [row[1] for row in reserved if row[0] == 'meal']
+        item_ids = iter([row[1] for row in reserved if row[0] == 'item'])
 
-        meal_id = cur.fetchone()[0]
-        print(f"💾 ארוחה נשמרה! (ID: {meal_id})")
-        
-        # 2. Items
-        items = data.get('items', [])
-        for item in items:
-            food_name = item.get('food_name', 'Unknown')
-            weight = item.get('estimated_weight_grams', 0)
-            macros = item.get('macros', {})
-            
-            cur.execute("""
-                INSERT INTO food_items (meal_id, food_name, estimated_weight_g, calories_kcal, protein_g, carbs_g, fat_g)
-                VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING item_id;
-            """, (meal_id, food_name, weight, macros.get('calories', 0), macros.get('protein', 0), macros.get('carbs', 0), macros.get('fat', 0)))
-            item_id = cur.fetchone()[0]
-
-            # 3. Micros
-            micros = item.get('micros', {})
-            count = 0
-            for k, v in micros.items():
-                amount, unit = parse_quantity(v)
-                if amount > 0:
-                    cur.execute("""
-                        INSERT INTO consumed_micros (item_id, nutrient_name, amount, unit)
-                        VALUES (%s, %s, %s, %s);
-                    """, (item_id, k, amount, unit))
-                    count += 1
-            print(f"   > {food_name}: נשמרו {count} ויטמינים.")
+        # המילון הקנוני מהזיכרון (בלי פנייה ל-DB, חוץ מבדיקת גרסה מדי פעם) - כל רכיב נשמר עם nutrient_id וביחידה הקנונית.
+        # בלי מילון (ReferenceDataUnavailable) השמירה נכשלת, ולא נשמרים רכיבים בלי nutrient_id שלא ייכנסו לסיכום
+        dictionary = get_nutrient_dictionary(conn)
+
+        meal_rows = []
+        item_rows = []
+        micro_rows = []
+        day_totals = {}
+        for meal_id, (index, image_url, data) in zip(new_meal_ids, parsed):
+            meal_ids[index] = meal_id
+            meal_rows.append((meal_id, user_id, image_url, data['overall_analysis']))
+
+            # 2. Items
+            for item in data['items']:
+                item_id = next(item_ids)
+                food_name = item['food_name']
+                macros = item['macros']
+                item_rows.append((item_id, meal_id, food_name, item['estimated_weight_grams'], macros['calories'], macros['protein'], macros['carbs'], macros['fat']))
+
+                # 3. Micros - כבר מפורקים לכמות ויחידה (רק כמויות חיוביות)
+                unresolved = 0
+                for nutrient_name, amount, unit in item['micros']:
+                    resolved = resolve_nutrient(dictionary, nutrient_name, amount, unit)
+                    if resolved is None:
+                        # שם / יחידה לא מוכרים - נשמר כמו שהוא, בלי nutrient_id ומחוץ לסיכום היומי
+                        micro_rows.append((item_id, None, nutrient_name, amount, unit))
+                        unresolved += 1
+                        continue
+                    nutrient_id, amount, unit = resolved
+                    micro_rows.append((item_id, nutrient_id, dictionary["by_id"][nutrient_id]["name"], amount, unit))
+                    day_totals[nutrient_id] = day_totals.get(nutrient_id, 0) + amount
+                print(f"   > {food_name}: נשמרו {len(item['micros'])} ויטמינים."
+                      + (f" ({unresolved} לא מזוהים)" if unresolved else ""))
+
+        execute_values(cur, """
+            INSERT INTO meals (meal_id, user_id, image_url, ai_analysis_summary)
+            VALUES %s;
+        """, meal_rows, page_size=len(meal_rows))
+        if item_rows:
+            execute_values(cur, """
+                INSERT INTO food_items (item_id, meal_id, food_name, estimated_weight_g, calories_kcal, protein_g, carbs_g, fat_g)
+                VALUES %s;
+            """, item_rows, page_size=len(item_rows))
+        if micro_rows:
+            execute_values(cur, """
+                INSERT INTO consumed_micros (item_id, nutrient_id, nutrient_name, amount, unit)
+                VALUES %s;
+            """, micro_rows, page_size=len(micro_rows))
+
+        if day_totals:
+            # 4. עדכון הסיכום היומי (daily_nutrient_totals) - באותה טרנזקציה, כדי שהדוחות לא יצטרכו לסכום מחדש.
+            # השורות ממוינות לפי nutrient_id: שתי שמירות במקביל לאותו משתמש ויום נועלות אותן באותו סדר (בלי deadlock)
+            execute_values(cur, """
+                INSERT INTO daily_nutrient_totals (user_id, day, nutrient_id, amount)
+                VALUES %s
+                ON CONFLICT (user_id, day, nutrient_id)
+                DO UPDATE SET amount = daily_nutrient_totals.amount + EXCLUDED.amount;
+            """, [(user_id, meal_day, nutrient_id, total) for nutrient_id, total in sorted(day_totals.items())], page_size=len(day_totals))
 
         conn.commit()
+        for meal_id in new_meal_ids:
+            print(f"💾 ארוחה נשמרה! (ID: {meal_id})")
         print("✅ הכל נשמר בהצלחה!")
+        return meal_ids
         
     except Exception as e:
         print(f"❌ שגיאה בשמירה: {e}")
-        if conn: conn.rollback()
-    finally:
-        if conn: conn.close()
\ No newline at end of file
+        conn.rollback()
+        return [None] * len(entries)
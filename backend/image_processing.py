@@ -0,0 +1,80 @@
+import hashlib
+import os
+from io import BytesIO
+
+from cache_handler import LRUCache
+
+# הגדרות עיבוד התמונה לפני Bedrock
+# 1568 פיקסלים בצלע הארוכה - מעבר לזה המודל מקטין בעצמו, כך שאנחנו רק משלמים על העברה וטוקנים
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1568"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_PREPROCESS = os.getenv("IMAGE_PREPROCESS", "1") == "1"
+IMAGE_CACHE_MAX_ITEMS = int(os.getenv("IMAGE_CACHE_MAX_ITEMS", "32"))
+
+# הפורמטים ש-Bedrock מקבל ישירות
+SUPPORTED_MEDIA_TYPES = ("image/jpeg", "image/png", "image/gif", "image/webp")
+
+# תמונות מעובדות לפי hash של המקור - חוסך עיבוד חוזר של אותה תמונה באותו קונטיינר
+_derived_cache = LRUCache(IMAGE_CACHE_MAX_ITEMS, 3600)
+
+def detect_media_type(image_bytes):
+    """זיהוי הפורמט האמיתי לפי ה-magic bytes (ולא לפי שם הקובץ)"""
+    header = bytes(image_bytes[:12])
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    if header[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1", b"ftypmsf1"):
+        return "image/heic"
+    return "application/octet-stream"
+
+def _downscale(image_bytes, max_dimension, quality):
+    from PIL import Image, ImageOps
+
+    with Image.open(BytesIO(image_bytes)) as img:
+        # האם יש בכלל סיבה לקודד מחדש (גודל / EXIF / מצב צבע)
+        needs_change = max(img.size) > max_dimension or bool(img.getexif()) or img.mode not in ("RGB", "L")
+        # סיבוב לפי ה-EXIF לפני שזורקים אותו, אחרת תמונות מהטלפון יוצאות הפוכות
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.thumbnail((max_dimension, max_dimension))
+        out = BytesIO()
+        # שמירה מחדש בלי exif= מסירה את כל ה-EXIF (כולל מיקום GPS)
+        img.save(out, format="JPEG", quality=quality, optimize=True)
+        return out.getvalue(), needs_change
+
+def prepare_image_for_model(image_bytes, max_dimension=None, quality=None):
+    """
+    מקטין ודוחס את התמונה לרזולוציה שהמודל באמת משתמש בה.
+    מחזיר (bytes, media_type). אם Pillow לא מותקן או שהפענוח נכשל - מחזיר את המקור כמו שהוא.
+    """
+    media_type = detect_media_type(image_bytes)
+    if not IMAGE_PREPROCESS:
+        return image_bytes, media_type
+
+    max_dimension = max_dimension or IMAGE_MAX_DIMENSION
+    quality = quality or IMAGE_JPEG_QUALITY
+    key = f"{hashlib.sha256(image_bytes).hexdigest()}:{max_dimension}:{quality}"
+    cached = _derived_cache.get(key)
+    if cached is not None:
+        return cached
+
+    try:
+        processed, needs_change = _downscale(image_bytes, max_dimension, quality)
+    except Exception as e:
+        print(f"⚠️ Image preprocessing skipped ({media_type}): {e}")
+        return image_bytes, media_type
+
+    if not needs_change and len(processed) >= len(image_bytes) and media_type in SUPPORTED_MEDIA_TYPES:
+        # תמונה שכבר קטנה ונקייה - דחיסה חוזרת רק הייתה מגדילה אותה
+        result = (image_bytes, media_type)
+    else:
+        result = (processed, "image/jpeg")
+
+    _derived_cache.set(key, result)
+    return result
@@ -0,0 +1,305 @@
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from aws_clients import get_client, get_s3_client
+from cache_handler import cache_client, image_cache_keys, set_analysis_cache
+from db_handler import save_meal_to_db
+from nutrition_ai import analyze_food_image
+
+# מצב Submit/Poll: ה-endpoint רק מכניס עבודה לתור ומחזיר job_id, ו-worker מנתח ושומר.
+# memory - תור בתוך התהליך (הרצה מקומית / Uvicorn), sqs - תור SQS שה-event source mapping שלו מפעיל
+# Worker Lambda עם job_queue.sqs_handler, redis - רשימה ב-Redis שרק worker חיצוני (python job_queue.py) מרוקן.
+# ברירת המחדל היא memory: תור חיצוני נבחר רק במפורש, כשיש worker שמושך ממנו - אחרת עבודות נשארות queued
+ANALYSIS_QUEUE_BACKEND = os.getenv("ANALYSIS_QUEUE_BACKEND", "memory")
+ANALYSIS_QUEUE_NAME = os.getenv("ANALYSIS_QUEUE_NAME", "analysis:jobs")
+ANALYSIS_QUEUE_URL = os.getenv("ANALYSIS_QUEUE_URL")  # נדרש רק עבור sqs
+ANALYSIS_WORKER_CONCURRENCY = int(os.getenv("ANALYSIS_WORKER_CONCURRENCY", "4"))  # קריאות Bedrock במקביל לכל worker
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "86400"))
+
+
+class JobStore:
+    """מצב העבודות: ב-Redis כשיש (משותף לכל הקונטיינרים), אחרת dict בזיכרון התהליך"""
+
+    def __init__(self, client=None, ttl=JOB_TTL_SECONDS):
+        self.client = client
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def get(self, job_id):
+        if self.client:
+            try:
+                raw = self.client.get(f"job:{job_id}")
+                return json.loads(raw) if raw else None
+            except Exception as e:
+                print(f"Error reading job {job_id}: {e}")
+                return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job and job["updated_at"] + self.ttl < time.time():
+                del self._jobs[job_id]
+                return None
+            return dict(job) if job else None
+
+    def put(self, job):
+        job["updated_at"] = time.time()
+        if self.client:
+            try:
+                self.client.setex(f"job:{job['job_id']}", self.ttl, json.dumps(job))
+            except Exception as e:
+                print(f"Error saving job {job['job_id']}: {e}")
+            return
+        with self._lock:
+            self._jobs[job["job_id"]] = dict(job)
+
+    def update(self, job_id, **fields):
+        job = self.get(job_id) or {"job_id": job_id}
+        job.update(fields)
+        self.put(job)
+        return job
+
+
+class InProcessQueue:
+    """תור בזיכרון להרצה מקומית - ה-worker רץ ב-thread ברקע של אותו תהליך"""
+
+    carries_image = True  # אפשר להעביר את ה-bytes עצמם בלי להוריד מ-S3
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def put(self, message):
+        self._queue.put(message)
+
+    def get(self, timeout):
+        try:
+            return self._queue.get(timeout=timeout), None
+        except queue.Empty:
+            return None, None
+
+    def ack(self, receipt):
+        pass
+
+
+class RedisQueue:
+    """רשימה ב-Redis (LPUSH / BRPOP) - כל קונטיינר שמריץ run_worker מושך ממנה"""
+
+    carries_image = False
+
+    def __init__(self, client, name=ANALYSIS_QUEUE_NAME):
+        self.client = client
+        self.name = name
+
+    def put(self, message):
+        self.client.lpush(self.name, json.dumps(message))
+
+    def get(self, timeout):
+        item = self.client.brpop(self.name, timeout=max(int(timeout), 1))
+        return (json.loads(item[1]), None) if item else (None, None)
+
+    def ack(self, receipt):
+        pass
+
+
+class SQSQueue:
+    """תור SQS - ה-worker הוא Lambda עם SQS trigger (sqs_handler) או run_worker עם long polling"""
+
+    carries_image = False
+
+    def __init__(self, queue_url=ANALYSIS_QUEUE_URL):
+        self.queue_url = queue_url
+
+    def put(self, message):
+        get_client("sqs").send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(message))
+
+    def get(self, timeout):
+        response = get_client("sqs").receive_message(
+            QueueUrl=self.queue_url, MaxNumberOfMessages=1, WaitTimeSeconds=min(max(int(timeout), 1), 20)
+        )
+        messages = response.get("Messages", [])
+        if not messages:
+            return None, None
+        return json.loads(messages[0]["Body"]), messages[0]["ReceiptHandle"]
+
+    def ack(self, receipt):
+        get_client("sqs").delete_message(QueueUrl=self.queue_url, ReceiptHandle=receipt)
+
+
+def _make_queue(backend):
+    if backend == "sqs" and ANALYSIS_QUEUE_URL:
+        return SQSQueue()
+    if backend == "redis" and cache_client:
+        return RedisQueue(cache_client)
+    if backend != "memory":
+        print(f"⚠️ Queue backend '{backend}' is not configured, using the in-process queue")
+    return InProcessQueue()
+
+
+job_queue = _make_queue(ANALYSIS_QUEUE_BACKEND)
+job_store = JobStore(cache_client)
+_local_worker = None
+_local_worker_lock = threading.Lock()
+
+
+def submit_job(user_id, image, image_url, filename):
+    """יוצר עבודה במצב queued ומכניס אותה לתור. מחזיר את רשומת העבודה."""
+    job = {"job_id": uuid.uuid4().hex, "user_id": user_id, "status": "queued", "stage": "queued",
+           "image_url": image_url, "created_at": time.time()}
+    job_store.put(job)
+
+    message = {"job_id": job["job_id"], "user_id": user_id, "image_url": image_url, "filename": filename}
+    if job_queue.carries_image:
+        message["image"] = bytes(image)
+    job_queue.put(message)
+
+    if isinstance(job_queue, InProcessQueue):
+        _ensure_local_worker()
+    return job
+
+
+def has_external_worker():
+    """תור חיצוני (SQS / Redis) - העבודה רצה ב-worker אחר, מחוץ לבקשה ולתהליך הזה"""
+    return not isinstance(job_queue, InProcessQueue)
+
+
+def submit_save(user_id, image_url, analysis_text):
+    """
+    שמירה של ניתוח שכבר הסתיים, כעבודה בתור (kind=save) - ב-Lambda זה מוציא את השמירה ב-DB מזמן הבקשה,
+    כי Mangum מחכה ל-BackgroundTasks לפני שהוא מחזיר תשובה. מחזיר את רשומת העבודה.
+    """
+    job = {"job_id": uuid.uuid4().hex, "user_id": user_id, "status": "queued", "stage": "saving",
+           "image_url": image_url, "created_at": time.time()}
+    job_store.put(job)
+    job_queue.put({"kind": "save", "job_id": job["job_id"], "user_id": user_id, "image_url": image_url,
+                   "data": analysis_text})
+    return job
+
+
+def get_job(job_id):
+    return job_store.get(job_id)
+
+
+def _download_image(image_url):
+    """ה-worker מקבל רק את כתובת התמונה - מורידים אותה מ-S3"""
+    bucket = image_url.split("//", 1)[1].split(".", 1)[0]
+    key = image_url.split(".amazonaws.com/", 1)[1]
+    return get_s3_client().get_object(Bucket=bucket, Key=key)["Body"].read()
+
+
+def _process_save(message):
+    """עבודת save: רק השמירה ב-DB. SQS עלול למסור הודעה פעמיים - עבודה שכבר הסתיימה לא נשמרת שוב"""
+    job_id = message["job_id"]
+    if (job_store.get(job_id) or {}).get("status") == "done":
+        return
+    try:
+        job_store.update(job_id, status="running", stage="saving")
+        meal_id = save_meal_to_db(message["user_id"], message["image_url"], message["data"])
+        if meal_id is None:
+            job_store.update(job_id, status="failed", stage="saving", error="Save failed", saved=False)
+            return
+        job_store.update(job_id, status="done", stage="done", meal_id=meal_id, saved=True)
+    except Exception as e:
+        print(f"❌ Save job {job_id} failed: {e}")
+        job_store.update(job_id, status="failed", error=str(e), saved=False)
+
+
+def process_job(message):
+    """ניתוח תמונה אחת מהתור ושמירתה - אותו רצף כמו ב-/analyze הסינכרוני"""
+    if message.get("kind") == "save":
+        return _process_save(message)
+    job_id = message["job_id"]
+    try:
+        job_store.update(job_id, status="running", stage="analyzing")
+        image = message.get("image") or _download_image(message["image_url"])
+
+        analysis_result = analyze_food_image(image)
+        if not analysis_result:
+            job_store.update(job_id, status="failed", stage="analyzing", error="Analysis failed")
+            return
+
+        image_url = message.get("image_url")
+        if not image_url:
+            # בלי תמונה ב-S3 אין מה לשמור - הניתוח מוחזר, אבל העבודה נכשלה (saved=False)
+            print("⚠️ Warning: image_url is None, skipping database save")
+            job_store.update(job_id, status="failed", stage="saving", error="Upload failed, meal not saved",
+                             data=analysis_result, saved=False)
+            return
+
+        set_analysis_cache(image_cache_keys(image), {"data": analysis_result, "image_url": image_url})
+        job_store.update(job_id, stage="saving")
+        meal_id = save_meal_to_db(message["user_id"], image_url, analysis_result)
+        if meal_id is None:
+            job_store.update(job_id, status="failed", stage="saving", error="Save failed",
+                             data=analysis_result, saved=False)
+            return
+
+        job_store.update(job_id, status="done", stage="done", data=analysis_result, meal_id=meal_id, saved=True)
+    except Exception as e:
+        print(f"❌ Job {job_id} failed: {e}")
+        job_store.update(job_id, status="failed", error=str(e))
+
+
+def run_worker(max_concurrency=ANALYSIS_WORKER_CONCURRENCY, max_jobs=None, idle_timeout=None, poll_seconds=5):
+    """
+    מושך עבודות מהתור ומעבד עד max_concurrency במקביל (הסמפור מונע משיכה של יותר ממה שאפשר לעבד).
+    עוצר אחרי max_jobs עבודות או אחרי idle_timeout שניות בלי עבודה (None = לנצח).
+    """
+    slots = threading.BoundedSemaphore(max_concurrency)
+    processed = 0
+    idle_since = time.monotonic()
+
+    def run(message, receipt):
+        try:
+            process_job(message)
+            if receipt:
+                job_queue.ack(receipt)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        while max_jobs is None or processed < max_jobs:
+            slots.acquire()
+            try:
+                message, receipt = job_queue.get(poll_seconds)
+            except Exception as e:
+                print(f"Error reading from job queue: {e}")
+                message, receipt = None, None
+            if message is None:
+                slots.release()
+                if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                    break
+                continue
+            idle_since = time.monotonic()
+            processed += 1
+            pool.submit(run, message, receipt)
+    return processed
+
+
+def _ensure_local_worker():
+    """בתור בתוך התהליך - worker ב-thread רקע שעולה עם העבודה הראשונה"""
+    global _local_worker
+    with _local_worker_lock:
+        if _local_worker is None or not _local_worker.is_alive():
+            _local_worker = threading.Thread(target=run_worker, kwargs={"poll_seconds": 1}, daemon=True)
+            _local_worker.start()
+
+
+def sqs_handler(event, context):
+    """
+    Handler ל-Worker Lambda עם SQS trigger. כל batch מעובד במקביל (עד ANALYSIS_WORKER_CONCURRENCY),
+    ו-SQS מוחק את ההודעות בעצמו כשה-handler מסתיים בהצלחה.
+    """
+    messages = [json.loads(record["body"]) for record in event.get("Records", [])]
+    with ThreadPoolExecutor(max_workers=ANALYSIS_WORKER_CONCURRENCY) as pool:
+        list(pool.map(process_job, messages))
+    return {"processed": len(messages)}
+
+
+if __name__ == "__main__":
+    # הרצת worker עצמאי מול Redis/SQS: python job_queue.py
+    print(f"👷 Analysis worker started ({ANALYSIS_QUEUE_BACKEND}, concurrency {ANALYSIS_WORKER_CONCURRENCY})")
+    run_worker()
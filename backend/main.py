@@ -1,7 +1,8 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from mangum import Mangum
-from routers import users, meals, recommendations
+from routers import users, meals, recommendations, debug
+from tracing import TracingMiddleware
 
 app = FastAPI(root_path="/default")
 
@@ -13,9 +14,12 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# מדידת זמנים לכל בקשה ולכל שלב - נוסף אחרון כדי לעטוף את כל השאר
+app.add_middleware(TracingMiddleware)
 
 app.include_router(users.router)
 app.include_router(meals.router)
 app.include_router(recommendations.router)
+app.include_router(debug.router)
 
 handler = Mangum(app)
\ No newline at end of file
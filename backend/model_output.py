@@ -0,0 +1,320 @@
+import json
+import re
+
+# פענוח התשובה של המודל. כל שלב רץ רק אם הקודם נכשל, וכל העבודה על הטקסט המלא נעשית ב-C:
+# 1. json.loads על החלק שבין הסוגריים (JSON תקין, גדרות ```).
+# 2. תיקונים מהשגיאה הראשונה של json.loads והלאה - ערכים בלי גרשיים ("476 mg", כולל גרש סוגר יתום) ופסיקים
+#    מיותרים, ב-re.split ו-re.sub עם החלפה קבועה (בלי קריאה ל-Python לכל התאמה) - ו-json.loads.
+# 3. תשובה שנקטעה: סריקה אחת של הסוגריים, חיתוך אחרי הערך השלם האחרון וסגירת מה שנשאר פתוח.
+# 4. רק מה שגם זה לא קורא עובר לפרסר הסובלני (tokenizer של regex ופענוח ב-Python).
+
+# כל התאמה היא טוקן אחד (הרווחים שלפניו נבלעים): (מחרוזת, פיסוק, ערך בלי גרשיים, מחרוזת שנקטעה)
+_TOKEN = re.compile(r'''\s*(?:
+    ("[^"\\]*(?:\\.[^"\\]*)*")            # מחרוזת שלמה
+  | ([{}\[\]:,])
+  | ([^\s{}\[\]:,"][^{}\[\]:,"\n]*)"?      # ערך בלי גרשיים (476 mg / true / 12.5), כולל גרש סוגר יתום
+  | ("[\s\S]*)                               # מחרוזת שנקטעה בסוף התשובה
+)''', re.VERBOSE)
+
+# התיקונים: ערך עם יחידה בלי גרשיים (עם גרש סוגר יתום או בלי), ופסיק מיותר לפני סוגר
+_UNIT_VALUE = re.compile(r':\s*(-?\d+(?:\.\d+)?\s*[a-zA-Zµμ%]+)"?(?=\s*[,}\]])')
+_TRAILING_COMMA = re.compile(r',(?=\s*[}\]])')
+# לסגירת תשובה שנקטעה: סוגריים, ומחרוזת (או "מפתח": מחרוזת) שלמה בסוף הטקסט
+_ONLY_BRACKETS = {code: None for code in range(128) if chr(code) not in "{}[]"}  # טבלה ל-str.translate
+_COMPLETE_MEMBER = re.compile(r'\s*"[^"\\]*(?:\\.[^"\\]*)*"\s*:\s*"[^"\\]*(?:\\.[^"\\]*)*"\s*\Z')
+_COMPLETE_ELEMENT = re.compile(r'\s*"[^"\\]*(?:\\.[^"\\]*)*"\s*\Z')
+_CLOSERS = {"{": "}", "[": "]"}
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\Z")
+_QUANTITY = re.compile(r"([\d\.]+)\s*([a-zA-Zµμ]+)")  # כולל µg / μg
+_BARE_WORDS = {"true": True, "false": False, "null": None}
+_EOF = object()  # ערך שנקטע - לא נכנס לתוצאה
+_END = ("", "", "", "")
+
+
+def parse_quantity(value_str):
+    if not isinstance(value_str, str):
+        # אם ה-AI החזיר מספר במקום טקסט (למשל 500 במקום "500 mg")
+        if isinstance(value_str, (int, float)):
+            return float(value_str), "unknown"
+        return 0, ""
+
+    clean_str = str(value_str).strip()
+    match = _QUANTITY.match(clean_str)
+    if match:
+        try:
+            return float(match.group(1)), match.group(2).lower()
+        except ValueError:
+            return 0, ""
+    return 0, ""
+
+
+def _bare_value(raw):
+    raw = raw.strip()
+    if raw in _BARE_WORDS:
+        return _BARE_WORDS[raw]
+    if _NUMBER.match(raw):
+        number = float(raw)
+        return int(number) if number.is_integer() and "." not in raw and "e" not in raw.lower() else number
+    return raw
+
+
+def _string_value(raw):
+    body = raw[1:-1]
+    if "\\" not in body:
+        return body
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return body
+
+
+class _TolerantParser:
+    def __init__(self, text):
+        # findall בקריאה אחת (ב-C) - כל טוקן הוא (string, punct, bare, open_string) עם קבוצה אחת לא ריקה
+        self.tokens = _TOKEN.findall(text)
+        self.pos = 0
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else _END
+
+    def parse(self):
+        # דילוג על טקסט חופשי / ``` עד האובייקט הראשון
+        while self.pos < len(self.tokens) and self.tokens[self.pos][1] != "{":
+            self.pos += 1
+        if self.pos >= len(self.tokens):
+            return None
+        value = self._value()
+        return value if isinstance(value, dict) else None
+
+    def _value(self):
+        string, punct, bare, open_string = self._peek()
+        if punct:
+            if punct not in "{[":
+                return None  # פיסוק במקום ערך (": ,") - ערך ריק, והפיסוק נשאר ללולאה שמעל
+            self.pos += 1
+            return self._object() if punct == "{" else self._array()
+        self.pos += 1
+        if string:
+            return _string_value(string)
+        if bare:
+            # ערך בלי גרשיים שמגיע עד סוף הטקסט יכול להיות חתוך (47 במקום 476) - לא משתמשים בו
+            return _EOF if self.pos >= len(self.tokens) else _bare_value(bare)
+        return _EOF  # מחרוזת שנקטעה / סוף הטקסט
+
+    def _object(self):
+        result = {}
+        while True:
+            punct = self._peek()[1]
+            if punct == "}":
+                self.pos += 1
+                return result
+            if punct and punct in ",:]":
+                self.pos += 1  # כולל פסיק מיותר לפני } וסוגר לא מתאים
+                continue
+            if self.pos >= len(self.tokens):
+                return result
+            key = self._value()
+            if key is _EOF:
+                return result
+            if self._peek()[1] == ":":
+                self.pos += 1
+            value = self._value()
+            if value is _EOF:
+                return result
+            if isinstance(key, str):
+                result[key] = value
+
+    def _array(self):
+        result = []
+        while True:
+            punct = self._peek()[1]
+            if punct == "]":
+                self.pos += 1
+                return result
+            if punct and punct in ",:}":
+                self.pos += 1  # פסיק מיותר / סוגר לא מתאים - מתעלמים
+                continue
+            if self.pos >= len(self.tokens):
+                return result
+            value = self._value()
+            if value is _EOF:
+                return result
+            result.append(value)
+
+
+def _loads_object(text):
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _in_string(text, pos):
+    # מספר אי-זוגי של גרשיים (שאינם escaped) לפני pos - התו נמצא בתוך מחרוזת
+    return (text.count('"', 0, pos) - text.count('\\"', 0, pos)) % 2 == 1
+
+
+def _close_truncated(text):
+    """
+    תשובה שנקטעה: חותך אחרי הערך השלם האחרון ומוסיף את הסוגרים שנשארו פתוחים.
+    ערך שמגיע עד הסוף (47 במקום 476, מחרוזת פתוחה) לא נכנס. הסריקות עצמן (rfind / count / split) רצות ב-C.
+    """
+    # התו המבני האחרון מחוץ למחרוזת
+    pos = len(text)
+    while True:
+        found = -1
+        for ch in ",{[}]":  # כל חיפוש רק אחרי מה שכבר נמצא - סוגר נדיר לא סורק את כל הטקסט
+            found = max(found, text.rfind(ch, found + 1, pos))
+        pos = found
+        if pos == -1:
+            return None
+        if not _in_string(text, pos):
+            break
+
+    cut = pos + 1 if text[pos] in "{[}]" else pos
+    # הסוגריים שמחוץ למחרוזות: אחרי split לפי גרשיים (בלי escaped) החלקים הזוגיים הם מה שבין המחרוזות.
+    # מורידים זוגות סגורים עד שנשארים רק הפותחים - המחסנית; כל דבר אחר (סוגר לא תואם) - לא מנחשים
+    outside = "".join(text[:cut].replace('\\"', "").split('"')[::2])
+    stack = outside.translate(_ONLY_BRACKETS)
+    while True:
+        reduced = stack.replace("{}", "").replace("[]", "")
+        if reduced == stack:
+            break
+        stack = reduced
+    if stack.strip("{["):
+        return None
+    # מחרוזת שלמה אחרי התו המבני ("Folate": "97 mcg" ממש לפני החיתוך) היא ערך שלם - נשארת
+    if text[pos] in ",{[" and stack:
+        tail = text[pos + 1:]
+        complete = _COMPLETE_MEMBER if stack[-1] == "{" else _COMPLETE_ELEMENT
+        if complete.match(tail):
+            cut = len(text) if text[pos] == "," else cut
+            prefix = text[:cut] + (tail if text[pos] in "{[" else "")
+            return prefix + "".join(_CLOSERS[bracket] for bracket in reversed(stack))
+    return text[:cut] + "".join(_CLOSERS[bracket] for bracket in reversed(stack))
+
+
+def _repair(text):
+    # split (ב-C) מחזיר את הערכים שצריך לעטוף בגרשיים - בלי קריאה ל-Python לכל התאמה כמו ב-sub עם תבנית
+    parts = _UNIT_VALUE.split(text)
+    parts[1::2] = [f': "{value}"' for value in parts[1::2]]
+    return _TRAILING_COMMA.sub("", "".join(parts))
+
+
+def loads_tolerant(text):
+    """dict מתוך תשובת המודל, או None אם אין בה אובייקט JSON בכלל"""
+    if not text:
+        return None
+    start = text.find("{")
+    if start == -1:
+        return None
+    end = text.rfind("}")
+    # טקסט אחרי ה-} האחרון (שאינו גדר ```) וסוגריים שלא נסגרו - התשובה נקטעה, ו-json.loads עליה רק ייכשל (ביוקר)
+    truncated = (end < start or bool(text[end + 1:].strip(" \t\r\n`"))) and (
+        text.count("{", start) + text.count("[", start) > text.count("}", start) + text.count("]", start))
+    body = text[start:] if truncated else text[start:end + 1]
+    error_at = 0
+    if not truncated:
+        try:
+            data = json.loads(body)
+            if isinstance(data, dict):
+                return data
+        except json.JSONDecodeError as e:
+            error_at = e.pos
+
+    # עד השגיאה הראשונה הטקסט הוא JSON תקין - מתקנים רק מה-":" האחרון שלפניה (הערך שנכשל) והלאה
+    fix_from = max(body.rfind(":", 0, error_at), 0)
+    repaired = body[:fix_from] + _repair(body[fix_from:])
+    if truncated:
+        repaired = _close_truncated(repaired)
+    data = _loads_object(repaired) if repaired else None
+    return data if data is not None else _TolerantParser(text).parse()
+
+
+def _number(value):
+    """ערך מספרי מתוך 100 / "100" / "100g" (ומה שלא ניתן לפענח הוא 0)"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    amount, _unit = parse_quantity(value)
+    return amount
+
+
+def parse_model_output(text):
+    """
+    מפענח את תשובת המודל ומחזיר אותה מנורמלת ומוכנה לשמירה:
+    {"overall_analysis": str, "items": [{"food_name", "estimated_weight_grams", "macros": {...: float},
+    "micros": [(nutrient_name, amount, unit), ...]}]} - רק רכיבים עם כמות חיובית. None אם אין JSON / הוא ריק.
+    """
+    return normalize_model_output(loads_tolerant(text))
+
+
+def normalize_model_output(data):
+    """כמו parse_model_output, ל-JSON שכבר פוענח (למשל ItemStreamParser.finish) - בלי לפענח את הטקסט שוב"""
+    if not data:
+        return None
+
+    items = []
+    raw_items = data.get("items")
+    for raw in raw_items if isinstance(raw_items, list) else []:
+        if not isinstance(raw, dict) or not raw:
+            continue  # כולל פריט שנקטע לפני שהגיע לשדה הראשון
+        macros = raw.get("macros") if isinstance(raw.get("macros"), dict) else {}
+        micros = raw.get("micros") if isinstance(raw.get("micros"), dict) else {}
+        parsed_micros = []
+        for name, value in micros.items():
+            if isinstance(value, dict):
+                # פריט מהכלי המקוצר: הכמות כבר מספר ביחידה הקנונית - בלי מחרוזת לפענח מחדש
+                amount, unit = _number(value.get("amount")), str(value.get("unit") or "").lower()
+            else:
+                amount, unit = parse_quantity(value)
+            if amount > 0:
+                parsed_micros.append((name, amount, unit))
+        items.append({
+            "food_name": str(raw.get("food_name") or "Unknown"),
+            "estimated_weight_grams": _number(raw.get("estimated_weight_grams", 0)),
+            "macros": {key: _number(macros.get(key, 0)) for key in ("calories", "protein", "carbs", "fat")},
+            "micros": parsed_micros,
+        })
+    return {"overall_analysis": data.get("overall_analysis", "No summary"), "items": items}
+
+
+# חוזה הפלט המקוצר (הכלי record_meal ב-nutrition_ai): מפתחות קצרים ומספרים בלבד, כל רכיב ביחידה קבועה -
+# היחידה הקנונית שלו במילון הרכיבים, כך שאין מה לפענח או להמיר. (קוד, שם במילון, יחידה)
+COMPACT_MICROS = [
+    ("va", "Vitamin A", "mcg"), ("vc", "Vitamin C", "mg"), ("vd", "Vitamin D", "mcg"), ("ve", "Vitamin E", "mg"),
+    ("vk", "Vitamin K", "mcg"), ("b1", "Thiamin B1", "mg"), ("b2", "Riboflavin B2", "mg"), ("b3", "Niacin B3", "mg"),
+    ("b6", "Vitamin B6", "mg"), ("b12", "Vitamin B12", "mcg"), ("fol", "Folate", "mcg"), ("ca", "Calcium", "mg"),
+    ("fe", "Iron", "mg"), ("mg", "Magnesium", "mg"), ("p", "Phosphorus", "mg"), ("k", "Potassium", "mg"),
+    ("na", "Sodium", "mg"), ("zn", "Zinc", "mg"), ("cu", "Copper", "mg"), ("se", "Selenium", "mcg"),
+    ("mn", "Manganese", "mg"), ("i", "Iodine", "mcg"),
+]
+
+
+def _amount(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+
+def expand_compact_item(raw):
+    """פריט מקוצר ({"n", "g", "kcal", "p", "c", "f", "u"}) -> פריט בחוזה הרגיל, עם micros כמו {"amount": 2, "unit": "mg"}"""
+    micros = raw.get("u") if isinstance(raw.get("u"), dict) else {}
+    return {
+        "food_name": str(raw.get("n") or "Unknown"),
+        "estimated_weight_grams": _amount(raw.get("g")),
+        "macros": {"calories": _amount(raw.get("kcal")), "protein": _amount(raw.get("p")),
+                   "carbs": _amount(raw.get("c")), "fat": _amount(raw.get("f"))},
+        "micros": {name: {"amount": _amount(micros.get(code)), "unit": unit}
+                   for code, name, unit in COMPACT_MICROS if _amount(micros.get(code)) > 0},
+    }
+
+
+def expand_compact_output(data):
+    """הקלט של record_meal ({"i": [...], "s": "..."}) -> {"overall_analysis", "items"} - החוזה שכל השאר עובד איתו"""
+    raw_items = data.get("i") if isinstance(data, dict) else None
+    items = [expand_compact_item(raw) for raw in raw_items if isinstance(raw, dict) and raw] if isinstance(raw_items, list) else []
+    return {"overall_analysis": str(data.get("s") or "") if isinstance(data, dict) else "", "items": items}
@@ -0,0 +1,57 @@
+import re
+
+from reference_data import ReferenceCache
+
+# מילון הרכיבים הקנוני (טבלת nutrients, מיגרציה 6): שם / כינוי -> nutrient_id, ומקדמי המרה ליחידה הקנונית.
+# נטען לזיכרון כמו שאר טבלאות הייחוס, כך שכל רכיב מזוהה ומומר פעם אחת - בזמן השמירה - בלי פנייה ל-DB.
+_KEY = re.compile(r"[^a-z0-9]")
+
+
+def nutrient_key(name):
+    """מפתח החיפוש של שם רכיב - זהה ל-init_cloud_db.nutrient_key ("Vitamin B-12" -> "vitaminb12")"""
+    return _KEY.sub("", str(name).lower())
+
+
+def unit_key(unit):
+    """"µg" / "μg" -> "ug", ויחידה ריקה היא unknown (מספר בלי יחידה)"""
+    return (unit or "unknown").lower().replace("µ", "u").replace("μ", "u")
+
+
+def build_nutrient_dictionary(columns):
+    by_id = {}
+    by_key = {}
+    for nutrient_id, name, unit, food_column, aliases, unit_factors in zip(
+        columns["nutrient_id"], columns["name"], columns["unit"], columns["food_column"],
+        columns["aliases"], columns["unit_factors"],
+    ):
+        by_id[nutrient_id] = {"name": name, "unit": unit, "food_column": food_column, "unit_factors": unit_factors}
+        by_key[nutrient_key(name)] = nutrient_id
+        for alias in aliases:
+            by_key[nutrient_key(alias)] = nutrient_id
+    return {"by_id": by_id, "by_key": by_key}
+
+
+nutrient_cache = ReferenceCache(
+    "nutrients",
+    "SELECT nutrient_id, name, unit, food_column, aliases, unit_factors FROM nutrients ORDER BY nutrient_id",
+    build_nutrient_dictionary,
+)
+
+
+def get_nutrient_dictionary(conn=None):
+    return nutrient_cache.get(conn)
+
+
+def resolve_nutrient(dictionary, name, amount, unit):
+    """
+    (nutrient_id, amount, unit) ביחידה הקנונית של הרכיב, או None אם הרכיב לא מוכר
+    או שהיחידה לא ניתנת להמרה (למשל IU של מינרל) - כדי שלא תיכנס לסיכום כמות ביחידה אחרת.
+    """
+    nutrient_id = dictionary["by_key"].get(nutrient_key(name))
+    if nutrient_id is None:
+        return None
+    nutrient = dictionary["by_id"][nutrient_id]
+    factor = nutrient["unit_factors"].get(unit_key(unit))
+    if factor is None:
+        return None
+    return nutrient_id, amount * factor, nutrient["unit"]
@@ -1,42 +1,33 @@
-import boto3
 import json
 import base64
 import os
-from botocore.exceptions import ClientError
-from db_handler import save_meal_to_db 
+from image_processing import prepare_image_for_model
+from aws_clients import get_bedrock_client
+from model_output import COMPACT_MICROS, expand_compact_item, expand_compact_output, loads_tolerant
+from stream_parser import ItemStreamParser
+from tracing import span
 
 MODEL_ID = "us.anthropic.claude-sonnet-4-5-20250929-v1:0" 
-REGION = "us-east-1" 
 
-def get_bedrock_client():
-    try:
-        return boto3.client(service_name='bedrock-runtime', region_name=REGION)
-    except ClientError as e:
-        print(f"Error connecting to AWS: {e}")
-        return None
-
-def encode_image_to_base64(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
-
-# --- עדכון: הוספת image_url כפרמטר ---
-def analyze_food_image(image_path, user_id=1, image_url=None):
-    client = get_bedrock_client()
-    if not client:
-        return None
+# פלט מובנה: המודל חייב לקרוא לכלי record_meal, כך שהתשובה היא JSON תקין לפי סכמה (בלי תיקונים),
+# עם מפתחות קצרים ומספרים ביחידות קבועות - פחות טוקני פלט. 0 = ה-JSON החופשי הישן
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "1") == "1"
+# תקציב טוקני הפלט לניתוח (ארוחה גדולה בפורמט המקוצר היא כמה מאות טוקנים)
+ANALYSIS_MAX_TOKENS = int(os.getenv("ANALYSIS_MAX_TOKENS", "2048"))
+# Prompt Caching לכלי ול-system (הקבועים) - נשמרים בצד של Bedrock לכמה דקות בין קריאות.
+# Bedrock שומר רק קידומת מעל מינימום של המודל (1024 טוקנים ב-Sonnet), ואחרת מתעלם מהסימון בלי שגיאה -
+# אם זה קורה בפועל רואים רק מ-cache_creation_input_tokens / cache_read_input_tokens בתשובה (uncached_calls ב-/debug/latency)
+PROMPT_CACHING = os.getenv("PROMPT_CACHING", "1") == "1"
 
-    if not os.path.exists(image_path):
-        print(f"Error: Image not found at {image_path}")
-        return None
-    
-    base64_image = encode_image_to_base64(image_path)
+_usage_stats = {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cache_read_input_tokens": 0,
+                "cache_creation_input_tokens": 0, "max_tokens_stops": 0, "uncached_calls": 0}
 
-    system_prompt = """
-    You are an advanced clinical dietitian AI. 
-    Your goal is to provide a highly detailed nutritional analysis of food images.
-    """
+# ה-system של הניתוח כמו שהיה - הסכמה של הכלי (יחידה לכל רכיב, רק רכיבים משמעותיים) מגדירה את הפלט
+SYSTEM_PROMPT = """You are an advanced clinical dietitian AI.
+Your goal is to provide a highly detailed nutritional analysis of food images."""
 
-    user_message = """
+# ה-JSON החופשי הישן - רק כש-STRUCTURED_OUTPUT=0
+_TEXT_OUTPUT_INSTRUCTIONS = """
     Analyze this meal image with high precision.
     Output structure (JSON only):
     {
@@ -51,41 +42,228 @@ def analyze_food_image(image_path, user_id=1, image_url=None):
         ]
     }
     """
+
+ANALYSIS_TOOL = {
+    "name": "record_meal",
+    "description": "Record the nutritional analysis of the meal in the image.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "i": {
+                "type": "array",
+                "description": "Food items",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "n": {"type": "string", "description": "Food name"},
+                        "g": {"type": "number", "description": "Estimated weight, g"},
+                        "kcal": {"type": "number", "description": "Calories, kcal"},
+                        "p": {"type": "number", "description": "Protein, g"},
+                        "c": {"type": "number", "description": "Carbohydrates, g"},
+                        "f": {"type": "number", "description": "Fat, g"},
+                        "u": {
+                            "type": "object",
+                            "description": "Micronutrients for the portion, only non-negligible ones",
+                            "properties": {code: {"type": "number", "description": f"{name}, {unit}"}
+                                           for code, name, unit in COMPACT_MICROS},
+                            "additionalProperties": False,
+                        },
+                    },
+                    "required": ["n", "g", "kcal", "p", "c", "f", "u"],
+                },
+            },
+            "s": {"type": "string", "description": "Short overall analysis of the meal"},
+        },
+        "required": ["i", "s"],
+    },
+}
+
+# מחזיק מקום לתמונה בתוך ה-JSON - ה-base64 משורשר פעם אחת ישירות לגוף הבקשה
+_IMAGE_PLACEHOLDER = "__IMAGE_BASE64__"
+
+def encode_image_to_base64(image):
+    """מקבל bytes / memoryview או נתיב לקובץ ומחזיר base64 כ-bytes (בלי decode נוסף)"""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return base64.b64encode(image)
+    with open(image, "rb") as image_file:
+        return base64.b64encode(image_file.read())
+
+def build_request_body(payload, base64_image):
+    """json.dumps על ה-payload בלי התמונה, ושרשור ה-base64 במקום המחזיק - בלי עותקי str של התמונה"""
+    prefix, suffix = json.dumps(payload).split(f'"{_IMAGE_PLACEHOLDER}"')
+    return b"".join((prefix.encode("utf-8"), b'"', base64_image, b'"', suffix.encode("utf-8")))
+
+def _build_analysis_body(image):
+    """מכין את גוף הבקשה ל-Bedrock (משותף לקריאה הרגילה ולקריאה המוזרמת), או None אם התמונה חסרה"""
+    if isinstance(image, str) and not os.path.exists(image):
+        print(f"Error: Image not found at {image}")
+        return None
     
+    if isinstance(image, str):
+        with open(image, "rb") as image_file:
+            image = image_file.read()
+
+    # הקטנה, הסרת EXIF ודחיסה - פחות bytes ברשת ופחות טוקנים של תמונה
+    with span("image.preprocess"):
+        image, media_type = prepare_image_for_model(image)
+    base64_image = encode_image_to_base64(image)
+
+    if STRUCTURED_OUTPUT:
+        instructions = "Analyze this meal image and record it with the record_meal tool."
+        tool_options = {"tools": [ANALYSIS_TOOL], "tool_choice": {"type": "tool", "name": ANALYSIS_TOOL["name"]}}
+    else:
+        instructions = _TEXT_OUTPUT_INSTRUCTIONS
+        tool_options = {}
+
+    system_block = {"type": "text", "text": SYSTEM_PROMPT}
+    if PROMPT_CACHING:
+        # ה-Cache מכסה את כל הקידומת עד הבלוק המסומן - הכלי וה-system (התמונה משתנה בכל קריאה)
+        system_block["cache_control"] = {"type": "ephemeral"}
+
     payload = {
         "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 4096,
+        "max_tokens": ANALYSIS_MAX_TOKENS,
         "temperature": 0.1,
-        "system": [{"type": "text", "text": system_prompt}],
+        "system": [system_block],
+        **tool_options,
         "messages": [
             {
                 "role": "user",
                 "content": [
-                    {"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": base64_image}},
-                    {"type": "text", "text": user_message}
+                    {"type": "image", "source": {"type": "base64", "media_type": media_type, "data": _IMAGE_PLACEHOLDER}},
+                    {"type": "text", "text": instructions}
                 ]
             }
         ]
     }
+    return build_request_body(payload, base64_image)
+
+def _record_usage(usage, stop_reason=None):
+    """צבירת הטוקנים של הקריאות (כולל קריאה / כתיבה ל-Prompt Cache) - מוצג ב-/debug/latency"""
+    _usage_stats["calls"] += 1
+    for key in ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"):
+        _usage_stats[key] += (usage or {}).get(key) or 0
+    if stop_reason == "max_tokens":
+        _usage_stats["max_tokens_stops"] += 1
+        print(f"⚠️ Analysis hit the token budget (ANALYSIS_MAX_TOKENS={ANALYSIS_MAX_TOKENS})")
+    # ביקשנו Cache ו-Bedrock לא כתב ולא קרא ממנו - הקידומת קצרה מהמינימום של המודל (או שהוא לא נתמך)
+    if PROMPT_CACHING and usage and not (usage.get("cache_read_input_tokens") or usage.get("cache_creation_input_tokens")):
+        _usage_stats["uncached_calls"] += 1
+        if _usage_stats["uncached_calls"] == 1:
+            print("⚠️ Prompt cache not used: no cache_read / cache_creation tokens in the Bedrock usage")
+
+def get_model_usage_stats():
+    stats = dict(_usage_stats)
+    cacheable = stats["cache_read_input_tokens"] + stats["cache_creation_input_tokens"]
+    stats["cache_hit_rate"] = round(stats["cache_read_input_tokens"] / cacheable, 3) if cacheable else 0.0
+    return stats
+
+def _analysis_text(result_body):
+    """
+    הניתוח כטקסט JSON בחוזה הרגיל: מהקלט של record_meal (כבר JSON תקין לפי הסכמה - רק מתורגם מהמפתחות הקצרים),
+    או מבלוק טקסט חופשי (STRUCTURED_OUTPUT=0) שמפוענח אחר כך בפרסר הסובלני.
+    """
+    content = result_body.get("content") or []
+    for block in content:
+        if block.get("type") == "tool_use":
+            return json.dumps(expand_compact_output(block.get("input")), ensure_ascii=False)
+    for block in content:
+        if block.get("type") == "text":
+            return block["text"]
+    return None
+
+def analyze_food_image(image):
+    """
+    שולח את התמונה ל-Bedrock ומחזיר את טקסט הניתוח (השמירה ב-DB נעשית ע"י הקורא).
+    image יכול להיות bytes / memoryview (הנתיב הרגיל מה-endpoint) או נתיב לקובץ.
+    """
+    client = get_bedrock_client()
+    if not client:
+        return None
+
+    body = _build_analysis_body(image)
+    if body is None:
+        return None
 
     try:
         print(f"Sending image to AWS Bedrock...")
-        response = client.invoke_model(modelId=MODEL_ID, body=json.dumps(payload))
-        result_body = json.loads(response['body'].read())
-        response_text = result_body['content'][0]['text']
-        
-        # --- תיקון: שליחת ה-URL האמיתי מה-S3 במקום טקסט קבוע ---
-        print(f"\n💾 Saving to Database for User {user_id} with URL: {image_url}")
-        if image_url:  # רק אם יש URL תקין
-            save_meal_to_db(user_id=user_id, image_url=image_url, ai_json_text=response_text)
-        else:
-            print("⚠️ Warning: image_url is None, skipping database save")
+        with span("bedrock.invoke"):
+            response = client.invoke_model(modelId=MODEL_ID, body=body)
+            result_body = json.loads(response['body'].read())
+        _record_usage(result_body.get("usage"), result_body.get("stop_reason"))
+        response_text = _analysis_text(result_body)
         
         return response_text
 
-    except ClientError as e:
+    except Exception as e:
         print(f"Error calling Bedrock: {e}")
         return None
+
+def _expanded_stream(fragments):
+    """
+    הזרמת הקלט של record_meal (JSON מקוצר בחתיכות) כטקסט בחוזה הרגיל: כל פריט נשלח מתורגם ברגע שנסגר,
+    ובסוף הסיכום - כך שהקורא (ItemStreamParser ב-/analyze/stream) לא יודע על הפורמט המקוצר.
+    """
+    parser = ItemStreamParser(items_key="i")
+    sent = 0
+    for fragment in fragments:
+        for _index, item in parser.feed(fragment):
+            yield ('{"items": [' if sent == 0 else ", ") + json.dumps(expand_compact_item(item), ensure_ascii=False)
+            sent += 1
+    data = loads_tolerant(parser.full_text())
+    if not isinstance(data, dict):
+        if sent == 0:
+            return  # לא התקבל ניתוח - כמו תשובה ריקה
+        data = {}
+    # פריטים שלא נסגרו בזמן ההזרמה (למשל כשהתשובה נקטעה) מגיעים מהפענוח המלא
+    raw_items = data.get("i") if isinstance(data.get("i"), list) else []
+    for _index, item in parser.missing(raw_items):
+        if isinstance(item, dict) and item:
+            yield ('{"items": [' if sent == 0 else ", ") + json.dumps(expand_compact_item(item), ensure_ascii=False)
+            sent += 1
+    summary = json.dumps(str(data.get("s") or ""), ensure_ascii=False)
+    yield ('{"items": [' if sent == 0 else "") + f'], "overall_analysis": {summary}}}'
+
+def stream_food_image_analysis(image):
+    """
+    גרסה מוזרמת של analyze_food_image: generator שמחזיר את טקסט התשובה בחתיכות
+    כפי שהן מגיעות מ-Bedrock (invoke_model_with_response_stream).
+    בשגיאה מדפיס ומפסיק - הקורא מזהה זאת לפי תשובה חסרה/ריקה.
+    """
+    client = get_bedrock_client()
+    if not client:
+        return
+
+    body = _build_analysis_body(image)
+    if body is None:
+        return
+
+    try:
+        print("Streaming image analysis from AWS Bedrock...")
+        # עד הטוקן הראשון - זה הזמן שהמשתמש מחכה לפני שהפריט הראשון מופיע
+        with span("bedrock.first_token"):
+            response = client.invoke_model_with_response_stream(modelId=MODEL_ID, body=body)
+        fragments = _stream_fragments(response['body'])
+        yield from (_expanded_stream(fragments) if STRUCTURED_OUTPUT else fragments)
+
     except Exception as e:
-        print(f"Unexpected error in analyze_food_image: {e}")
-        return None
\ No newline at end of file
+        print(f"Error streaming from Bedrock: {e}")
+
+def _stream_fragments(events):
+    """הטקסט (text_delta) או ה-JSON של הכלי (input_json_delta) מתוך אירועי ה-Stream, וספירת הטוקנים בדרך"""
+    usage, stop_reason = {}, None
+    for event in events:
+        chunk = event.get('chunk')
+        if not chunk:
+            continue
+        data = json.loads(chunk['bytes'])
+        if data.get('type') == 'content_block_delta':
+            text = data['delta'].get('text') or data['delta'].get('partial_json')
+            if text:
+                yield text
+        elif data.get('type') == 'message_start':
+            usage.update(data['message'].get('usage') or {})
+        elif data.get('type') == 'message_delta':
+            usage.update(data.get('usage') or {})
+            stop_reason = data['delta'].get('stop_reason')
+    _record_usage(usage, stop_reason)
@@ -1,96 +1,204 @@
-import pandas as pd
-from db_handler import get_db_connection
+import numpy as np
+from db_handler import db_connection
+from reference_data import ReferenceCache, get_standards
+from nutrients import get_nutrient_dictionary
 
-# === המיפוי המלא והמעודכן (תואם ל-SQL החדש) ===
-NUTRIENT_MAP = {
+# עמודות הרכיבים ב-recommendation_foods (ביחידה הקנונית של כל רכיב, כמו הסיומת בשם).
+# המיפוי מרכיב לעמודה מגיע ממילון הרכיבים (nutrients.food_column) ולא מהשם. זה גם סדר העמודות הקבוע במטריצת המאכלים
+NUTRIENT_COLUMNS = [
     # ויטמינים
-    'vitamin_a': 'vitamin_a_mcg',
-    'vitamin_c': 'vitamin_c_mg',
-    'vitamin_d': 'vitamin_d_mcg',
-    'vitamin_e': 'vitamin_e_mg',
-    'vitamin_k': 'vitamin_k_mcg',
-    'thiamin_b1': 'vitamin_b1_mg',
-    'riboflavin_b2': 'vitamin_b2_mg',
-    'niacin_b3': 'vitamin_b3_mg',
-    'vitamin_b6': 'vitamin_b6_mg',
-    'vitamin_b12': 'vitamin_b12_mcg',
-    'folate': 'folate_mcg',
-    
+    'vitamin_a_mcg', 'vitamin_c_mg', 'vitamin_d_mcg', 'vitamin_e_mg', 'vitamin_k_mcg',
+    'vitamin_b1_mg', 'vitamin_b2_mg', 'vitamin_b3_mg', 'vitamin_b6_mg', 'vitamin_b12_mcg', 'folate_mcg',
     # מינרלים
-    'calcium': 'calcium_mg',
-    'iron': 'iron_mg',
-    'magnesium': 'magnesium_mg',
-    'phosphorus': 'phosphorus_mg',
-    'potassium': 'potassium_mg',
-    'sodium': 'sodium_mg',
-    'zinc': 'zinc_mg'
-}
+    'calcium_mg', 'iron_mg', 'magnesium_mg', 'phosphorus_mg', 'potassium_mg', 'sodium_mg', 'zinc_mg',
+]
 
 def get_deficiency_amounts(user_id):
     """מחשב כמה בדיוק חסר למשתמש מכל רכיב נכון להיום"""
-    conn = get_db_connection()
-    if not conn:
-        return {}
-    
-    try:
-        # 1. שליפת פרופיל משתמש
-        user_query = """
-            SELECT gender, 
-                   (EXTRACT(YEAR FROM age(CURRENT_DATE, date_of_birth)) * 12 + EXTRACT(MONTH FROM age(CURRENT_DATE, date_of_birth))) as age_months,
-                   CASE WHEN is_pregnant THEN 'pregnancy' WHEN is_lactating THEN 'lactation' ELSE 'normal' END 
-            FROM users WHERE user_id = %s
-        """
-        cur = conn.cursor()
-        cur.execute(user_query, (user_id,))
-        prof = cur.fetchone()
-        if not prof: 
+    with db_connection() as conn:
+        if not conn:
             return {}
-        gender, age_months, condition = prof
-        
-        # 2. שליפת צריכה יומית מצטברת מול יעד ה-RDA
-        query = """
-        WITH daily_sum AS (
-            SELECT cm.nutrient_name, SUM(cm.amount) as consumed
-            FROM consumed_micros cm
-            JOIN food_items fi ON cm.item_id = fi.item_id
-            JOIN meals m ON fi.meal_id = m.meal_id
-            WHERE m.user_id = %s AND m.created_at::date = CURRENT_DATE
-            GROUP BY cm.nutrient_name
-        )
-        SELECT 
-            ns.nutrient_name,
-            COALESCE(ds.consumed, 0) as consumed,
-            ns.daily_value as target
-        FROM nutrient_standards ns
-        LEFT JOIN daily_sum ds ON ns.nutrient_name = ds.nutrient_name
-        WHERE ns.gender IN (%s, 'both') 
-          AND ns.min_age_months <= %s 
-          AND ns.max_age_months >= %s
-          AND ns.condition = %s
-        """
+
+        try:
+            # 1. שליפת פרופיל משתמש
+            user_query = """
+                SELECT gender, 
+                       (EXTRACT(YEAR FROM age(CURRENT_DATE, date_of_birth)) * 12 + EXTRACT(MONTH FROM age(CURRENT_DATE, date_of_birth))) as age_months,
+                       CASE WHEN is_pregnant THEN 'pregnancy' WHEN is_lactating THEN 'lactation' ELSE 'normal' END 
+                FROM users WHERE user_id = %s
+            """
+            cur = conn.cursor()
+            cur.execute(user_query, (user_id,))
+            prof = cur.fetchone()
+            if not prof: 
+                return {}
+            gender, age_months, condition = prof
         
-        df = pd.read_sql(query, conn, params=(user_id, gender, age_months, age_months, condition))
+            # 2. הצריכה של היום מהסיכום היומי - היעדים (RDA) מגיעים מה-Cache של טבלאות הייחוס
+            query = """
+                SELECT nutrient_id, amount as consumed
+                FROM daily_nutrient_totals
+                WHERE user_id = %s AND day = CURRENT_DATE
+            """
+            cur.execute(query, (user_id,))
+            daily_sum = {nutrient_id: float(consumed) for nutrient_id, consumed in cur.fetchall()}
+            nutrients = get_nutrient_dictionary(conn)["by_id"]
         
-        deficiencies = {}
-        for _, row in df.iterrows():
-            consumed = row['consumed']
-            target = row['target']
+            deficiencies = {}
+            for nutrient_id, _name, target, _unit in get_standards(gender, age_months, condition, conn):
+                consumed = daily_sum.get(nutrient_id, 0)
             
-            if target > 0 and consumed < target:
-                missing_val = target - consumed
-                key = row['nutrient_name'].lower().replace(' ', '_')
-                
-                if key in NUTRIENT_MAP:
-                    db_col = NUTRIENT_MAP[key]
-                    deficiencies[db_col] = missing_val
-
-        return deficiencies
-    except Exception as e:
-        print(f"Error in get_deficiency_amounts: {e}")
-        return {}
-    finally:
-        if conn:
-            conn.close()
+                if target > 0 and consumed < target:
+                    db_col = nutrients.get(nutrient_id, {}).get("food_column")
+                    if db_col in NUTRIENT_COLUMNS:
+                        deficiencies[db_col] = target - consumed
+
+            return deficiencies
+        except Exception as e:
+            print(f"Error in get_deficiency_amounts: {e}")
+            return {}
+
+def build_food_catalog(columns):
+    """
+    ממיר את recommendation_foods (dict של עמודות -> רשימות) למטריצה foods x NUTRIENT_COLUMNS.
+    ערכים חסרים נחשבים 0. השם, הקלוריות וגודל המנה נשמרים כערכי Python לתצוגה.
+    """
+    n_foods = len(columns['food_name'])
+    matrix = np.zeros((n_foods, len(NUTRIENT_COLUMNS)))
+    for i, col in enumerate(NUTRIENT_COLUMNS):
+        if col in columns:
+            matrix[:, i] = np.array(columns[col], dtype=float)
+    return {
+        "food_name": list(columns['food_name']),
+        "food_name_arr": np.array(columns['food_name'], dtype=object),
+        "calories": list(columns['calories']),
+        "calories_arr": np.array(columns['calories'], dtype=float),
+        "serving_grams": list(columns['serving_grams']),
+        "tags": list(columns['tags']),
+        "matrix": np.nan_to_num(matrix),
+        "col_index": {col: i for i, col in enumerate(NUTRIENT_COLUMNS)},
+    }
+
+# קטלוג המאכלים נטען פעם אחת לקונטיינר ומתרענן רק כשהטבלה משתנה
+food_catalog_cache = ReferenceCache("recommendation_foods", "SELECT * FROM recommendation_foods", build_food_catalog)
+
+def _recommendation(catalog, best, gap_cols, amounts, importance):
+    impacts = []
+    for j, nutrient_col in enumerate(gap_cols):
+        if amounts[j] > 0 and importance[j] > 15:  # הצגת רכיבים משמעותיים בלבד בסיבת ההמלצה
+            parts = nutrient_col.split('_')
+            clean_name = " ".join(parts[:-1]).title()
+            impacts.append(f"{clean_name} (+{int(importance[j])}%)")
+
+    return {
+        "food_name": catalog["food_name"][best],
+        "calories": catalog["calories"][best],
+        "serving": f"{catalog['serving_grams'][best]}g",
+        "reason": ", ".join(impacts[:3]),
+        "tags": catalog["tags"][best]
+    }
+
+def greedy_recommend(catalog, current_gaps, max_items=3):
+    """אלגוריתם בחירה חמדן להשגת כיסוי מקסימלי של חוסרים תזונתיים - כל הניקוד מחושב כפעולות על מערכים"""
+    current_gaps = dict(current_gaps)
+    names = catalog["food_name"]
+    matrix = catalog["matrix"]
+    denominator = catalog["calories_arr"] + 10
+    excluded = np.zeros(len(names), dtype=bool)
+    recommended_list = []
+
+    # לולאת בחירה איטרטיבית להשגת גיוון (Diversity)
+    for _ in range(max_items):
+        if not current_gaps or not len(names): break
+
+        gap_cols = list(current_gaps)
+        amounts = matrix[:, [catalog["col_index"][col] for col in gap_cols]]
+        missing = np.array([current_gaps[col] for col in gap_cols], dtype=float)
+
+        # ניקוד המבוסס על אחוז הכיסוי של כל חוסר (רק רכיבים שהמאכל באמת מכיל)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            importance = np.where(amounts > 0, np.minimum(amounts, missing) / missing * 100, 0.0)
+            # חיבור עמודה אחר עמודה - אותו סדר חיבור כמו בלולאה המקורית, כדי ששוויונות יוכרעו באותה צורה
+            score = np.zeros(len(names))
+            for j in range(len(gap_cols)):
+                score += importance[:, j]
+            # פונקציית מטרה: מקסום ערך תזונתי במינימום קלוריות (Efficiency Factor)
+            final_score = score / denominator
+        # מניעת המלצה על אותו מאכל פעמיים
+        final_score = np.where(excluded | np.isnan(final_score), -np.inf, final_score)
+
+        best = int(np.argmax(final_score))
+        if final_score[best] <= 0.5:
+            break
+
+        recommended_list.append(_recommendation(catalog, best, gap_cols, amounts[best], importance[best]))
+        excluded |= catalog["food_name_arr"] == names[best]
+
+        # עדכון החוסרים (Update Gaps) לקראת האיטרציה הבאה
+        for j, nutrient in enumerate(gap_cols):
+            current_gaps[nutrient] -= float(amounts[best, j])
+            if current_gaps[nutrient] <= 0:
+                del current_gaps[nutrient]
+
+    return recommended_list
+
+def batch_greedy_recommend(catalog, gaps, gap_cols, max_items=3):
+    """
+    greedy_recommend לכל המשתמשים בבת אחת: gaps היא מטריצה users x gap_cols (0 = אין חוסר),
+    וכל סבב בוחר לכל המשתמשים את המאכל הבא בפעולות על מטריצות users x foods.
+    כשהעמודות מסודרות כמו ה-dict של החוסרים - אותן בחירות בדיוק (אותו סדר חיבור ואותו שובר שוויון).
+    """
+    gaps = np.array(gaps, dtype=float)
+    results = [[] for _ in range(len(gaps))]
+    n_foods = len(catalog["food_name"])
+    if not n_foods or not len(gaps):
+        return results
+
+    foods = catalog["matrix"][:, [catalog["col_index"][col] for col in gap_cols]]
+    denominator = catalog["calories_arr"] + 10
+    # מאכלים עם אותו שם נחסמים יחד, כמו ב-greedy_recommend
+    _, name_group = np.unique(catalog["food_name_arr"].astype(str), return_inverse=True)
+    excluded = np.zeros((len(gaps), n_foods), dtype=bool)
+    active = np.ones(len(gaps), dtype=bool)
+
+    for _ in range(max_items):
+        active &= (gaps > 0).any(axis=1)
+        rows = np.flatnonzero(active)
+        if not len(rows):
+            break
+
+        missing = gaps[rows]
+        score = np.zeros((len(rows), n_foods))
+        part = np.empty_like(score)
+        for j in range(len(gap_cols)):
+            gap = missing[:, j][:, None]
+            if not gap.any():
+                continue
+            # min(food, gap) / gap * 100 במקום (כמויות אי-שליליות: מאכל בלי הרכיב או משתמש בלי החוסר נותנים 0)
+            np.minimum(foods[:, j], gap, out=part)
+            np.divide(part, gap, out=part, where=gap > 0)
+            part *= 100
+            score += part
+        final_score = score / denominator
+        final_score = np.where(excluded[rows] | np.isnan(final_score), -np.inf, final_score)
+
+        best = np.argmax(final_score, axis=1)
+        chosen = final_score[np.arange(len(rows)), best] > 0.5
+        active[rows[~chosen]] = False
+        rows, best, missing = rows[chosen], best[chosen], missing[chosen]
+
+        amounts = foods[best]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            importance = np.where((amounts > 0) & (missing > 0), np.minimum(amounts, missing) / missing * 100, 0.0)
+        # רשימות Python ולא סקלרים של numpy - בניית הסיבה רצה לכל המלצה
+        for user, food, food_amounts, food_importance in zip(rows.tolist(), best.tolist(), amounts.tolist(), importance.tolist()):
+            results[user].append(_recommendation(catalog, food, gap_cols, food_amounts, food_importance))
+
+        excluded[rows] |= name_group[best][:, None] == name_group[None, :]
+        remaining = np.where(missing > 0, missing - amounts, 0.0)
+        gaps[rows] = np.where(remaining > 0, remaining, 0.0)
+
+    return results
 
 def recommend_food(user_id, max_items=3):
     """אלגוריתם בחירה חמדן להשגת כיסוי מקסימלי של חוסרים תזונתיים"""
@@ -98,79 +206,10 @@ def recommend_food(user_id, max_items=3):
     if not current_gaps:
         return []
 
-    conn = get_db_connection()
-    if not conn:
-        return []
-    
     try:
-        # שליפת מאגר המאכלים הפוטנציאליים להמלצה
-        foods_df = pd.read_sql("SELECT * FROM recommendation_foods", conn)
-        
-        recommended_list = []
-        
-        # לולאת בחירה איטרטיבית להשגת גיוון (Diversity)
-        for _ in range(max_items):
-            if not current_gaps: break
-
-            best_food = None
-            best_score = -1
-            best_reason = ""
-            
-            for idx, food in foods_df.iterrows():
-                # מניעת המלצה על אותו מאכל פעמיים
-                if food['food_name'] in [r['food_name'] for r in recommended_list]:
-                    continue
-                    
-                score = 0
-                impacts = []
-                for nutrient_col, missing_amount in current_gaps.items():
-                    food_amount = food[nutrient_col]
-                    if food_amount > 0:
-                        covered = min(food_amount, missing_amount)
-                        # ניקוד המבוסס על אחוז הכיסוי של החוסר הספציפי
-                        importance = (covered / missing_amount) * 100
-                        score += importance
-                        
-                        if importance > 15: # הצגת רכיבים משמעותיים בלבד בסיבת ההמלצה
-                            parts = nutrient_col.split('_')
-                            clean_name = " ".join(parts[:-1]).title() 
-                            impacts.append(f"{clean_name} (+{int(importance)}%)")
-                
-                # פונקציית מטרה: מקסום ערך תזונתי במינימום קלוריות (Efficiency Factor)
-                final_score = score / (food['calories'] + 10)
-                
-                if final_score > best_score:
-                    best_score = final_score
-                    best_food = food
-                    best_reason = ", ".join(impacts[:3])
-
-            # הוספת המאכל הטוב ביותר שנמצא בסיבוב הנוכחי
-            if best_food is not None and best_score > 0.5:
-                recommended_list.append({
-                    "food_name": best_food['food_name'],
-                    "calories": best_food['calories'],
-                    "serving": f"{best_food['serving_grams']}g",
-                    "reason": best_reason,
-                    "tags": best_food['tags']
-                })
-                
-                # עדכון החוסרים (Update Gaps) לקראת האיטרציה הבאה
-                keys_to_remove = []
-                for nutrient in current_gaps:
-                    provided = best_food[nutrient]
-                    current_gaps[nutrient] -= provided
-                    if current_gaps[nutrient] <= 0:
-                        keys_to_remove.append(nutrient)
-                
-                for k in keys_to_remove: 
-                    del current_gaps[k]
-            else:
-                break
-
-        return recommended_list
+        # מאגר המאכלים הפוטנציאליים להמלצה - מה-Cache ולא מה-DB בכל בקשה
+        catalog = food_catalog_cache.get()
+        return greedy_recommend(catalog, current_gaps, max_items)
     except Exception as e:
         print(f"Error in recommend_food: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
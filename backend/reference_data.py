@@ -0,0 +1,208 @@
+import json
+import os
+import threading
+import time
+from decimal import Decimal
+
+import numpy as np
+
+from db_handler import db_connection
+from cache_handler import cache_client
+
+# טבלאות ייחוס (nutrient_standards, recommendation_foods) כמעט לא משתנות -
+# נטענות פעם אחת לכל קונטיינר חם ונבדקות מול סימן גרסה זול מדי פעם
+REFDATA_TTL_SECONDS = float(os.getenv("REFDATA_TTL_SECONDS", "3600"))  # טעינה מלאה לפחות פעם בשעה
+REFDATA_CHECK_SECONDS = float(os.getenv("REFDATA_CHECK_SECONDS", "60"))  # בדיקת סימן הגרסה
+REFDATA_REDIS_TTL_SECONDS = int(os.getenv("REFDATA_REDIS_TTL_SECONDS", "86400"))
+
+
+def _table_version(conn, table):
+    """
+    סימן הגרסה של הטבלה מ-reference_version (מיגרציה 8): טוקן אקראי שמתחלף ב-trigger בכל שינוי בטבלה.
+    נקרא בסכמה הנוכחית (search_path), והוא גם המפתח של העותק המשותף ב-Redis - טוקן אקראי לא חוזר על עצמו
+    בין סכמות / שרתים, ולא מתאפס כמו מוני pg_stat.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT version FROM reference_version WHERE table_name = %s", (table,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def fetch_columns(conn, query):
+    """מריץ שאילתה ומחזיר dict של עמודות -> רשימות ערכים (Decimal מומר ל-float כדי שיהיה ניתן ל-JSON)"""
+    cur = conn.cursor()
+    cur.execute(query)
+    names = [desc[0] for desc in cur.description]
+    rows = cur.fetchall()
+    columns = {name: [] for name in names}
+    for row in rows:
+        for name, value in zip(names, row):
+            columns[name].append(float(value) if isinstance(value, Decimal) else value)
+    return columns
+
+
+class ReferenceDataUnavailable(Exception):
+    """אין נתוני ייחוס בכלל - ה-Cache קר והטעינה נכשלה (כשיש עותק ישן משתמשים בו ולא זורקים)"""
+
+
+class ReferenceCache:
+    """
+    Cache ברמת התהליך לטבלת ייחוס אחת.
+    fetch(conn) מחזיר עמודות שניתנות ל-JSON (זה גם מה שנשמר ב-Redis), build(columns) ממיר למבנה העבודה בזיכרון.
+    """
+
+    def __init__(self, table, query, build, ttl=REFDATA_TTL_SECONDS, check_interval=REFDATA_CHECK_SECONDS):
+        self.table = table
+        self.query = query
+        self.build = build
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._data = None
+        self._version = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "version_checks": 0, "db_loads": 0, "redis_loads": 0}
+
+    def _fresh(self, now):
+        return (self._data is not None
+                and now - self._checked_at < self.check_interval
+                and now - self._loaded_at < self.ttl)
+
+    def get(self, conn=None):
+        """
+        conn - חיבור שהקורא כבר מחזיק (אם יש). בלי זה רענון מתוך בלוק db_connection פתוח
+        היה תופס חיבור שני מה-Pool, ותחת עומס כל ה-threads מחכים לחיבור שני ונתקעים.
+        הרענון על החיבור של הקורא רץ בתוך SAVEPOINT, כך שכישלון לא משאיר את הטרנזקציה שלו במצב aborted.
+        זורק ReferenceDataUnavailable אם אין נתונים בכלל (Cache קר והטעינה נכשלה).
+        """
+        now = time.monotonic()
+        if self._fresh(now):
+            self.stats["hits"] += 1
+            return self._data
+
+        with self._lock:
+            # ייתכן ש-thread אחר כבר רענן בזמן שחיכינו למנעול
+            now = time.monotonic()
+            if self._fresh(now):
+                self.stats["hits"] += 1
+                return self._data
+            try:
+                if conn is not None:
+                    self._refresh_in_savepoint(conn, now)
+                else:
+                    with db_connection() as own_conn:
+                        if own_conn:
+                            self._refresh(own_conn, now)
+            except Exception as e:
+                # עדיף נתונים ישנים מאשר כשל בבקשה
+                print(f"⚠️ Reference data refresh failed for {self.table}: {e}")
+            if self._data is None:
+                raise ReferenceDataUnavailable(f"Reference data unavailable: {self.table}")
+            return self._data
+
+    def _refresh_in_savepoint(self, conn, now):
+        """הרענון על החיבור של הקורא, באמצע הטרנזקציה שלו - שגיאה מתגלגלת אחורה רק עד ה-SAVEPOINT"""
+        cur = conn.cursor()
+        cur.execute("SAVEPOINT reference_refresh")
+        try:
+            self._refresh(conn, now)
+        except Exception:
+            cur.execute("ROLLBACK TO SAVEPOINT reference_refresh")
+            raise
+        cur.execute("RELEASE SAVEPOINT reference_refresh")
+
+    def _refresh(self, conn, now):
+        self.stats["version_checks"] += 1
+        version = _table_version(conn, self.table)
+        if self._data is not None and version == self._version and now - self._loaded_at < self.ttl:
+            self._checked_at = now
+            return
+
+        columns = self._load_shared(version)
+        if columns is not None:
+            self.stats["redis_loads"] += 1
+        else:
+            columns = fetch_columns(conn, self.query)
+            self.stats["db_loads"] += 1
+            self._store_shared(version, columns)
+
+        self._data = self.build(columns)
+        self._version = version
+        self._loaded_at = self._checked_at = now
+        print(f"📚 Reference data loaded: {self.table} (version {version})")
+
+    def _shared_key(self):
+        return f"refdata:{self.table}"
+
+    def _load_shared(self, version):
+        """עותק משותף ב-Redis - קונטיינר קר טוען ממנו במקום להריץ את השאילתה הכבדה"""
+        if not cache_client or version is None:
+            return None
+        try:
+            raw = cache_client.get(self._shared_key())
+            if not raw:
+                return None
+            payload = json.loads(raw)
+            return payload["columns"] if payload.get("version") == version else None
+        except Exception:
+            return None
+
+    def _store_shared(self, version, columns):
+        if not cache_client or version is None:
+            return
+        try:
+            cache_client.setex(self._shared_key(), REFDATA_REDIS_TTL_SECONDS,
+                               json.dumps({"version": version, "columns": columns}, default=str))
+        except Exception as e:
+            print(f"Error saving reference data to cache: {e}")
+
+    def invalidate(self):
+        with self._lock:
+            self._data = None
+            self._version = None
+
+
+def build_standards(columns):
+    """nutrient_standards בצורה עמודתית: מערכי numpy לסינון מהיר לפי פרופיל"""
+    return {
+        "nutrient_id": columns["nutrient_id"],
+        "nutrient_name": np.array(columns["nutrient_name"], dtype=object),
+        "gender": np.array(columns["gender"], dtype=object),
+        "min_age_months": np.array(columns["min_age_months"], dtype=float),
+        "max_age_months": np.array(columns["max_age_months"], dtype=float),
+        "condition": np.array(columns["condition"], dtype=object),
+        "daily_value": columns["daily_value"],
+        "unit": columns["unit"],
+    }
+
+
+# סדר קבוע לשורות התקן, כדי שכשיש כמה שורות לאותו רכיב הבחירה לא תלויה בסדר הפיזי של הטבלה: ב-get_deficiency_amounts
+# (ו-batch_recommendations) האחרונה קובעת - הספציפית יותר (מגדר לפני 'both', טווח גילאים מאוחר יותר), ואז הגבוהה
+STANDARDS_ORDER = ("nutrient_name", "gender", "min_age_months", "max_age_months", "daily_value")
+
+standards_cache = ReferenceCache(
+    "nutrient_standards",
+    "SELECT nutrient_id, nutrient_name, gender, min_age_months, max_age_months, condition, daily_value, unit "
+    f"FROM nutrient_standards ORDER BY {', '.join(STANDARDS_ORDER)}",
+    build_standards,
+)
+
+
+def get_standards(gender, age_months, condition, conn=None):
+    """
+    היעדים היומיים שמתאימים לפרופיל (אותו סינון כמו ב-SQL הקודם), ממוינים לפי שם הרכיב.
+    מחזיר רשימת (nutrient_id, nutrient_name, daily_value, unit) - הכמויות ביחידה הקנונית של הרכיב.
+    conn - החיבור של הקורא, אם הוא כבר מחזיק אחד. זורק ReferenceDataUnavailable אם היעדים לא נטענו.
+    """
+    standards = standards_cache.get(conn)
+    age_months = float(age_months)
+    mask = (
+        ((standards["gender"] == gender) | (standards["gender"] == 'both'))
+        & (standards["min_age_months"] <= age_months)
+        & (standards["max_age_months"] >= age_months)
+        & (standards["condition"] == condition)
+    )
+    rows = [(standards["nutrient_id"][i], standards["nutrient_name"][i], standards["daily_value"][i], standards["unit"][i])
+            for i in np.flatnonzero(mask)]
+    return sorted(rows, key=lambda row: row[1])
@@ -0,0 +1,35 @@
+import os
+import hmac
+from fastapi import APIRouter, HTTPException, Header
+from tracing import latency_summary, reset_latency_stats
+from db_handler import get_pool_stats
+from cache_handler import get_response_cache_stats, get_flight_stats
+from aws_clients import get_client_stats
+from nutrition_ai import get_model_usage_stats
+
+router = APIRouter()
+
+# כבוי כברירת מחדל - נתוני הביצועים נחשפים רק בסביבות שמדליקות אותם במפורש (DEBUG_ENDPOINTS=1)
+DEBUG_ENDPOINTS = os.getenv("DEBUG_ENDPOINTS", "0") == "1"
+# איפוס המונים מוחק נתונים - דורש את הטוקן הזה ב-X-Admin-Token. בלי טוקן מוגדר אין איפוס בכלל
+DEBUG_ADMIN_TOKEN = os.getenv("DEBUG_ADMIN_TOKEN", "")
+
+def _is_admin(token):
+    return bool(DEBUG_ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, DEBUG_ADMIN_TOKEN)
+
+@router.get("/debug/latency")
+def get_latency_endpoint(reset: bool = False, x_admin_token: str = Header(None)):
+    """אחוזוני זמנים לכל route ולכל שלב (בקונטיינר הנוכחי), יחד עם מוני ה-Pool, ה-Cache, איחוד הבקשות והטוקנים של המודל"""
+    if not DEBUG_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if reset and not _is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required to reset stats")
+    summary = latency_summary()
+    summary["db_pool"] = get_pool_stats()
+    summary["response_cache"] = get_response_cache_stats()
+    summary["single_flight"] = get_flight_stats()
+    summary["aws_clients"] = get_client_stats()
+    summary["model_usage"] = get_model_usage_stats()
+    if reset:
+        reset_latency_stats()
+    return summary
@@ -1,26 +1,47 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query
+from fastapi import APIRouter, UploadFile, File, Form, Header, HTTPException, Query, BackgroundTasks, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+import asyncio
+import json
 import os
+import base64
+import hashlib
+import time
 import uuid
-import boto3
-import pandas as pd
-from db_handler import get_db_connection
-from nutrition_ai import analyze_food_image
+from datetime import date, datetime, timedelta
+from typing import List
+from db_handler import db_connection, save_meal_to_db, save_meals_to_db, extract_json_from_text
+from cache_handler import (image_cache_keys, get_cached_analysis, set_analysis_cache,
+                           response_cache_key, get_cached_response, set_cached_response, etag_response,
+                           single_flight, get_idempotent_response, set_idempotent_response)
+from nutrition_ai import analyze_food_image, stream_food_image_analysis
+from stream_parser import ItemStreamParser
+from job_queue import submit_job, submit_save, get_job, has_external_worker, InProcessQueue, job_queue
+from image_processing import detect_media_type
+from aws_clients import get_s3_client
+from tracing import span
 
 router = APIRouter()
 
 # הגדרת S3 - וודא ששם הבאקט מעודכן לחשבון הפעיל
 S3_BUCKET = "nutrition-app-images"
-s3_client = boto3.client('s3')
+# sync - מחכים לניתוח בתוך הבקשה, async - מחזירים job_id מיד (ניתן לדרוס לכל בקשה עם ?mode=)
+ANALYZE_MODE = os.getenv("ANALYZE_MODE", "sync")
+# העלאה מרובת תמונות: כמה תמונות לבקשה, וכמה מהן מנותחות במקביל (חסם על קריאות Bedrock בו-זמניות)
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "10"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
 
-def upload_to_s3(file_path, original_name):
+def upload_to_s3(image, original_name):
+    """מעלה את התמונה ישירות מהזיכרון (bytes / memoryview) - בלי קובץ זמני"""
     unique_name = f"{uuid.uuid4()}-{original_name}"
     try:
-        with open(file_path, "rb") as f:
-            s3_client.put_object(
+        with span("s3.put"):
+            get_s3_client().put_object(
                 Bucket=S3_BUCKET,
                 Key=unique_name,
-                Body=f,
-                ContentType="image/jpeg"
+                Body=image if isinstance(image, bytes) else bytes(image),
+                ContentType=detect_media_type(image)
             )
         return f"https://{S3_BUCKET}.s3.amazonaws.com/{unique_name}"
     
@@ -28,118 +49,538 @@ def upload_to_s3(file_path, original_name):
         print(f"❌ S3 ERROR: {e}")
         return None
 
+async def _timed(timings, stage, func, *args):
+    """מריץ פונקציה חוסמת ב-Thread Pool (כדי לא לתקוע את ה-Event Loop) ומודד את זמנה"""
+    start = time.perf_counter()
+    try:
+        return await run_in_threadpool(func, *args)
+    finally:
+        timings[stage] = round((time.perf_counter() - start) * 1000, 1)
+
+def _stored_response(user_id, idempotency_key, fingerprint):
+    """התשובה שנשמרה ל-Idempotency-Key (או None). אותו מפתח עם תוכן אחר הוא שגיאה של הלקוח - 422"""
+    if not idempotency_key:
+        return None
+    stored = get_idempotent_response(user_id, idempotency_key)
+    if stored and stored["fingerprint"] != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different image")
+    return stored
+
+def _analyze_flight_key(user_id, cache_keys, mode, debug):
+    # mode ו-debug משנים את התשובה (202 מול 200, timings_ms) - בקשות שונות בהם לא מתאחדות
+    return f"analyze:{user_id}:{mode or ANALYZE_MODE}:{int(bool(debug))}:{cache_keys[0]}"
+
 @router.post("/analyze")
-async def analyze_meal_endpoint(user_id: int = Form(...), file: UploadFile = File(...)):
-    # יצירת נתיב זמני בטוח לכל מערכת הפעלה
-    if os.name == 'nt':
-        temp_dir = os.path.join(os.getenv('TEMP', os.getcwd()), 'nutrition_app')
-        os.makedirs(temp_dir, exist_ok=True)
-        temp_filename = os.path.join(temp_dir, f"{uuid.uuid4()}_{file.filename}")
-    else:
-        temp_filename = f"/tmp/{uuid.uuid4()}_{file.filename}"
+async def analyze_meal_endpoint(background_tasks: BackgroundTasks, user_id: int = Form(...), file: UploadFile = File(...), debug: bool = Query(False), mode: str = Query(None),
+                                idempotency_key: str = Header(None)):
+    """
+    ניתוח ושמירה של ארוחה. "coalesced": true בתשובה - אותה תמונה של אותו משתמש כבר נותחה בבקשה מקבילה,
+    והתשובה היא של הבקשה ההיא: הארוחה נשמרה פעם אחת בלבד (שם), ולא נשמרה ארוחה נוספת עבור הבקשה הזו.
+    """
     print(f"🔍 Starting analysis for user {user_id} and file {file.filename}")
-    try:
-        # 1. קריאת תוכן הקובץ
-        file_content = await file.read()
-        
-        # 2. כתיבת הקובץ הזמני לניתוח
-        with open(temp_filename, "wb") as buffer:
-            buffer.write(file_content)
-        
-        image_url = upload_to_s3(temp_filename, file.filename)
-        print(f"Uploaded image to S3: {image_url}")
-        analysis_result = analyze_food_image(temp_filename, user_id=user_id, image_url=image_url)
-        print(f"Analysis result: {analysis_result}")
-        if not analysis_result: 
-            raise HTTPException(status_code=500, detail="Analysis failed")
+    # 1. קריאת תוכן הקובץ - פעם אחת בלבד. UploadFile כבר מחזיק קבצים גדולים ב-SpooledTemporaryFile,
+    # ומכאן אותם bytes משותפים (בלי העתקה) ל-hash, ל-S3 ול-Bedrock
+    file_content = await file.read()
+    cache_keys = image_cache_keys(file_content)
 
-        return {"status": "success", "data": analysis_result, "image_url": image_url, "cached": False}
+    # ניסיון חוזר עם אותו Idempotency-Key מקבל את התשובה המקורית - בלי ניתוח ובלי ארוחה נוספת
+    stored = _stored_response(user_id, idempotency_key, cache_keys[0])
+    if stored:
+        return JSONResponse(status_code=stored["status_code"], content=stored["body"], headers={"Idempotent-Replayed": "true"})
 
-    finally:
-        # ניקוי הקובץ הזמני
-        if os.path.exists(temp_filename): 
-            os.remove(temp_filename)
+    # אותה תמונה של אותו משתמש שכבר בעבודה (הלקוח שלח שוב) - מחכים לתוצאה של הבקשה הראשונה
+    # במקום ניתוח, העלאה ושמירה נוספים
+    async def analyze():
+        return await _analyze_meal(background_tasks, user_id, file_content, file.filename, cache_keys, debug, mode)
 
-@router.get("/report/{user_id}")
-def get_report(user_id: int, meal_id: int = Query(None)):
-    conn = get_db_connection()
-    if not conn: raise HTTPException(status_code=500, detail="DB Error")
+    outcome, shared = await single_flight(_analyze_flight_key(user_id, cache_keys, mode, debug), analyze)
+    body = dict(outcome["body"], coalesced=True) if shared else outcome["body"]
+    if idempotency_key:
+        set_idempotent_response(user_id, idempotency_key, cache_keys[0], outcome["status_code"], body)
+    return JSONResponse(status_code=outcome["status_code"], content=body)
+
+async def _persist_meal(background_tasks, user_id, image_url, analysis_text, data=None):
+    """
+    השמירה ב-DB מחוץ לזמן התשובה. עם תור חיצוני (SQS / Redis) היא עבודת save ב-worker, ומוחזר ה-job_id שלה:
+    ב-Lambda, Mangum מחכה ל-BackgroundTasks לפני שהוא מחזיר תשובה, כך שרק התור באמת מוציא אותה מהבקשה.
+    בלי תור חיצוני (Uvicorn) - BackgroundTasks אחרי שליחת התשובה, ומוחזר None.
+    data - הניתוח אם כבר פוענח, כדי שהשמירה לא תפענח אותו שוב (ל-worker בתור עובר רק הטקסט).
+    """
+    if has_external_worker():
+        try:
+            job = await run_in_threadpool(submit_save, user_id, image_url, analysis_text)
+            return job["job_id"]
+        except Exception as e:
+            print(f"❌ Queue ERROR, saving after the response instead: {e}")
+    background_tasks.add_task(save_meal_to_db, user_id=user_id, image_url=image_url, ai_json_text=analysis_text, data=data)
+    return None
+
+async def _analyze_meal(background_tasks, user_id, file_content, filename, cache_keys, debug, mode):
+    """הניתוח עצמו - מחזיר {"status_code", "body"} (ערך JSON, כדי שאפשר לשתף אותו בין workers)"""
+    timings = {}
+    request_start = time.perf_counter()
+
+    # בדיקה אם התמונה כבר נותחה - חוסך גם את Bedrock וגם את ההעלאה ל-S3
+    cached = get_cached_analysis(cache_keys)
+    if cached:
+        print(f"⚡ Cache hit for {filename}")
+        save_job_id = await _persist_meal(background_tasks, user_id, cached["image_url"], cached["data"])
+        response = {"status": "success", "data": cached["data"], "image_url": cached["image_url"], "cached": True}
+        if save_job_id:
+            response["save_job_id"] = save_job_id
+        if debug:
+            timings["total"] = round((time.perf_counter() - request_start) * 1000, 1)
+            response["timings_ms"] = timings
+        return {"status_code": 200, "body": response}
+
+    if (mode or ANALYZE_MODE) == "async":
+        return {"status_code": 202, "body": await _submit_analysis_job(user_id, file_content, filename)}
+    
+    # 2. העלאה ל-S3 וניתוח ב-Bedrock במקביל - הזמן הכולל הוא המקסימום ולא הסכום
+    image_url, analysis_result = await asyncio.gather(
+        _timed(timings, "s3_upload", upload_to_s3, file_content, filename),
+        _timed(timings, "bedrock", analyze_food_image, file_content),
+    )
+    print(f"Uploaded image to S3: {image_url}")
+    print(f"Analysis result: {analysis_result}")
+    if not analysis_result: 
+        raise HTTPException(status_code=500, detail="Analysis failed")
+
+    save_job_id = None
+    if image_url:
+        set_analysis_cache(cache_keys, {"data": analysis_result, "image_url": image_url})
+        # 3. השמירה ב-DB לא מעכבת את התשובה למשתמש
+        save_job_id = await _persist_meal(background_tasks, user_id, image_url, analysis_result)
+    else:
+        print("⚠️ Warning: image_url is None, skipping database save")
+
+    response = {"status": "success", "data": analysis_result, "image_url": image_url, "cached": False}
+    if save_job_id:
+        response["save_job_id"] = save_job_id
+    if debug:
+        timings["total"] = round((time.perf_counter() - request_start) * 1000, 1)
+        response["timings_ms"] = timings
+    return {"status_code": 200, "body": response}
+
+async def _submit_analysis_job(user_id, file_content, filename):
+    """מצב async: מעלים ל-S3, מכניסים לתור ומחזירים (עם 202) את ה-job_id - בלי לחכות ל-Bedrock"""
+    image_url = await run_in_threadpool(upload_to_s3, file_content, filename)
+    # תור חיצוני מעביר רק את כתובת התמונה, כך שבלי S3 אין ל-worker מה לנתח
+    if not image_url and not isinstance(job_queue, InProcessQueue):
+        raise HTTPException(status_code=500, detail="Upload failed")
     try:
-        cur = conn.cursor()
-        # 1. שליפת נתוני משתמש
-        cur.execute("SELECT gender, (CURRENT_DATE - date_of_birth)/30, CASE WHEN is_pregnant THEN 'pregnancy' ELSE 'normal' END FROM users WHERE user_id = %s", (user_id,))
-        prof = cur.fetchone()
-        if not prof:
-            raise HTTPException(status_code=404, detail="User not found")
-        gender, age_months, condition = prof
-        
-        # 2. פילטר לפי ארוחה או יום - תיקון SQL Injection
-        if meal_id:
-            meal_filter = "m.meal_id = %s"
-            meal_params = (meal_id,)
+        job = await run_in_threadpool(submit_job, user_id, file_content, image_url, filename)
+    except Exception as e:
+        print(f"❌ Queue ERROR: {e}")
+        raise HTTPException(status_code=503, detail="Analysis queue unavailable")
+    return {"status": "queued", "job_id": job["job_id"], "status_url": f"/analyze/{job['job_id']}", "image_url": image_url}
+
+@router.get("/analyze/{job_id}")
+def get_analysis_job(job_id: str):
+    """מצב העבודה: queued -> running (analyzing / saving) -> done / failed. ב-done מגיע גם הניתוח.
+    failed עם saved=False - הניתוח הצליח (ב-data) אבל הארוחה לא נשמרה."""
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def _item_events(analysis_text, data=None):
+    """אירועי item לכל פריט בניתוח שהושלם (תשובה מה-Cache, מבקשה מקבילה או שמורה). data - אם כבר פוענח"""
+    if data is None:
+        data = (extract_json_from_text(analysis_text) if analysis_text else None) or {}
+    return [_sse("item", {"index": index, "item": item}) for index, item in enumerate(data.get("items", []))]
+
+@router.post("/analyze/stream")
+async def analyze_meal_stream_endpoint(user_id: int = Form(...), file: UploadFile = File(...), idempotency_key: str = Header(None)):
+    """
+    גרסת Server-Sent Events של /analyze: כל פריט מזון נשלח (event: item) ברגע שהמודל סגר אותו,
+    ובסוף event: done עם אותו מבנה כמו התשובה של /analyze (כולל "coalesced": true כשהניתוח נעשה בבקשה מקבילה).
+    """
+    print(f"🔍 Starting streaming analysis for user {user_id} and file {file.filename}")
+    file_content = await file.read()
+    cache_keys = image_cache_keys(file_content)
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+    # אותו Idempotency-Key כמו /analyze: נפילה ל-/analyze אחרי שההזרמה הסתיימה מקבלת את התשובה הזו
+    stored = _stored_response(user_id, idempotency_key, cache_keys[0])
+    if stored:
+        async def replay():
+            for event in _item_events(stored["body"].get("data")):
+                yield event
+            yield _sse("done", stored["body"])
+        return StreamingResponse(replay(), media_type="text/event-stream", headers=dict(headers, **{"Idempotent-Replayed": "true"}))
+
+    # הניתוח והשמירה לא תלויים בחיבור: אם הלקוח מתנתק באמצע, הזרם נסגר אבל הניתוח ממשיך והארוחה נשמרת
+    saves = _DetachedTasks()
+
+    def result_body(flight):
+        outcome, shared = flight.result()
+        return outcome["status_code"], dict(outcome["body"], coalesced=True) if shared else outcome["body"]
+
+    def remember(flight):
+        # גם אחרי ניתוק - כדי שנפילה ל-/analyze עם אותו מפתח תקבל את התשובה ולא תשמור שוב
+        if idempotency_key and not flight.cancelled() and flight.exception() is None:
+            status_code, body = result_body(flight)
+            set_idempotent_response(user_id, idempotency_key, cache_keys[0], status_code, body)
+
+    async def events():
+        # המוביל מזרים את הפריטים דרך התור; עוקב (אותה תמונה כבר בעבודה - גם דרך /analyze) מקבל רק את התוצאה
+        queue = asyncio.Queue()
+
+        async def analyze():
+            return await _stream_meal(queue.put_nowait, saves, user_id, file_content, file.filename, cache_keys)
+
+        flight = _detach(single_flight(_analyze_flight_key(user_id, cache_keys, "sync", False), analyze))
+        flight.add_done_callback(remember)
+        flight.add_done_callback(lambda _: queue.put_nowait(None))
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            yield event
+
+        try:
+            status_code, body = result_body(flight)
+        except HTTPException as e:
+            yield _sse("error", {"status": "error", "detail": e.detail})
+            return
+        if body.get("coalesced"):
+            for event in _item_events(body.get("data")):
+                yield event
+        yield _sse("done", body)
+
+    # השמירה כבר רצה ברקע; ה-background רק מחכה לה (ב-Lambda, כדי שהקונטיינר לא יוקפא באמצעה)
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers, background=saves)
+
+_detached = set()
+
+def _detach(awaitable):
+    """Task שלא תלוי בבקשה - ההפניה נשמרת עד שהוא מסתיים (אחרת ה-Event Loop עלול לאסוף אותו באמצע)"""
+    task = asyncio.ensure_future(awaitable)
+    _detached.add(task)
+    task.add_done_callback(_detached.discard)
+    return task
+
+class _DetachedTasks:
+    """כמו BackgroundTasks, אבל כל משימה מתחילה מיד (ב-Thread Pool) ולא מחכה לסוף התשובה או תלויה בה"""
+
+    def __init__(self):
+        self.tasks = []
+
+    def add_task(self, func, *args, **kwargs):
+        self.tasks.append(_detach(run_in_threadpool(func, *args, **kwargs)))
+
+    async def __call__(self):
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+async def _stream_meal(emit, background_tasks, user_id, file_content, filename, cache_keys):
+    """
+    הניתוח המוזרם: כל פריט עובר ל-emit כאירוע SSE, ובסוף מוחזר {"status_code", "body"} כמו ב-_analyze_meal.
+    השמירה נקבעת כאן, ברגע שהניתוח המלא ידוע - בלי קשר לשאלה אם הלקוח עדיין מחובר.
+    """
+    cached = get_cached_analysis(cache_keys)
+    if cached:
+        print(f"⚡ Cache hit for {filename}")
+        data = (extract_json_from_text(cached["data"]) if cached["data"] else None) or {}
+        for event in _item_events(cached["data"], data):
+            emit(event)
+        save_job_id = await _persist_meal(background_tasks, user_id, cached["image_url"], cached["data"], data or None)
+        body = {"status": "success", "data": cached["data"], "image_url": cached["image_url"], "cached": True}
+        return {"status_code": 200, "body": dict(body, save_job_id=save_job_id) if save_job_id else body}
+
+    # ההעלאה ל-S3 רצה במקביל להזרמה מ-Bedrock
+    upload = asyncio.ensure_future(run_in_threadpool(upload_to_s3, file_content, filename))
+    parser = ItemStreamParser()
+    async for text in iterate_in_threadpool(stream_food_image_analysis(file_content)):
+        for index, item in parser.feed(text):
+            emit(_sse("item", {"index": index, "item": item}))
+
+    analysis_result = parser.full_text()
+    image_url = await upload
+    # פריטים שהפרסר המוזרם לא הצליח לפענח מגיעים מהפענוח המלא (עם התיקונים הרגילים)
+    data = parser.finish() if analysis_result else None
+    if not data:
+        raise HTTPException(status_code=500, detail="Analysis failed")
+    for index, item in parser.missing(data.get("items", [])):
+        emit(_sse("item", {"index": index, "item": item}))
+
+    save_job_id = None
+    if image_url:
+        set_analysis_cache(cache_keys, {"data": analysis_result, "image_url": image_url})
+        # הטקסט כבר פוענח ב-parser.finish - השמירה מקבלת את התוצאה ולא מפענחת שוב
+        save_job_id = await _persist_meal(background_tasks, user_id, image_url, analysis_result, data)
+    else:
+        print("⚠️ Warning: image_url is None, skipping database save")
+    body = {"status": "success", "data": analysis_result, "image_url": image_url, "cached": False}
+    return {"status_code": 200, "body": dict(body, save_job_id=save_job_id) if save_job_id else body}
+
+@router.post("/analyze/batch")
+async def analyze_batch_endpoint(user_id: int = Form(...), files: List[UploadFile] = File(...), idempotency_key: str = Header(None)):
+    """
+    ניתוח של כמה תמונות בבקשה אחת: עד BATCH_CONCURRENCY תמונות מנותחות ומועלות במקביל,
+    וכל הניתוחים נשמרים בטרנזקציה אחת. מחזיר סטטוס לכל תמונה (לפי סדר הקבצים).
+    אותה קבוצת תמונות שכבר בעבודה מקבלת את התשובה של הבקשה ההיא עם "coalesced": true (בלי שמירה נוספת).
+    """
+    if len(files) > BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"Too many images (max {BATCH_MAX_IMAGES})")
+    print(f"🔍 Starting batch analysis for user {user_id}: {len(files)} images")
+    contents = [await file.read() for file in files]
+    cache_keys = [image_cache_keys(content) for content in contents]
+    # טביעת האצווה: התמונות לפי הסדר
+    fingerprint = hashlib.sha256("\n".join(keys[0] for keys in cache_keys).encode()).hexdigest()
+
+    stored = _stored_response(user_id, idempotency_key, fingerprint)
+    if stored:
+        return JSONResponse(status_code=stored["status_code"], content=stored["body"], headers={"Idempotent-Replayed": "true"})
+
+    async def analyze():
+        body = await _analyze_batch(user_id, [file.filename for file in files], contents, cache_keys)
+        return {"status_code": 200, "body": body}
+
+    outcome, shared = await single_flight(f"analyze-batch:{user_id}:{fingerprint}", analyze)
+    body = dict(outcome["body"], coalesced=True) if shared else outcome["body"]
+    if idempotency_key:
+        set_idempotent_response(user_id, idempotency_key, fingerprint, outcome["status_code"], body)
+    return JSONResponse(status_code=outcome["status_code"], content=body)
+
+async def _analyze_batch(user_id, filenames, contents, cache_keys):
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def analyze_one(index):
+        file_content, filename = contents[index], filenames[index]
+        result = {"index": index, "filename": filename, "cached": False}
+        cached = get_cached_analysis(cache_keys[index])
+        if cached:
+            result.update(status="success", cached=True, data=cached["data"], image_url=cached["image_url"])
+            return result
+
+        async with slots:
+            image_url, analysis_result = await asyncio.gather(
+                run_in_threadpool(upload_to_s3, file_content, filename),
+                run_in_threadpool(analyze_food_image, file_content),
+            )
+        if not analysis_result:
+            result.update(status="failed", detail="Analysis failed", image_url=image_url)
+        elif not image_url:
+            result.update(status="failed", detail="Upload failed", data=analysis_result)
         else:
-            meal_filter = "m.user_id = %s AND m.created_at::date = CURRENT_DATE"
-            meal_params = (user_id,)
+            set_analysis_cache(cache_keys[index], {"data": analysis_result, "image_url": image_url})
+            result.update(status="success", data=analysis_result, image_url=image_url)
+        return result
+
+    results = await asyncio.gather(*(analyze_one(index) for index in range(len(contents))))
+
+    # שמירה אחת לכל התמונות שהצליחו
+    succeeded = [result for result in results if result["status"] == "success"]
+    if succeeded:
+        meal_ids = await run_in_threadpool(
+            save_meals_to_db, user_id, [(result["image_url"], result["data"]) for result in succeeded]
+        )
+        for result, meal_id in zip(succeeded, meal_ids):
+            result["meal_id"] = meal_id
+            if meal_id is None:
+                result.update(status="failed", detail="Save failed")
+
+    return {
+        "status": "success" if all(result["status"] == "success" for result in results) else "partial",
+        "results": results,
+    }
+
+@router.get("/report/{user_id}")
+def get_report(request: Request, user_id: int, meal_id: int = Query(None)):
+    # הדוח משתנה רק כששומרים ארוחה - שמור לפי (משתמש, יום / ארוחה) ומתבטל ב-save_meal_to_db
+    key = response_cache_key("report", user_id, f"meal-{meal_id}" if meal_id else date.today().isoformat())
+    entry = get_cached_response(key)
+    if entry is None:
+        entry = set_cached_response(key, jsonable_encoder(build_report(user_id, meal_id)))
+    return etag_response(request, entry)
+
+def build_report(user_id, meal_id=None):
+    # numpy נטען רק כשבאמת צריך דוח
+    from reference_data import get_standards, ReferenceDataUnavailable
+
+    with db_connection() as conn:
+        if not conn: raise HTTPException(status_code=500, detail="DB Error")
+        try:
+            cur = conn.cursor()
+            # 1. שליפת נתוני משתמש
+            cur.execute("SELECT gender, (CURRENT_DATE - date_of_birth)/30, CASE WHEN is_pregnant THEN 'pregnancy' ELSE 'normal' END FROM users WHERE user_id = %s", (user_id,))
+            prof = cur.fetchone()
+            if not prof:
+                raise HTTPException(status_code=404, detail="User not found")
+            gender, age_months, condition = prof
         
-        # 3. שאילתה שמביאה את כל הרכיבים מהתקן ומצמידה אליהם צריכה (אם יש)
-        query = """
-        SELECT 
-            ns.nutrient_name,
-            COALESCE(di.total, 0) as total_consumed,
-            ns.daily_value as target_value,
-            ns.unit,
-            (COALESCE(di.total, 0) / NULLIF(ns.daily_value, 0)) * 100 as percentage
-        FROM nutrient_standards ns
-        LEFT JOIN (
-            SELECT cm.nutrient_name, SUM(cm.amount) as total
-            FROM consumed_micros cm
-            JOIN food_items fi ON cm.item_id = fi.item_id
-            JOIN meals m ON fi.meal_id = m.meal_id
-            WHERE """ + meal_filter + """
-            GROUP BY cm.nutrient_name
-        ) di ON LOWER(ns.nutrient_name) = LOWER(di.nutrient_name)
-        WHERE ns.gender IN (%s, 'both') 
-          AND ns.min_age_months <= %s AND ns.max_age_months >= %s 
-          AND ns.condition = %s
-        ORDER BY ns.nutrient_name ASC;
-        """
-        # שילוב הפרמטרים בצורה בטוחה
-        all_params = meal_params + (gender, age_months, age_months, condition)
-        report_df = pd.read_sql(query, conn, params=all_params)
+            # 2+3. סכימת הצריכה בלבד - היעדים מגיעים מה-Cache של nutrient_standards
+            if meal_id:
+                # ארוחה בודדת - סכימה ישירה של הפריטים שלה
+                query = """
+                    SELECT cm.nutrient_id, SUM(cm.amount) as total
+                    FROM consumed_micros cm
+                    JOIN food_items fi ON cm.item_id = fi.item_id
+                    WHERE fi.meal_id = %s AND cm.nutrient_id IS NOT NULL
+                    GROUP BY cm.nutrient_id
+                """
+                cur.execute(query, (meal_id,))
+            else:
+                # היום - קריאה מהסיכום היומי שמתעדכן בכל שמירת ארוחה (חיפוש לפי מפתח ראשי)
+                query = """
+                    SELECT nutrient_id, amount
+                    FROM daily_nutrient_totals
+                    WHERE user_id = %s AND day = CURRENT_DATE
+                """
+                cur.execute(query, (user_id,))
+            # הכמויות כבר ביחידה הקנונית - אותה יחידה כמו ביעד
+            totals = {nutrient_id: float(total) for nutrient_id, total in cur.fetchall()}
+
+            # מצמידים לכל רכיב בתקן את הצריכה (אם יש)
+            report = []
+            for nutrient_id, nutrient_name, target, unit in get_standards(gender, age_months, condition, conn):
+                consumed = totals.get(nutrient_id, 0)
+                report.append({
+                    "nutrient_name": nutrient_name,
+                    "total_consumed": consumed,
+                    "target_value": target,
+                    "unit": unit,
+                    "percentage": (consumed / target) * 100 if target else None
+                })
         
-        # 4. שליפת סיכום ותמונה
-        info_query = "SELECT ai_analysis_summary, image_url FROM meals WHERE " + ("meal_id = %s" if meal_id else "user_id = %s ORDER BY created_at DESC LIMIT 1")
-        cur.execute(info_query, (meal_id if meal_id else user_id,))
-        res = cur.fetchone()
+            # 4. שליפת סיכום ותמונה
+            info_query = "SELECT ai_analysis_summary, image_url FROM meals WHERE " + ("meal_id = %s" if meal_id else "user_id = %s ORDER BY created_at DESC LIMIT 1")
+            cur.execute(info_query, (meal_id if meal_id else user_id,))
+            res = cur.fetchone()
         
-        return {
-            "report": report_df.to_dict(orient="records"),
-            "summary": res[0] if res else "",
-            "image_url": res[1] if res else None
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"Error in get_report: {e}")
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
-    finally: 
-        if conn: conn.close()
+            return {
+                "report": report,
+                "summary": res[0] if res else "",
+                "image_url": res[1] if res else None
+            }
+        except HTTPException:
+            raise
+        except ReferenceDataUnavailable as e:
+            print(f"Error in get_report: {e}")
+            raise HTTPException(status_code=503, detail="Reference data unavailable")
+        except Exception as e:
+            print(f"Error in get_report: {e}")
+            raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-@router.get("/history/{user_id}")
-def get_meal_history(user_id: int):
-    conn = get_db_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="DB Connection Failed")
+@router.get("/report/{user_id}/range")
+def get_report_range(
+    request: Request,
+    user_id: int,
+    from_date: date = Query(None),
+    to_date: date = Query(None),
+    window: int = Query(7, ge=1, le=90),
+):
+    """צריכה יומית, אחוז מהיעד וממוצע נע לכל רכיב בטווח תאריכים (ברירת מחדל: 30 הימים האחרונים)"""
+    from trends import TREND_DEFAULT_DAYS, TREND_MAX_DAYS
+
+    to_date = to_date or date.today()
+    from_date = from_date or to_date - timedelta(days=TREND_DEFAULT_DAYS - 1)
+    if from_date > to_date:
+        raise HTTPException(status_code=400, detail="from_date must be before to_date")
+    if (to_date - from_date).days + 1 > TREND_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range is limited to {TREND_MAX_DAYS} days")
+
+    key = response_cache_key("report-range", user_id, from_date.isoformat(), to_date.isoformat(), window)
+    entry = get_cached_response(key)
+    if entry is None:
+        entry = set_cached_response(key, build_report_range(user_id, from_date, to_date, window))
+    return etag_response(request, entry)
+
+def build_report_range(user_id, from_date, to_date, window):
+    from reference_data import get_standards, ReferenceDataUnavailable
+    from trends import build_trend
+
+    with db_connection() as conn:
+        if not conn: raise HTTPException(status_code=500, detail="DB Error")
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT gender, (CURRENT_DATE - date_of_birth)/30, CASE WHEN is_pregnant THEN 'pregnancy' ELSE 'normal' END FROM users WHERE user_id = %s", (user_id,))
+            prof = cur.fetchone()
+            if not prof:
+                raise HTTPException(status_code=404, detail="User not found")
+            gender, age_months, condition = prof
+
+            # כל הטווח בשאילתה אחת: טווח על day (חלק מהמפתח הראשי) במקום שאילתה לכל יום.
+            # שורה אחת לכל (יום, nutrient_id) - הסיכום היומי כבר מקובץ לפי המפתח
+            query = """
+                SELECT day, nutrient_id, amount
+                FROM daily_nutrient_totals
+                WHERE user_id = %s AND day BETWEEN %s AND %s
+            """
+            cur.execute(query, (user_id, from_date, to_date))
+            rows = cur.fetchall()
+            return build_trend(from_date, to_date, rows, get_standards(gender, age_months, condition, conn), window)
+        except HTTPException:
+            raise
+        except ReferenceDataUnavailable as e:
+            print(f"Error in get_report_range: {e}")
+            raise HTTPException(status_code=503, detail="Reference data unavailable")
+        except Exception as e:
+            print(f"Error in get_report_range: {e}")
+            raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+def encode_history_cursor(created_at, meal_id):
+    """Cursor אטום לדף הבא: המיקום (created_at, meal_id) של השורה האחרונה בדף"""
+    raw = f"{created_at.isoformat()}|{meal_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_history_cursor(cursor):
     try:
+        created_at, meal_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(meal_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@router.get("/history/{user_id}")
+def get_meal_history(
+    user_id: int,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    cursor: str = Query(None),
+    from_date: date = Query(None),
+    to_date: date = Query(None),
+):
+    """היסטוריית ארוחות בדפים (keyset על created_at, meal_id) - בלי OFFSET ובלי DataFrame"""
+    filters = ["user_id = %s"]
+    params = [user_id]
+    if from_date:
+        filters.append("created_at >= %s")
+        params.append(from_date)
+    if to_date:
+        # טווח חצי-פתוח כדי שהאינדקס על created_at ישמש (ולא created_at::date)
+        filters.append("created_at < %s")
+        params.append(to_date + timedelta(days=1))
+    if cursor:
+        filters.append("(created_at, meal_id) < (%s, %s)")
+        params.extend(decode_history_cursor(cursor))
+
+    with db_connection() as conn:
+        if not conn:
+            raise HTTPException(status_code=500, detail="DB Connection Failed")
         query = """
             SELECT meal_id, created_at, ai_analysis_summary, image_url
             FROM meals 
-            WHERE user_id = %s 
-            ORDER BY created_at DESC
+            WHERE """ + " AND ".join(filters) + """
+            ORDER BY created_at DESC, meal_id DESC
+            LIMIT %s
         """
-        df = pd.read_sql(query, conn, params=(user_id,))
-        df['created_at'] = df['created_at'].astype(str)
-        
-        return df.to_dict(orient="records")
-    finally:
-        conn.close()
+        cur = conn.cursor()
+        # שורה אחת נוספת רק כדי לדעת אם יש דף הבא
+        cur.execute(query, params + [limit + 1])
+        rows = cur.fetchall()
+
+    page = rows[:limit]
+    next_cursor = encode_history_cursor(page[-1][1], page[-1][0]) if len(rows) > limit else None
+    return {
+        "items": [
+            {"meal_id": meal_id, "created_at": str(created_at), "ai_analysis_summary": summary, "image_url": image_url}
+            for meal_id, created_at, summary, image_url in page
+        ],
+        "next_cursor": next_cursor,
+    }
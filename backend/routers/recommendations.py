@@ -1,8 +1,48 @@
-from fastapi import APIRouter
-from recommender_engine import recommend_food
+from fastapi import APIRouter, Request
+from fastapi.encoders import jsonable_encoder
+from datetime import date
+from cache_handler import response_cache_key, get_cached_response, set_cached_response, etag_response
+from db_handler import db_connection
 
 router = APIRouter()
 
+def load_stored_recommendations(user_id):
+    """
+    התוצאה של החישוב הלילי (batch_recommendations.py) - אם היא מהיום ולא נשמרה ארוחה מאז שחושבה.
+    None אם אין תוצאה תקפה (ואז מחשבים כרגיל).
+    """
+    with db_connection() as conn:
+        if not conn:
+            return None
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT r.recommendations
+                FROM user_recommendations r
+                WHERE r.user_id = %s AND r.day = CURRENT_DATE
+                  AND NOT EXISTS (SELECT 1 FROM meals m WHERE m.user_id = r.user_id AND m.created_at >= r.computed_at)
+            """, (user_id,))
+            row = cur.fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            print(f"Error loading stored recommendations: {e}")
+            conn.rollback()
+            return None
+
 @router.get("/recommendations/{user_id}")
-def get_recommendations_endpoint(user_id: int):
-    return recommend_food(user_id)
+def get_recommendations_endpoint(request: Request, user_id: int):
+    # ההמלצות תלויות רק בצריכה של היום - נשמרות עד שהמשתמש שומר ארוחה חדשה
+    key = response_cache_key("recommendations", user_id, date.today().isoformat())
+    entry = get_cached_response(key)
+    if entry is None:
+        recommendations = load_stored_recommendations(user_id)
+        if recommendations is not None:
+            return etag_response(request, set_cached_response(key, recommendations))
+        # מנוע ההמלצות (numpy) נטען רק כשאין תוצאה שמורה ולא ב-Cold Start של כל הלמבדה
+        from recommender_engine import recommend_food
+        recommendations = jsonable_encoder(recommend_food(user_id))
+        if not recommendations:
+            # רשימה ריקה יכולה להיות גם תוצאה של שגיאה - לא שומרים אותה
+            return recommendations
+        entry = set_cached_response(key, recommendations)
+    return etag_response(request, entry)
@@ -0,0 +1,108 @@
+from db_handler import extract_json_from_text
+from model_output import loads_tolerant
+
+
+class ItemStreamParser:
+    """
+    פרסר אינקרמנטלי לתשובת ה-AI בזמן שהיא מוזרמת.
+    feed(text) מקבל את החתיכה הבאה ומחזיר את הפריטים של "items" (או items_key) שנסגרו בה כזוגות (index, item),
+    כל פריט פעם אחת בלבד ובלי לחכות לסוף התשובה. finish() מפענח את הטקסט המלא עם לוגיקת התיקון הרגילה.
+
+    הסורק סובלני לשגיאה הנפוצה של המודל - ערך בלי גרש פותח (כמו 2mg") - כך שמצב
+    המחרוזות לא משתבש, והפריט עצמו מפוענח בפרסר הסובלני (loads_tolerant).
+    """
+
+    def __init__(self, items_key="items"):
+        self.items_key = items_key
+        self.text = []
+        self.items = {}           # index -> פריט שפוענח בזמן ההזרמה
+        self._closed = 0          # כמה פריטים נסגרו (כולל כאלה שלא הצליחו להתפענח)
+        self._chunk = []          # הטקסט מאז תחילת הפריט הנוכחי (או ריק אם אנחנו לא בתוך פריט)
+        self._stack = []          # סוגרי הפתיחה הפתוחים כרגע
+        self._in_string = False
+        self._escape = False
+        self._bare = False        # בתוך ערך בלי גרשיים (מספר / true / 476 mg)
+        self._string = []
+        self._last_string = None
+        self._key = None
+        self._items_depth = None  # עומק המערך של items (אחרי שנפתח)
+        self._in_item = False
+
+    def feed(self, text):
+        self.text.append(text)
+        completed = []
+        for ch in text:
+            item = self._consume(ch)
+            if item is not None:
+                completed.append((self._closed - 1, item))
+        return completed
+
+    def _consume(self, ch):
+        if self._in_item:
+            self._chunk.append(ch)
+
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                self._last_string = "".join(self._string)
+            else:
+                self._string.append(ch)
+            return None
+
+        if self._bare:
+            if ch == '"':
+                # גרש סוגר בלי גרש פותח (: 2mg") - שייך לערך ולא פותח מחרוזת חדשה
+                self._bare = False
+                return None
+            if ch not in ",}]\n":
+                return None
+            self._bare = False
+
+        if ch == '"':
+            self._in_string = True
+            self._string = []
+        elif ch == ":":
+            self._key = self._last_string
+            self._bare = False
+        elif ch in "{[":
+            if ch == "[" and len(self._stack) == 1 and self._key == self.items_key and self._items_depth is None:
+                self._items_depth = len(self._stack) + 1
+            elif ch == "{" and self._items_depth is not None and len(self._stack) == self._items_depth:
+                self._in_item = True
+                self._chunk = [ch]
+            self._stack.append(ch)
+        elif ch in "}]":
+            if self._stack:
+                self._stack.pop()
+            if ch == "}" and self._in_item and len(self._stack) == self._items_depth:
+                self._in_item = False
+                return self._emit("".join(self._chunk))
+            if ch == "]" and self._items_depth is not None and len(self._stack) < self._items_depth:
+                self._items_depth = -1  # המערך נסגר - לא מחפשים פריטים נוספים
+        elif not ch.isspace() and ch != "," and self._stack and self._stack[-1] in "{[":
+            self._bare = True
+        return None
+
+    def _emit(self, raw):
+        self._closed += 1
+        item = loads_tolerant(raw)
+        if item is None:
+            # הפריט ייצא בסוף מתוך הפענוח המלא (missing)
+            return None
+        self.items[self._closed - 1] = item
+        return item
+
+    def missing(self, items):
+        """הפריטים מהפענוח המלא שלא נשלחו בזמן ההזרמה, כזוגות (index, item)"""
+        return [(index, item) for index, item in enumerate(items) if index not in self.items]
+
+    def full_text(self):
+        return "".join(self.text)
+
+    def finish(self):
+        """פענוח הטקסט המלא (עם התיקונים של extract_json_from_text) - מקור האמת לשמירה ב-DB"""
+        return extract_json_from_text(self.full_text())
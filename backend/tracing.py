@@ -0,0 +1,184 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+# מדידת זמנים לכל בקשה ולכל שלב (DB, S3, Bedrock, פענוח JSON, שמירה).
+# כל בקשה נכתבת כשורת JSON אחת ללוג (בפורמט EMF של CloudWatch, כך שהמדדים נוצרים בלי קריאות API),
+# ובזיכרון נשמרות הדגימות האחרונות לכל שלב לחישוב אחוזונים ב-/debug/latency
+TRACE_LOG = os.getenv("TRACE_LOG", "1") == "1"
+TRACE_EMF = os.getenv("TRACE_EMF", "1") == "1"
+TRACE_NAMESPACE = os.getenv("TRACE_NAMESPACE", "NutritionApp")
+TRACE_SAMPLE_SIZE = int(os.getenv("TRACE_SAMPLE_SIZE", "2000"))  # דגימות אחרונות לכל שלב / route
+
+_current = contextvars.ContextVar("current_trace", default=None)
+_samples = {}
+_samples_lock = threading.Lock()
+
+
+class Trace:
+    """הזמנים של בקשה אחת: סכום וכמות לכל שלב"""
+
+    def __init__(self, request_id, method, path):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.route = path
+        self.status = None
+        self.start = time.perf_counter()
+        self.response_ms = None  # עד ה-chunk האחרון של התשובה (בלי BackgroundTasks)
+        self.spans = {}
+        self._lock = threading.Lock()  # שלבים יכולים לרוץ במקביל ב-Thread Pool
+
+    def add(self, name, elapsed_ms):
+        with self._lock:
+            span = self.spans.setdefault(name, {"count": 0, "ms": 0.0})
+            span["count"] += 1
+            span["ms"] += elapsed_ms
+
+
+def record(name, elapsed_ms):
+    with _samples_lock:
+        samples = _samples.get(name)
+        if samples is None:
+            samples = _samples[name] = deque(maxlen=TRACE_SAMPLE_SIZE)
+        samples.append(elapsed_ms)
+
+
+@contextmanager
+def span(name):
+    """מודד שלב: נרשם לבקשה הנוכחית (אם יש) ולסטטיסטיקה הכללית של השלב"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        record(f"stage:{name}", elapsed_ms)
+        trace = _current.get()
+        if trace is not None:
+            trace.add(name, elapsed_ms)
+
+
+def traced(name):
+    """דקורטור - כל קריאה לפונקציה נמדדת כשלב"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 2)
+
+
+def latency_summary():
+    """אחוזונים (p50/p90/p95/p99) לכל route ולכל שלב, על הדגימות האחרונות"""
+    with _samples_lock:
+        snapshot = {name: sorted(samples) for name, samples in _samples.items()}
+    summary = {"routes": {}, "stages": {}}
+    for name, values in sorted(snapshot.items()):
+        if not values:
+            continue
+        kind, _, label = name.partition(":")
+        summary["routes" if kind == "route" else "stages"][label] = {
+            "count": len(values),
+            "p50": _percentile(values, 50),
+            "p90": _percentile(values, 90),
+            "p95": _percentile(values, 95),
+            "p99": _percentile(values, 99),
+            "max": round(values[-1], 2),
+        }
+    return summary
+
+
+def reset_latency_stats():
+    with _samples_lock:
+        _samples.clear()
+
+
+def _log_trace(trace, duration_ms, background_ms=0.0):
+    spans = {name: {"count": span["count"], "ms": round(span["ms"], 2)} for name, span in trace.spans.items()}
+    entry = {
+        "type": "request",
+        "request_id": trace.request_id,
+        "method": trace.method,
+        "path": trace.path,
+        "route": trace.route,
+        "status": trace.status,
+        "duration_ms": round(duration_ms, 2),
+        "background_ms": round(background_ms, 2),
+        "spans": spans,
+    }
+    if TRACE_EMF:
+        # Embedded Metric Format: CloudWatch מחלץ את המדדים מהשורה עצמה
+        metrics = [{"Name": "duration_ms", "Unit": "Milliseconds"}, {"Name": "background_ms", "Unit": "Milliseconds"}]
+        for name, span in spans.items():
+            entry[f"stage.{name}"] = span["ms"]
+            metrics.append({"Name": f"stage.{name}", "Unit": "Milliseconds"})
+        entry["Route"] = trace.route
+        entry["_aws"] = {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{"Namespace": TRACE_NAMESPACE, "Dimensions": [["Route"]], "Metrics": metrics}],
+        }
+    print(json.dumps(entry))
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware (ולא BaseHTTPMiddleware) - כך שגם תשובות מוזרמות (SSE) נמדדות עד ה-chunk האחרון.
+    מוסיף X-Request-ID לתשובה ו-Server-Timing עם זמן הבקשה.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode() or uuid.uuid4().hex
+        trace = Trace(request_id, scope["method"], scope["path"])
+        token = _current.set(trace)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                trace.status = message["status"]
+                elapsed_ms = (time.perf_counter() - trace.start) * 1000
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"x-request-id", request_id.encode()),
+                    (b"server-timing", f"app;dur={elapsed_ms:.1f}".encode()),
+                ]
+            elif message["type"] == "http.response.body" and not message.get("more_body"):
+                trace.response_ms = (time.perf_counter() - trace.start) * 1000
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            total_ms = (time.perf_counter() - trace.start) * 1000
+            # BackgroundTasks רצות אחרי ה-chunk האחרון - נמדדות בנפרד ולא נבלעות בזמן התשובה.
+            # ב-Lambda (Mangum) הלקוח מחכה גם להן: התשובה חוזרת רק כשהאפליקציה מסיימת
+            duration_ms = trace.response_ms if trace.response_ms is not None else total_ms
+            background_ms = total_ms - duration_ms
+            # התבנית של ה-route (/report/{user_id}) ולא הנתיב עצמו - אחרת כל משתמש הוא סדרה נפרדת
+            route = scope.get("route")
+            trace.route = getattr(route, "path", None) or trace.path
+            trace.status = trace.status or 500
+            _current.reset(token)
+            record(f"route:{trace.method} {trace.route}", duration_ms)
+            if background_ms >= 1:
+                record(f"stage:background {trace.method} {trace.route}", background_ms)
+            if TRACE_LOG:
+                _log_trace(trace, duration_ms, background_ms)
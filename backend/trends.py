@@ -0,0 +1,77 @@
+from datetime import timedelta
+
+import numpy as np
+
+# דוח מגמה לטווח תאריכים: מטריצה של ימים x רכיבים (מהסיכום היומי) וכל החישובים עליה בבת אחת -
+# אחוז מהיעד וממוצע נע, בלי לולאה לכל יום / רכיב.
+TREND_DEFAULT_DAYS = 30
+TREND_MAX_DAYS = 366
+TREND_DEFAULT_WINDOW = 7
+
+
+def rolling_mean(matrix, window):
+    """
+    ממוצע נע לאורך הימים (שורות) בעזרת סכום מצטבר - O(ימים x רכיבים) לכל גודל חלון.
+    בתחילת הטווח, לפני שיש window ימים, הממוצע הוא על הימים שיש.
+    """
+    cumulative = np.cumsum(matrix, axis=0)
+    rolled = cumulative.copy()
+    rolled[window:] = cumulative[window:] - cumulative[:-window]
+    counts = np.minimum(np.arange(1, matrix.shape[0] + 1), window)
+    return rolled / counts[:, None]
+
+
+def _percent(matrix, targets):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(targets > 0, matrix / targets * 100, np.nan)
+
+
+def _to_list(values):
+    """שורת numpy ל-JSON: עיגול ו-None במקום NaN"""
+    return [None if np.isnan(value) else round(float(value), 2) for value in values]
+
+
+def build_trend(from_date, to_date, rows, standards, window=TREND_DEFAULT_WINDOW):
+    """
+    rows: (day, nutrient_id, amount) מהסיכום היומי, standards: (nutrient_id, nutrient_name, target, unit) של המשתמש.
+    מחזיר את הימים בטווח (כולל ימים בלי ארוחות - צריכה 0) ולכל רכיב בתקן סדרות של צריכה, אחוז מהיעד וממוצע נע.
+    """
+    n_days = (to_date - from_date).days + 1
+    days = [from_date + timedelta(days=offset) for offset in range(n_days)]
+
+    column = {nutrient_id: index for index, (nutrient_id, _name, _target, _unit) in enumerate(standards)}
+    targets = np.array([target or 0 for _id, _name, target, _unit in standards], dtype=float)
+
+    # פיזור השורות למטריצה (השורות כבר מקובצות ב-DB, כאן רק מיקום לפי nutrient_id)
+    matrix = np.zeros((n_days, len(standards)))
+    day_index, nutrient_index, amounts = [], [], []
+    for day, nutrient_id, amount in rows:
+        index = column.get(nutrient_id)
+        if index is not None:
+            day_index.append((day - from_date).days)
+            nutrient_index.append(index)
+            amounts.append(float(amount))
+    np.add.at(matrix, (np.array(day_index, dtype=int), np.array(nutrient_index, dtype=int)), amounts)
+
+    averages = rolling_mean(matrix, window)
+    percentages = _percent(matrix, targets)
+    average_percentages = _percent(averages, targets)
+
+    nutrients = []
+    for index, (_nutrient_id, name, target, unit) in enumerate(standards):
+        nutrients.append({
+            "nutrient_name": name,
+            "target_value": target,
+            "unit": unit,
+            "totals": _to_list(matrix[:, index]),
+            "percentage": _to_list(percentages[:, index]),
+            "rolling_avg": _to_list(averages[:, index]),
+            "rolling_percentage": _to_list(average_percentages[:, index]),
+        })
+    return {
+        "from_date": from_date.isoformat(),
+        "to_date": to_date.isoformat(),
+        "window": window,
+        "days": [day.isoformat() for day in days],
+        "nutrients": nutrients,
+    }
@@ -15,6 +15,7 @@ function App() {
   const [reportData, setReportData] = useState(null);
   const [recommendations, setRecommendations] = useState([]);
   const [refreshTrigger, setRefreshTrigger] = useState(0);
+  const [liveItems, setLiveItems] = useState([]);
 
   useEffect(() => {
     axios.get(`${API_URL}/users`)
@@ -44,17 +45,60 @@ function App() {
       .catch(err => console.error(err));
   };
 
+  // גרסת ה-SSE של /analyze: כל פריט מוצג ברגע שהמודל סיים אותו.
+  // progress.received מסמן שהשרת כבר התחיל להחזיר ניתוח (item / done) - מכאן הוא גם ישמור את הארוחה
+  const analyzeStream = async (formData, idempotencyKey, progress) => {
+    const response = await fetch(`${API_URL}/analyze/stream`, {
+      method: 'POST',
+      body: formData,
+      headers: { 'Idempotency-Key': idempotencyKey }
+    });
+    if (!response.ok || !response.body) throw new Error(`Stream failed (${response.status})`);
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const events = buffer.split("\n\n");
+      buffer = events.pop();
+      for (const raw of events) {
+        const event = raw.match(/^event: (.*)$/m)?.[1];
+        const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || "null");
+        if (event === "item" || event === "done") progress.received = true;
+        if (event === "item") setLiveItems(prev => [...prev, data.item]);
+        if (event === "error") throw new Error(data.detail);
+      }
+    }
+  };
+
   const handleAnalyze = async () => {
     if (!file || !selectedUserId) return;
     setLoading(true);
+    setLiveItems([]);
     const formData = new FormData();
     formData.append("file", file);
     formData.append("user_id", selectedUserId);
 
+    // אותו מפתח לשתי הקריאות - אם השרת כבר שמר את הארוחה, הקריאה החוזרת מקבלת את אותה תשובה בלי ארוחה נוספת
+    const idempotencyKey = crypto.randomUUID();
+    const progress = { received: false };
+
     try {
-      await axios.post(`${API_URL}/analyze`, formData, {
-        headers: { 'Content-Type': 'multipart/form-data' }
-      });
+      try {
+        await analyzeStream(formData, idempotencyKey, progress);
+      } catch (streamError) {
+        // שגיאה אחרי שכבר הגיע ניתוח - השמירה כבר בדרך, ניסיון נוסף היה יוצר ארוחה כפולה
+        if (progress.received) throw streamError;
+        // אם ההזרמה לא נתמכת בדרך (למשל Gateway שמאגד את התשובה) - חוזרים ל-endpoint הרגיל
+        console.warn("Streaming analysis failed, falling back to /analyze:", streamError);
+        setLiveItems([]);
+        await axios.post(`${API_URL}/analyze`, formData, {
+          headers: { 'Content-Type': 'multipart/form-data', 'Idempotency-Key': idempotencyKey }
+        });
+      }
       fetchReport(selectedUserId);
       fetchRecommendations(selectedUserId);
     } catch (error) {
@@ -89,6 +133,7 @@ function App() {
         handleAnalyze={handleAnalyze}
         loading={loading}
         lastUpdated={refreshTrigger}
+        liveItems={liveItems}
       />
 
       <main className="content">
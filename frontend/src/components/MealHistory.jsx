@@ -73,7 +73,7 @@ const MealDetails = ({ meal, onClose, userId }) => {
                   <div style={{ display: 'flex', flexWrap: 'wrap', gap: '5px', marginTop: '5px' }}>
                     {Object.entries(item.micros).map(([name, val]) => (
                       <span key={name} style={{ fontSize: '0.8rem', background: '#f0f9ff', color: '#0369a1', padding: '2px 8px', borderRadius: '4px', border: '1px solid #bae6fd' }}>
-                        {name}: {val}
+                        {name}: {typeof val === 'object' && val !== null ? `${val.amount} ${val.unit}` : val}
                       </span>
                     ))}
                   </div>
@@ -152,22 +152,27 @@ const MealDetails = ({ meal, onClose, userId }) => {
 
 export default function MealHistory({ userId, lastUpdated }) {
   const [meals, setMeals] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(false);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [selectedMeal, setSelectedMeal] = useState(null);
 
   useEffect(() => {
     if (userId) fetchHistory();
   }, [userId, lastUpdated]);
 
-  const fetchHistory = async () => {
-    setLoading(true);
+  // ההיסטוריה מגיעה בדפים - cursor מצביע על הדף הבא
+  const fetchHistory = async (cursor = null) => {
+    cursor ? setLoadingMore(true) : setLoading(true);
     try {
-      const response = await axios.get(`${API_URL}/history/${userId}`);
-      setMeals(response.data);
+      const response = await axios.get(`${API_URL}/history/${userId}`, { params: cursor ? { cursor } : {} });
+      setMeals(prev => cursor ? [...prev, ...response.data.items] : response.data.items);
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       console.error("Error fetching history:", error);
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
@@ -193,6 +198,12 @@ export default function MealHistory({ userId, lastUpdated }) {
         ))}
       </div>
 
+      {nextCursor && (
+        <button className="load-more-button" onClick={() => fetchHistory(nextCursor)} disabled={loadingMore}>
+          {loadingMore ? 'טוען...' : 'טען ארוחות נוספות'}
+        </button>
+      )}
+
       {selectedMeal && (
         <MealDetails
           meal={selectedMeal}
@@ -10,7 +10,8 @@ const Sidebar = ({
     file,
     handleAnalyze,
     loading,
-    lastUpdated
+    lastUpdated,
+    liveItems = []
 }) => {
     return (
         <aside className="sidebar">
@@ -63,6 +64,18 @@ const Sidebar = ({
                         <><Zap size={18} /> Analyze Meal</>
                     )}
                 </button>
+
+                {/* פריטים שזוהו עד עכשיו בניתוח המוזרם */}
+                {liveItems.length > 0 && (
+                    <ul className="live-items">
+                        {liveItems.map((item, idx) => (
+                            <li key={idx}>
+                                {item.food_name}
+                                {item.estimated_weight_grams ? ` · ${item.estimated_weight_grams}g` : ''}
+                            </li>
+                        ))}
+                    </ul>
+                )}
             </div>
         </aside>
     );
@@ -1,11 +1,16 @@
 import psycopg2
+import argparse
+import json
 import os
+import re
 
-# פרטי ההתחברות ל-RDS שלך (העתקתי ממה ששלחת קודם)
-DB_HOST = "database-1.cmtkkqyiagdy.us-east-1.rds.amazonaws.com"
-DB_NAME = "postgres"
-DB_USER = "postgres"
-DB_PASS = "Karina1256"
+# פרטי ההתחברות ל-RDS שלך (העתקתי ממה ששלחת קודם) - ניתן לדרוס ב-Environment Variables
+DB_HOST = os.getenv("DB_HOST", "database-1.cmtkkqyiagdy.us-east-1.rds.amazonaws.com")
+DB_NAME = os.getenv("DB_NAME", "postgres")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASS = os.getenv("DB_PASS", "Karina1256")
+DB_PORT = int(os.getenv("DB_PORT", "5432"))
+DB_SSLMODE = os.getenv("DB_SSLMODE", "prefer")
 
 # הטבלאות שצריך ליצור
 CREATE_USERS_TABLE = """
@@ -52,6 +57,310 @@ CREATE TABLE IF NOT EXISTS consumed_micros (
 );
 """
 
+# סיכום יומי מצטבר לכל משתמש ורכיב - מתעדכן באותה טרנזקציה של שמירת הארוחה
+CREATE_DAILY_TOTALS_TABLE = """
+CREATE TABLE IF NOT EXISTS daily_nutrient_totals (
+    user_id INTEGER REFERENCES users(user_id),
+    day DATE NOT NULL,
+    nutrient_name VARCHAR(50) NOT NULL,
+    amount FLOAT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day, nutrient_name)
+);
+"""
+
+# טבלאות הייחוס שהקוד שולף מהן (reference_data / recommender_engine)
+CREATE_NUTRIENT_STANDARDS_TABLE = """
+CREATE TABLE IF NOT EXISTS nutrient_standards (
+    standard_id SERIAL PRIMARY KEY,
+    nutrient_name VARCHAR(50) NOT NULL,
+    gender VARCHAR(10) NOT NULL DEFAULT 'both',
+    min_age_months INTEGER NOT NULL DEFAULT 0,
+    max_age_months INTEGER NOT NULL DEFAULT 1500,
+    condition VARCHAR(20) NOT NULL DEFAULT 'normal',
+    daily_value FLOAT NOT NULL,
+    unit VARCHAR(10)
+);
+"""
+
+CREATE_RECOMMENDATION_FOODS_TABLE = """
+CREATE TABLE IF NOT EXISTS recommendation_foods (
+    food_id SERIAL PRIMARY KEY,
+    food_name VARCHAR(100) NOT NULL,
+    calories FLOAT NOT NULL DEFAULT 0,
+    serving_grams FLOAT NOT NULL DEFAULT 100,
+    tags TEXT,
+    vitamin_a_mcg FLOAT DEFAULT 0,
+    vitamin_c_mg FLOAT DEFAULT 0,
+    vitamin_d_mcg FLOAT DEFAULT 0,
+    vitamin_e_mg FLOAT DEFAULT 0,
+    vitamin_k_mcg FLOAT DEFAULT 0,
+    vitamin_b1_mg FLOAT DEFAULT 0,
+    vitamin_b2_mg FLOAT DEFAULT 0,
+    vitamin_b3_mg FLOAT DEFAULT 0,
+    vitamin_b6_mg FLOAT DEFAULT 0,
+    vitamin_b12_mcg FLOAT DEFAULT 0,
+    folate_mcg FLOAT DEFAULT 0,
+    calcium_mg FLOAT DEFAULT 0,
+    iron_mg FLOAT DEFAULT 0,
+    magnesium_mg FLOAT DEFAULT 0,
+    phosphorus_mg FLOAT DEFAULT 0,
+    potassium_mg FLOAT DEFAULT 0,
+    sodium_mg FLOAT DEFAULT 0,
+    zinc_mg FLOAT DEFAULT 0
+);
+"""
+
+# אינדקסים משניים - בלעדיהם כל JOIN ו-WHERE על user_id הם Sequential Scan
+CREATE_INDEXES = [
+    # היסטוריה, הארוחה האחרונה וסינון לפי טווח תאריכים
+    "CREATE INDEX IF NOT EXISTS idx_meals_user_created ON meals (user_id, created_at DESC);",
+    # JOIN של food_items -> meals ו-consumed_micros -> food_items
+    "CREATE INDEX IF NOT EXISTS idx_food_items_meal ON food_items (meal_id);",
+    "CREATE INDEX IF NOT EXISTS idx_consumed_micros_item ON consumed_micros (item_id);",
+    # סינון היעדים לפי פרופיל
+    "CREATE INDEX IF NOT EXISTS idx_nutrient_standards_profile ON nutrient_standards (condition, gender, min_age_months, max_age_months);",
+]
+
+# מילון הרכיבים הקנוני: מזהה קבוע, שם, היחידה שבה נשמרות כל הכמויות, העמודה המתאימה ב-recommendation_foods,
+# שמות נוספים שהמודל / טבלת היעדים משתמשים בהם, ומקדמי המרה מיוחדים (IU) ליחידה הקנונית
+NUTRIENT_DICTIONARY = [
+    (1, "Vitamin A", "mcg", "vitamin_a_mcg", ["Retinol", "Vit A", "Vitamin A RAE"], {"iu": 0.3}),
+    (2, "Vitamin C", "mg", "vitamin_c_mg", ["Ascorbic Acid", "Vit C"], {}),
+    (3, "Vitamin D", "mcg", "vitamin_d_mcg", ["Vitamin D3", "Cholecalciferol", "Vit D"], {"iu": 0.025}),
+    (4, "Vitamin E", "mg", "vitamin_e_mg", ["Alpha-Tocopherol", "Tocopherol", "Vit E"], {"iu": 0.67}),
+    (5, "Vitamin K", "mcg", "vitamin_k_mcg", ["Vitamin K1", "Phylloquinone", "Vit K"], {}),
+    (6, "Thiamin B1", "mg", "vitamin_b1_mg", ["Thiamin", "Thiamine", "Vitamin B1"], {}),
+    (7, "Riboflavin B2", "mg", "vitamin_b2_mg", ["Riboflavin", "Vitamin B2"], {}),
+    (8, "Niacin B3", "mg", "vitamin_b3_mg", ["Niacin", "Vitamin B3"], {}),
+    (9, "Vitamin B6", "mg", "vitamin_b6_mg", ["Pyridoxine", "B6"], {}),
+    (10, "Vitamin B12", "mcg", "vitamin_b12_mcg", ["Cobalamin", "B12"], {}),
+    (11, "Folate", "mcg", "folate_mcg", ["Folic Acid", "Vitamin B9", "Folate DFE"], {}),
+    (12, "Calcium", "mg", "calcium_mg", ["Ca"], {}),
+    (13, "Iron", "mg", "iron_mg", ["Fe"], {}),
+    (14, "Magnesium", "mg", "magnesium_mg", ["Mg"], {}),
+    (15, "Phosphorus", "mg", "phosphorus_mg", ["Phosphorous"], {}),
+    (16, "Potassium", "mg", "potassium_mg", ["K"], {}),
+    (17, "Sodium", "mg", "sodium_mg", ["Na", "Salt Sodium"], {}),
+    (18, "Zinc", "mg", "zinc_mg", ["Zn"], {}),
+    (19, "Copper", "mg", None, ["Cu"], {}),
+    (20, "Selenium", "mcg", None, ["Se"], {}),
+    (21, "Manganese", "mg", None, ["Mn"], {}),
+    (22, "Iodine", "mcg", None, ["Iodide"], {}),
+]
+
+# יחידות משקל ביחס לגרם - מהן נגזרים מקדמי ההמרה של כל רכיב (µg / μg נשמרים כ-ug).
+# unknown = מספר בלי יחידה - נחשב כיחידה הקנונית, כמו שהמודל מתבקש להחזיר
+MASS_UNITS = {"g": 1.0, "mg": 1e-3, "mcg": 1e-6, "ug": 1e-6}
+
+def nutrient_key(name):
+    """מפתח החיפוש של שם רכיב: אותיות קטנות וספרות בלבד ("Vitamin B-12" -> "vitaminb12")"""
+    return re.sub(r"[^a-z0-9]", "", str(name).lower())
+
+def _sql_literal(value):
+    if value is None:
+        return "NULL"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, list):
+        return "ARRAY[" + ", ".join(_sql_literal(item) for item in value) + "]::text[]"
+    return "'" + str(value).replace("'", "''") + "'"
+
+def seed_nutrients_sql():
+    """INSERT של המילון (מקדמי ההמרה נגזרים מ-MASS_UNITS) - גם עדכון של רכיב קיים"""
+    values = []
+    for nutrient_id, name, unit, food_column, aliases, extra_factors in NUTRIENT_DICTIONARY:
+        factors = {mass_unit: round(grams / MASS_UNITS[unit], 9) for mass_unit, grams in MASS_UNITS.items()}
+        factors.update(extra_factors)
+        factors["unknown"] = 1.0
+        keys = sorted({nutrient_key(alias) for alias in [name] + aliases})
+        row = [nutrient_id, name, unit, food_column, keys]
+        values.append("(" + ", ".join(_sql_literal(v) for v in row) + f", {_sql_literal(json.dumps(factors))}::jsonb)")
+    return """
+INSERT INTO nutrients (nutrient_id, name, unit, food_column, aliases, unit_factors)
+VALUES """ + ",\n       ".join(values) + """
+ON CONFLICT (nutrient_id) DO UPDATE SET name = EXCLUDED.name, unit = EXCLUDED.unit, food_column = EXCLUDED.food_column,
+    aliases = EXCLUDED.aliases, unit_factors = EXCLUDED.unit_factors;
+"""
+
+CREATE_NUTRIENTS_TABLE = """
+CREATE TABLE IF NOT EXISTS nutrients (
+    nutrient_id SMALLINT PRIMARY KEY,
+    name VARCHAR(50) NOT NULL UNIQUE,
+    unit VARCHAR(10) NOT NULL,
+    food_column VARCHAR(30),
+    aliases TEXT[] NOT NULL DEFAULT '{}',
+    unit_factors JSONB NOT NULL DEFAULT '{}'
+);
+"""
+
+# המפתח והיחידה של שורה קיימת כפי שהם נשמרו עד עכשיו (שם חופשי + יחידה חופשית) - לשימוש בהסבת הנתונים
+_NAME_KEY_SQL = "regexp_replace(lower({name}), '[^a-z0-9]', '', 'g')"
+# (µg / μg -> ug בלי תווים שאינם ASCII ב-SQL)
+_UNIT_KEY_SQL = "COALESCE(NULLIF(regexp_replace(lower({unit}), '^[^a-z]g$', 'ug'), ''), 'unknown')"
+
+# מיגרציה 6: מזהה רכיב מספרי וכמויות ביחידה הקנונית בכל הטבלאות.
+# שורות שהשם / היחידה שלהן לא מוכרים נשארות כמו שהן עם nutrient_id ריק - ולא נספרות בסיכומים.
+NUTRIENT_ID_MIGRATION = [
+    CREATE_NUTRIENTS_TABLE,
+    seed_nutrients_sql(),
+    "ALTER TABLE consumed_micros ADD COLUMN IF NOT EXISTS nutrient_id SMALLINT REFERENCES nutrients(nutrient_id);",
+    """
+    UPDATE consumed_micros cm
+    SET nutrient_id = n.nutrient_id,
+        nutrient_name = n.name,
+        amount = cm.amount * (n.unit_factors ->> {unit_key})::float,
+        unit = n.unit
+    FROM nutrients n
+    WHERE cm.nutrient_id IS NULL
+      AND {name_key} = ANY(n.aliases)
+      AND n.unit_factors ? {unit_key};
+    """.format(name_key=_NAME_KEY_SQL.format(name="cm.nutrient_name"), unit_key=_UNIT_KEY_SQL.format(unit="cm.unit")),
+    "ALTER TABLE nutrient_standards ADD COLUMN IF NOT EXISTS nutrient_id SMALLINT REFERENCES nutrients(nutrient_id);",
+    """
+    UPDATE nutrient_standards ns
+    SET nutrient_id = n.nutrient_id,
+        daily_value = ns.daily_value * (n.unit_factors ->> {unit_key})::float,
+        unit = n.unit
+    FROM nutrients n
+    WHERE ns.nutrient_id IS NULL
+      AND {name_key} = ANY(n.aliases)
+      AND n.unit_factors ? {unit_key};
+    """.format(name_key=_NAME_KEY_SQL.format(name="ns.nutrient_name"), unit_key=_UNIT_KEY_SQL.format(unit="ns.unit")),
+    # הסיכום היומי נבנה מחדש לפי nutrient_id (אפשר לשחזר אותו תמיד מ-consumed_micros)
+    "DROP TABLE IF EXISTS daily_nutrient_totals;",
+    """
+    CREATE TABLE daily_nutrient_totals (
+        user_id INTEGER REFERENCES users(user_id),
+        day DATE NOT NULL,
+        nutrient_id SMALLINT NOT NULL REFERENCES nutrients(nutrient_id),
+        amount FLOAT NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day, nutrient_id)
+    );
+    """,
+    """
+    INSERT INTO daily_nutrient_totals (user_id, day, nutrient_id, amount)
+    SELECT m.user_id, m.created_at::date, cm.nutrient_id, SUM(cm.amount)
+    FROM consumed_micros cm
+    JOIN food_items fi ON cm.item_id = fi.item_id
+    JOIN meals m ON fi.meal_id = m.meal_id
+    WHERE cm.nutrient_id IS NOT NULL
+    GROUP BY m.user_id, m.created_at::date, cm.nutrient_id;
+    """,
+]
+
+# תוצאות החישוב הלילי (batch_recommendations.py) - שורה לכל משתמש.
+# computed_at מול הארוחה האחרונה קובע אם התוצאה עדיין תקפה
+CREATE_USER_RECOMMENDATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS user_recommendations (
+    user_id INTEGER PRIMARY KEY REFERENCES users(user_id),
+    day DATE NOT NULL,
+    computed_at TIMESTAMP NOT NULL,
+    deficiencies JSONB NOT NULL,
+    recommendations JSONB NOT NULL
+);
+"""
+
+# סימן הגרסה של טבלאות הייחוס (ה-ReferenceCache ב-backend בודק אותו): טוקן אקראי חדש בכל שינוי בטבלה,
+# מ-trigger ברמת פקודה - כך שגם seed, מיגרציה ועריכה ידנית מעדכנים אותו. הטוקן אקראי ולא מונה,
+# כדי שאותו ערך לא יופיע בשתי סכמות / שני שרתים (הוא גם המפתח של העותק המשותף ב-Redis)
+REFERENCE_TABLES = ["nutrient_standards", "recommendation_foods", "nutrients"]
+
+REFERENCE_VERSION_MIGRATION = [
+    """
+    CREATE TABLE IF NOT EXISTS reference_version (
+        table_name TEXT PRIMARY KEY,
+        version TEXT NOT NULL,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+    """
+    CREATE OR REPLACE FUNCTION bump_reference_version() RETURNS trigger AS $$
+    BEGIN
+        EXECUTE format(
+            'INSERT INTO %I.reference_version (table_name, version, updated_at) VALUES ($1, $2, CURRENT_TIMESTAMP)
+             ON CONFLICT (table_name) DO UPDATE SET version = EXCLUDED.version, updated_at = EXCLUDED.updated_at',
+            TG_TABLE_SCHEMA)
+        USING TG_TABLE_NAME, md5(random()::text || clock_timestamp()::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+] + [
+    statement
+    for table in REFERENCE_TABLES
+    for statement in (
+        f"DROP TRIGGER IF EXISTS reference_version_bump ON {table};",
+        f"""CREATE TRIGGER reference_version_bump AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE PROCEDURE bump_reference_version();""",
+        f"""INSERT INTO reference_version (table_name, version) VALUES ('{table}', md5(random()::text || clock_timestamp()::text))
+            ON CONFLICT (table_name) DO NOTHING;""",
+    )
+]
+
+CREATE_SCHEMA_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    description TEXT NOT NULL,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+# רשימת המיגרציות לפי הסדר. מיגרציה שכבר רשומה ב-schema_version לא רצה שוב,
+# וכל הפקודות כתובות עם IF NOT EXISTS כך שגם DB קיים בלי schema_version מתעדכן בבטחה.
+# מיגרציה חדשה = רק להוסיף שורה בסוף עם המספר הבא.
+MIGRATIONS = [
+    (1, "base tables", [CREATE_USERS_TABLE, CREATE_MEALS_TABLE, CREATE_FOOD_ITEMS_TABLE, CREATE_MICROS_TABLE]),
+    (2, "reference tables", [CREATE_NUTRIENT_STANDARDS_TABLE, CREATE_RECOMMENDATION_FOODS_TABLE]),
+    (3, "daily nutrient totals rollup", [CREATE_DAILY_TOTALS_TABLE]),
+    (4, "secondary indexes", CREATE_INDEXES),
+    # keyset pagination של ההיסטוריה משווה (created_at, meal_id) - האינדקס צריך את שתי העמודות
+    (5, "history keyset index", [
+        "CREATE INDEX IF NOT EXISTS idx_meals_user_created_id ON meals (user_id, created_at DESC, meal_id DESC);",
+        "DROP INDEX IF EXISTS idx_meals_user_created;",
+    ]),
+    (6, "canonical nutrient dictionary", NUTRIENT_ID_MIGRATION),
+    (7, "precomputed recommendations", [CREATE_USER_RECOMMENDATIONS_TABLE]),
+    (8, "reference data version marker", REFERENCE_VERSION_MIGRATION),
+]
+
+def get_schema_version(cur):
+    cur.execute(CREATE_SCHEMA_VERSION_TABLE)
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version;")
+    return cur.fetchone()[0]
+
+def run_migrations(conn, target=None):
+    """מריץ את כל המיגרציות שעוד לא הורצו (עד target), כל אחת בטרנזקציה משלה"""
+    cur = conn.cursor()
+    current = get_schema_version(cur)
+    conn.commit()
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version <= current or (target is not None and version > target):
+            continue
+        print(f"🔨 Applying migration {version}: {description}")
+        try:
+            for statement in statements:
+                cur.execute(statement)
+            cur.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s);", (version, description))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    if not applied:
+        print(f"✅ Schema is up to date (version {current})")
+    return applied
+
+def connect():
+    return psycopg2.connect(
+        host=DB_HOST,
+        port=DB_PORT,
+        database=DB_NAME,
+        user=DB_USER,
+        password=DB_PASS,
+        sslmode=DB_SSLMODE
+    )
+
 # הנתונים שאנחנו רוצים להכניס
 INITIAL_USERS = [
     # שם, תאריך לידה, מגדר, הריון, הנקה
@@ -60,22 +369,13 @@ INITIAL_USERS = [
     ('Dana Pregnant', '1995-03-15', 'female', True, False)
 ]
 
-def init_db():
+def init_db(target=None):
     try:
         print(f"🔌 Connecting to AWS RDS: {DB_HOST}...")
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS
-        )
+        conn = connect()
         cur = conn.cursor()
 
-        print("🔨 Creating tables if not exist...")
-        cur.execute(CREATE_USERS_TABLE)
-        cur.execute(CREATE_MEALS_TABLE)
-        cur.execute(CREATE_FOOD_ITEMS_TABLE)
-        cur.execute(CREATE_MICROS_TABLE)
+        run_migrations(conn, target)
         
         print("🌱 Seeding initial users...")
         for user in INITIAL_USERS:
@@ -99,4 +399,12 @@ def init_db():
         print(f"❌ Error: {e}")
 
 if __name__ == "__main__":
-    init_db()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Create / migrate the database schema")
+    parser.add_argument("--target", type=int, help="migrate only up to this schema version")
+    parser.add_argument("--status", action="store_true", help="print the current schema version and exit")
+    args = parser.parse_args()
+    if args.status:
+        with connect() as status_conn:
+            print(f"Schema version: {get_schema_version(status_conn.cursor())} (latest: {MIGRATIONS[-1][0]})")
+    else:
+        init_db(args.target)